@@ -25,6 +25,8 @@ GO
 PRINT '--- 2. Limpando todas as tabelas ---';
 DELETE FROM ComposicaoFundo;
 DELETE FROM HistoricoPreco;
+DELETE FROM PrecoAtual;
+DELETE FROM EstatisticaProduto;
 DELETE FROM ClienteGrupoLink;
 DELETE FROM AuditoriaCompliance;
 DELETE FROM RespostaSuitabilityCliente;
@@ -33,6 +35,7 @@ DELETE FROM Pergunta;
 DELETE FROM QuestionarioSuitabilityVersao;
 DELETE FROM Ordem;
 DELETE FROM Posicao;
+DELETE FROM SnapshotPortfolio;
 DELETE FROM Portfolio;
 DELETE FROM MovimentacaoConta;
 DELETE FROM Conta;
@@ -43,6 +46,9 @@ DELETE FROM Produto_Acao;
 DELETE FROM Produto_RendaFixa;
 DELETE FROM Produto_Fundo;
 DELETE FROM ProdutoFinanceiro;
+-- VersaoRecurso no  limpa: os IDs recomeam do 1, e verses zeradas repetiriam ETags j
+-- entregues aos clientes. Todas avanam para que nenhum 304 sirva dados de antes do reset.
+UPDATE VersaoRecurso SET Versao = Versao + 1;
 GO
 
 /*
@@ -125,6 +131,17 @@ VALUES
 (3, GETDATE(), 38.50);   -- Petrobras
 GO
 
+-- ltimo preo de cada produto (o que `flask precos reconstruir-atual` faz)
+INSERT INTO PrecoAtual (ProdutoID, Data, PrecoFechamento)
+SELECT H.ProdutoID, H.Data, H.PrecoFechamento
+FROM HistoricoPreco H
+INNER JOIN (
+    SELECT ProdutoID, MAX(Data) AS Data
+    FROM HistoricoPreco
+    GROUP BY ProdutoID
+) Ultimo ON Ultimo.ProdutoID = H.ProdutoID AND Ultimo.Data = H.Data;
+GO
+
 -- 4.4. Questionrio de Suitability
 PRINT 'Inserindo Questionrio...';
 
@@ -11,9 +11,14 @@ BEGIN
     DECLARE @Perfil VARCHAR(50);
     IF @PontuacaoTotal IS NULL RETURN 'Indefinido';
 
-    IF @PontuacaoTotal < 50 SET @Perfil = 'Conservador';
-    ELSE IF @PontuacaoTotal <= 80 SET @Perfil = 'Moderado';
-    ELSE SET @Perfil = 'Agressivo';
+    -- Faixas em FaixaPerfilRisco (as mesmas usadas pela API); abaixo da primeira faixa, o perfil dela
+    SELECT TOP 1 @Perfil = PerfilCalculado
+    FROM FaixaPerfilRisco
+    WHERE PontuacaoMinima <= @PontuacaoTotal
+    ORDER BY PontuacaoMinima DESC;
+
+    IF @Perfil IS NULL
+        SELECT TOP 1 @Perfil = PerfilCalculado FROM FaixaPerfilRisco ORDER BY PontuacaoMinima;
 
     RETURN @Perfil;
 END;
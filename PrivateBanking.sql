@@ -30,6 +30,19 @@ CREATE TABLE Cliente (
 );
 GO
 
+ALTER TABLE Cliente
+ADD SenhaHash VARCHAR(128) NULL;
+GO
+
+-- Login (/unified-login e /portal/login): e-mail -> (ID, SenhaHash) numa busca só pelo índice,
+-- nas duas partes do UNION ALL que resolve o papel do usuário
+-- (não únicos: a unicidade já vem da UNIQUE da coluna Email)
+CREATE INDEX IX_Assessor_Email_Login ON Assessor (Email) INCLUDE (SenhaHash);
+GO
+
+CREATE INDEX IX_Cliente_Email_Login ON Cliente (Email) INCLUDE (SenhaHash);
+GO
+
 CREATE TABLE GrupoEconomico (
     GrupoID INT IDENTITY(1,1) PRIMARY KEY,
     NomeGrupo VARCHAR(255) NOT NULL,
@@ -100,6 +113,20 @@ CREATE TABLE RespostaSuitabilityCliente (
 );
 GO
 
+-- Faixas de pontuação do suitability: o perfil é o da faixa de maior PontuacaoMinima <= PontuacaoTotal.
+-- Lidas pela API, por fn_CalcularPerfilRisco e pela reclassificação em lote (flask suitability reclassificar).
+CREATE TABLE FaixaPerfilRisco (
+    PontuacaoMinima INT NOT NULL PRIMARY KEY,
+    PerfilCalculado VARCHAR(50) NOT NULL UNIQUE
+);
+GO
+
+INSERT INTO FaixaPerfilRisco (PontuacaoMinima, PerfilCalculado) VALUES
+    (0, 'Conservador'),
+    (50, 'Moderado'),
+    (81, 'Agressivo');
+GO
+
 -- DOM�NIO 3: Produtos Financeiros (EER e Recursivo)
 
 CREATE TABLE ProdutoFinanceiro (
@@ -152,6 +179,36 @@ CREATE TABLE HistoricoPreco (
 );
 GO
 
+-- Snapshot do preço mais recente por produto (mantido pela aplicação a cada inserção em HistoricoPreco).
+-- Para popular um banco existente: flask precos reconstruir-atual
+CREATE TABLE PrecoAtual (
+    ProdutoID INT PRIMARY KEY,
+    Data DATE NOT NULL,
+    PrecoFechamento DECIMAL(18, 8) NOT NULL,
+    CONSTRAINT FK_PrecoAtual_Produto FOREIGN KEY (ProdutoID) REFERENCES ProdutoFinanceiro(ProdutoID) ON DELETE CASCADE ON UPDATE CASCADE
+);
+GO
+
+-- Estatísticas de risco/retorno por produto, avançadas a cada novo preço (services/product_stats.py)
+CREATE TABLE EstatisticaProduto (
+    ProdutoID INT PRIMARY KEY,
+    DataUltimoPreco DATE NOT NULL,
+    UltimoPreco DECIMAL(18, 8) NOT NULL,
+    PrecoMaximo DECIMAL(18, 8) NOT NULL,
+    DrawdownMaximo FLOAT NOT NULL DEFAULT 0,
+    NumeroRetornos INT NOT NULL DEFAULT 0,
+    MediaRetorno FLOAT NOT NULL DEFAULT 0,
+    M2Retorno FLOAT NOT NULL DEFAULT 0,
+    NumeroPares INT NOT NULL DEFAULT 0,
+    MediaPar FLOAT NOT NULL DEFAULT 0,
+    MediaReferencia FLOAT NOT NULL DEFAULT 0,
+    M2Par FLOAT NOT NULL DEFAULT 0,
+    M2Referencia FLOAT NOT NULL DEFAULT 0,
+    CoMomento FLOAT NOT NULL DEFAULT 0,
+    CONSTRAINT FK_EstatisticaProduto_Produto FOREIGN KEY (ProdutoID) REFERENCES ProdutoFinanceiro(ProdutoID) ON DELETE CASCADE ON UPDATE CASCADE
+);
+GO
+
 CREATE TABLE ComposicaoFundo (
     FundoProdutoID INT NOT NULL,
     AtivoComponenteID INT NOT NULL,
@@ -200,6 +257,16 @@ CREATE TABLE MovimentacaoConta (
 );
 GO
 
+-- Extrato por conta (GET /contas/<id>/extrato): uma busca ordenada por papel da conta,
+-- cobrindo as colunas do extrato para não voltar à tabela
+CREATE INDEX IX_Mov_ContaOrigem_DataHora ON MovimentacaoConta (ContaOrigemID, DataHora, MovimentacaoID)
+    INCLUDE (ContaDestinoID, TipoMovimentacao, Valor, Status);
+GO
+
+CREATE INDEX IX_Mov_ContaDestino_DataHora ON MovimentacaoConta (ContaDestinoID, DataHora, MovimentacaoID)
+    INCLUDE (ContaOrigemID, TipoMovimentacao, Valor, Status);
+GO
+
 CREATE TABLE Ordem (
     OrdemID BIGINT IDENTITY(1,1) PRIMARY KEY,
     PortfolioID INT NOT NULL,
@@ -216,6 +283,11 @@ CREATE TABLE Ordem (
 );
 GO
 
+-- Desempenho da carteira (GET /portfolios/<id>/desempenho): ordens da carteira em ordem de execução
+CREATE INDEX IX_Ordem_Portfolio_DataExecucao ON Ordem (PortfolioID, DataExecucao, OrdemID)
+    INCLUDE (ProdutoID, TipoOrdem, Quantidade, PrecoUnitario, StatusOrdem);
+GO
+
 CREATE TABLE Posicao (
     PosicaoID INT IDENTITY(1,1) PRIMARY KEY,
     PortfolioID INT NOT NULL,
@@ -228,6 +300,28 @@ CREATE TABLE Posicao (
 );
 GO
 
+-- Valor de fechamento diário de cada carteira (gerado por: flask carteiras marcar-mercado)
+CREATE TABLE SnapshotPortfolio (
+    PortfolioID INT NOT NULL,
+    DataReferencia DATE NOT NULL,
+    ValorMercado DECIMAL(18, 2) NOT NULL,
+    CustoTotal DECIMAL(18, 2) NOT NULL,
+    ResultadoFinanceiro DECIMAL(18, 2) NOT NULL,
+    QuantidadePosicoes INT NOT NULL,
+    DataCalculo DATETIME NOT NULL DEFAULT GETDATE(),
+    PRIMARY KEY (PortfolioID, DataReferencia),
+    CONSTRAINT FK_Snapshot_Portfolio FOREIGN KEY (PortfolioID) REFERENCES Portfolio(PortfolioID) ON DELETE CASCADE ON UPDATE CASCADE
+);
+GO
+
+-- Contadores de alteração usados nos ETags da API ('conta:<id>', 'portfolio:<id>', 'catalogo', 'snapshots'),
+-- incrementados na mesma transação das escritas (backend/app/services/versioning.py e sp_ExecutarOrdem)
+CREATE TABLE VersaoRecurso (
+    Recurso VARCHAR(50) PRIMARY KEY,
+    Versao BIGINT NOT NULL DEFAULT 0
+);
+GO
+
 -- TRIGGER de Auditoria
 
 CREATE TRIGGER trg_Cliente_Compliance_Audit
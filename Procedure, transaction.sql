@@ -9,131 +9,187 @@ CREATE PROCEDURE sp_ExecutarOrdem (
     @ProdutoID INT,
     @TipoOrdem VARCHAR(10), -- 'Compra' ou 'Venda'
     @Quantidade DECIMAL(18, 8),
-    @PrecoUnitario DECIMAL(18, 2),
-    @AssessorID INT -- ID do assessor que est a executar (para auditoria futura, no usado agora)
+    @PrecoUnitario DECIMAL(18, 8), -- Mesma preciso usada pela API no clculo do valor e da tolerncia
+    @UsuarioID INT = NULL, -- ID do usurio logado (assessor ou cliente)
+    @Role VARCHAR(20) = NULL -- 'assessor' ou 'cliente'; NULL dispensa a verificao de acesso (uso interno)
 )
 AS
+-- Retorna sempre uma linha (Codigo, OrdemID, Texto, Numero, Risco).
+-- Codigo 0 = ordem executada; 1..9 = ordem recusada pela regra correspondente (nada  gravado):
+--   1 portflio no encontrado/no autorizado   2 compliance (Texto = StatusCompliance)
+--   3 produto no encontrado                    4 preo defasado (Numero = preo atual)
+--   5 cliente sem suitability                   6 produto incompatvel (Texto = perfil, Risco)
+--   7 cliente sem conta                         8 saldo insuficiente (Numero = saldo)
+--   9 quantidade insuficiente (Numero = quantidade disponvel)
+-- Erros inesperados so relanados com THROW.
 BEGIN
     SET NOCOUNT ON; -- Evita mensagens "X rows affected"
     DECLARE @ClienteID INT;
     DECLARE @ContaID INT;
-    DECLARE @SaldoAtual DECIMAL(18, 2);
     DECLARE @ValorTotalOrdem DECIMAL(18, 2) = @Quantidade * @PrecoUnitario;
     DECLARE @MovimentacaoID BIGINT;
-    DECLARE @PosicaoQuantidadeAtual DECIMAL(18, 8);
-    DECLARE @PosicaoCustoMedioAtual DECIMAL(18, 2);
-    DECLARE @Erro VARCHAR(500) = NULL;
-
-    -- Inicia a transao
-    BEGIN TRANSACTION;
+    DECLARE @OrdemID BIGINT;
+    DECLARE @StatusCompliance VARCHAR(50);
+    DECLARE @PrecoAtual DECIMAL(18, 8);
+    DECLARE @RiscoProduto INT;
+    DECLARE @Perfil VARCHAR(50);
+    DECLARE @Codigo INT = 0;
+    DECLARE @Texto VARCHAR(50) = NULL;
+    DECLARE @Numero DECIMAL(18, 8) = NULL;
+    DECLARE @TranCount INT = @@TRANCOUNT;
+
+    -- Participa da transao de quem chamou (a API abre uma) usando um savepoint
+    IF @TranCount = 0
+        BEGIN TRANSACTION;
+    ELSE
+        SAVE TRANSACTION sp_ExecutarOrdem;
 
     BEGIN TRY
-        -- Validaes (Simplificadas - Suitability e outras deveriam estar aqui)
-        SELECT @ClienteID = ClienteID FROM Portfolio WHERE PortfolioID = @PortfolioID;
-        IF @ClienteID IS NULL 
-        BEGIN 
-            SET @Erro = 'Portflio no encontrado.'; 
-            RAISERROR(@Erro, 16, 1); 
+        -- 1. Acesso ao portflio e status de compliance do cliente
+        SELECT @ClienteID = p.ClienteID, @StatusCompliance = c.StatusCompliance
+        FROM Portfolio p
+        JOIN Cliente c ON c.ClienteID = p.ClienteID
+        WHERE p.PortfolioID = @PortfolioID
+          AND (@Role IS NULL
+               OR (@Role = 'assessor' AND c.AssessorID = @UsuarioID)
+               OR (@Role = 'cliente' AND p.ClienteID = @UsuarioID));
+        IF @ClienteID IS NULL
+        BEGIN
+            SET @Codigo = 1; THROW 50001, 'Portflio no encontrado ou no autorizado.', 1;
+        END;
+
+        IF @StatusCompliance IS NULL OR @StatusCompliance <> 'Aprovado'
+        BEGIN
+            SET @Codigo = 2; SET @Texto = @StatusCompliance;
+            THROW 50002, 'Cliente no aprovado pelo compliance.', 1;
         END;
 
-        SELECT @ContaID = ContaID, @SaldoAtual = Saldo FROM Conta WHERE ClienteID = @ClienteID; -- Assume conta nica
-        IF @ContaID IS NULL 
-        BEGIN 
-            SET @Erro = 'Conta no encontrada para o cliente.'; 
-            RAISERROR(@Erro, 16, 1); 
+        -- 2. Produto e tolerncia de 5% sobre o ltimo preo (PrecoAtual)
+        SELECT @RiscoProduto = ISNULL(prod.NivelRiscoProduto, 3), @PrecoAtual = pa.PrecoFechamento
+        FROM ProdutoFinanceiro prod
+        LEFT JOIN PrecoAtual pa ON pa.ProdutoID = prod.ProdutoID
+        WHERE prod.ProdutoID = @ProdutoID;
+        IF @RiscoProduto IS NULL
+        BEGIN
+            SET @Codigo = 3; THROW 50003, 'Produto no encontrado.', 1;
+        END;
+
+        IF @PrecoAtual IS NOT NULL AND ABS(@PrecoAtual - @PrecoUnitario) > @PrecoAtual * 0.05
+        BEGIN
+            SET @Codigo = 4; SET @Numero = @PrecoAtual;
+            THROW 50004, 'Preo defasado.', 1;
         END;
 
+        -- 3. Suitability: perfil da resposta mais recente
+        SELECT TOP 1 @Perfil = PerfilCalculado
+        FROM RespostaSuitabilityCliente
+        WHERE ClienteID = @ClienteID
+        ORDER BY DataResposta DESC;
+        IF @Perfil IS NULL
+        BEGIN
+            SET @Codigo = 5; THROW 50005, 'Cliente sem perfil de suitability.', 1;
+        END;
+
+        IF NOT ((@Perfil = 'Conservador' AND @RiscoProduto <= 2)
+             OR (@Perfil = 'Moderado' AND @RiscoProduto <= 4)
+             OR @Perfil = 'Agressivo')
+        BEGIN
+            SET @Codigo = 6; SET @Texto = @Perfil;
+            THROW 50006, 'Produto incompatvel com o perfil.', 1;
+        END;
+
+        SELECT @ContaID = ContaID FROM Conta WHERE ClienteID = @ClienteID; -- Assume conta nica
+        IF @ContaID IS NULL
+        BEGIN
+            SET @Codigo = 7; THROW 50007, 'Conta no encontrada para o cliente.', 1;
+        END;
+
+        -- 4. Liquidao com UPDATEs condicionais (Conta antes de Posicao, como na API)
         IF @TipoOrdem = 'Compra'
         BEGIN
-            IF @SaldoAtual < @ValorTotalOrdem 
-            BEGIN 
-                SET @Erro = 'Saldo insuficiente.'; 
-                RAISERROR(@Erro, 16, 1); 
+            UPDATE Conta SET Saldo = Saldo - @ValorTotalOrdem
+            WHERE ContaID = @ContaID AND Saldo >= @ValorTotalOrdem;
+            IF @@ROWCOUNT = 0
+            BEGIN
+                SET @Codigo = 8;
+                SELECT @Numero = Saldo FROM Conta WHERE ContaID = @ContaID;
+                THROW 50008, 'Saldo insuficiente.', 1;
             END;
 
-            -- Atualiza Saldo
-            UPDATE Conta SET Saldo = Saldo - @ValorTotalOrdem WHERE ContaID = @ContaID;
-
-            -- Regista Movimentao
             INSERT INTO MovimentacaoConta (ContaOrigemID, TipoMovimentacao, Valor)
             VALUES (@ContaID, 'Aplicacao', @ValorTotalOrdem);
             SET @MovimentacaoID = SCOPE_IDENTITY();
 
-            -- Atualiza/Insere Posio
-            SELECT @PosicaoQuantidadeAtual = Quantidade, @PosicaoCustoMedioAtual = CustoMedio 
-            FROM Posicao WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID;
+            -- Upsert da posio: o SERIALIZABLE segura a faixa da chave at o INSERT
+            UPDATE Posicao WITH (UPDLOCK, SERIALIZABLE)
+            SET CustoMedio = ((Quantidade * CustoMedio) + @ValorTotalOrdem) / (Quantidade + @Quantidade),
+                Quantidade = Quantidade + @Quantidade
+            WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID;
 
-            IF @@ROWCOUNT > 0 -- Posio existe
-            BEGIN
-                DECLARE @NovoCustoMedio DECIMAL(18, 2) = ((@PosicaoQuantidadeAtual * @PosicaoCustoMedioAtual) + @ValorTotalOrdem) / (@PosicaoQuantidadeAtual + @Quantidade);
-                UPDATE Posicao 
-                SET Quantidade = Quantidade + @Quantidade, CustoMedio = @NovoCustoMedio
-                WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID;
-            END
-            ELSE -- Posio no existe
-            BEGIN
+            IF @@ROWCOUNT = 0
                 INSERT INTO Posicao (PortfolioID, ProdutoID, Quantidade, CustoMedio)
                 VALUES (@PortfolioID, @ProdutoID, @Quantidade, @PrecoUnitario);
-            END
         END
         ELSE IF @TipoOrdem = 'Venda'
         BEGIN
-            SELECT @PosicaoQuantidadeAtual = Quantidade 
-            FROM Posicao WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID;
+            UPDATE Conta SET Saldo = Saldo + @ValorTotalOrdem WHERE ContaID = @ContaID;
 
-            IF @@ROWCOUNT = 0 OR @PosicaoQuantidadeAtual < @Quantidade
+            UPDATE Posicao SET Quantidade = Quantidade - @Quantidade
+            WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID AND Quantidade >= @Quantidade;
+            IF @@ROWCOUNT = 0
             BEGIN
-                SET @Erro = 'Quantidade insuficiente para venda.'; 
-                RAISERROR(@Erro, 16, 1); 
+                SET @Codigo = 9;
+                SELECT @Numero = Quantidade FROM Posicao WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID;
+                THROW 50009, 'Quantidade insuficiente para venda.', 1;
             END;
 
-            -- Atualiza Saldo
-            UPDATE Conta SET Saldo = Saldo + @ValorTotalOrdem WHERE ContaID = @ContaID;
+            -- Remove a posio zerada
+            DELETE FROM Posicao WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID AND Quantidade = 0;
 
-            -- Regista Movimentao
             INSERT INTO MovimentacaoConta (ContaDestinoID, TipoMovimentacao, Valor)
             VALUES (@ContaID, 'Resgate', @ValorTotalOrdem);
             SET @MovimentacaoID = SCOPE_IDENTITY();
-
-            -- Atualiza Posio
-            UPDATE Posicao SET Quantidade = Quantidade - @Quantidade
-            WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID;
-
-            -- Opcional: Remover posio se quantidade for zero
-            IF (@PosicaoQuantidadeAtual - @Quantidade) = 0
-                DELETE FROM Posicao WHERE PortfolioID = @PortfolioID AND ProdutoID = @ProdutoID;
         END
         ELSE
         BEGIN
-            SET @Erro = 'Tipo de Ordem invlido.'; 
-            RAISERROR(@Erro, 16, 1); 
+            THROW 50010, 'Tipo de Ordem invlido.', 1;
         END;
 
         -- Regista a Ordem
         INSERT INTO Ordem (PortfolioID, ProdutoID, MovimentacaoID_Liquidacao, TipoOrdem, Quantidade, PrecoUnitario)
         VALUES (@PortfolioID, @ProdutoID, @MovimentacaoID, @TipoOrdem, @Quantidade, @PrecoUnitario);
+        SET @OrdemID = SCOPE_IDENTITY();
 
-        -- Se chegou aqui, tudo OK
-        COMMIT TRANSACTION;
-        PRINT 'Ordem executada com sucesso.';
+        -- Versoes lidas pelos ETags da API (VersaoRecurso): conta e carteira alteradas
+        UPDATE VersaoRecurso SET Versao = Versao + 1
+        WHERE Recurso IN ('conta:' + CAST(@ContaID AS VARCHAR(20)), 'portfolio:' + CAST(@PortfolioID AS VARCHAR(20)));
+        INSERT INTO VersaoRecurso (Recurso, Versao)
+        SELECT r.Recurso, 1
+        FROM (VALUES ('conta:' + CAST(@ContaID AS VARCHAR(20))), ('portfolio:' + CAST(@PortfolioID AS VARCHAR(20)))) AS r(Recurso)
+        WHERE NOT EXISTS (SELECT 1 FROM VersaoRecurso v WITH (UPDLOCK, HOLDLOCK) WHERE v.Recurso = r.Recurso);
 
+        -- Se chegou aqui, tudo OK
+        IF @TranCount = 0
+            COMMIT TRANSACTION;
     END TRY
     BEGIN CATCH
-        -- Se deu erro, desfaz tudo
-        IF @@TRANCOUNT > 0
+        -- Se deu erro, desfaz tudo o que a procedure fez
+        IF XACT_STATE() = -1 OR (XACT_STATE() = 1 AND @TranCount = 0)
             ROLLBACK TRANSACTION;
+        ELSE IF XACT_STATE() = 1
+            ROLLBACK TRANSACTION sp_ExecutarOrdem;
 
-        -- Regista ou retorna o erro
-        SET @Erro = ERROR_MESSAGE();
-        PRINT 'Erro ao executar ordem: ' + @Erro;
-        -- Re-lana o erro para a aplicao saber que falhou
-        RAISERROR(@Erro, 16, 1); 
+        -- Recusas de negcio viram o cdigo de retorno; o resto  relanado para a aplicao
+        IF @Codigo = 0
+            THROW;
     END CATCH
+
+    SELECT @Codigo AS Codigo, @OrdemID AS OrdemID, @Texto AS Texto, @Numero AS Numero, @RiscoProduto AS Risco;
 END;
 GO
 
 PRINT 'Stored Procedure sp_ExecutarOrdem criada/atualizada com sucesso.';
 GO
 
-EXEC sp_ExecutarOrdem @PortfolioID=2, @ProdutoID=1, @TipoOrdem='Compra', @Quantidade=5, @PrecoUnitario=30, @AssessorID=1;
+EXEC sp_ExecutarOrdem @PortfolioID=2, @ProdutoID=1, @TipoOrdem='Compra', @Quantidade=5, @PrecoUnitario=30, @UsuarioID=1, @Role='assessor';
 GO
\ No newline at end of file
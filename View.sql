@@ -25,10 +25,8 @@ JOIN
     Posicao pos ON p.PortfolioID = pos.PortfolioID
 JOIN 
     ProdutoFinanceiro prod ON pos.ProdutoID = prod.ProdutoID
-LEFT JOIN (
-    SELECT ProdutoID, PrecoFechamento, ROW_NUMBER() OVER(PARTITION BY ProdutoID ORDER BY Data DESC) as rn
-    FROM HistoricoPreco
-) hp ON prod.ProdutoID = hp.ProdutoID AND hp.rn = 1
+LEFT JOIN 
+    PrecoAtual hp ON prod.ProdutoID = hp.ProdutoID
 GO
 
 PRINT 'View vw_CarteiraDetalhadaCliente criada/atualizada com sucesso.';
@@ -17,12 +17,29 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
-    CORS(app)
+    CORS(app, expose_headers=['X-Next-Cursor', 'Link', 'ETag'])
     db.init_app(app)
     ma.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
 
+    from app.services.pricing import price_cache
+    price_cache.init_app(app)
+    from app.services.trading_context import trading_context
+    trading_context.init_app(app)
+    from app.services.performance import performance_cache
+    performance_cache.init_app(app)
+    from app.services.scenarios import scenario_models
+    scenario_models.init_app(app)
+    from app.services.lookthrough import expansoes_fundos
+    expansoes_fundos.init_app(app)
+    from app.services.passwords import password_verifier
+    password_verifier.init_app(app)
+    from app.services.client_claims import claim_revocations
+    claim_revocations.init_app(app)
+    from app.services.questionnaire import questionnaire_cache
+    questionnaire_cache.init_app(app)
+
     # Importação das rotas
     from app.routes import (
         auth_routes,
@@ -32,7 +49,8 @@ def create_app():
         order_routes,
         suitability_routes,
         client_portal_routes,
-        grupo_routes
+        grupo_routes,
+        conta_routes
     )
 
     # Registo das Blueprints
@@ -44,5 +62,12 @@ def create_app():
     app.register_blueprint(suitability_routes.bp)
     app.register_blueprint(client_portal_routes.bp)
     app.register_blueprint(grupo_routes.bp, url_prefix='/api/grupos')
+    app.register_blueprint(conta_routes.bp)
+
+    # Comandos de linha (flask <grupo> <comando>)
+    from app.commands import precos_cli, carteiras_cli, suitability_cli
+    app.cli.add_command(precos_cli)
+    app.cli.add_command(carteiras_cli)
+    app.cli.add_command(suitability_cli)
 
     return app
\ No newline at end of file
@@ -0,0 +1,110 @@
+import time
+from datetime import date
+import click
+from flask.cli import AppGroup
+from app import db
+from app.services.pricing import price_cache, recalcular_precos_atuais
+from app.services.product_stats import recalcular_estatisticas
+from app.services.versioning import CATALOGO, incrementar_versoes
+from app.services.price_ingest import (
+    FORMATOS, TAMANHO_LOTE_PADRAO, ConflitoIngestaoError, PriceIngestor, iter_registros
+)
+from app.services.valuation import TAMANHO_LOTE_MARCACAO, avaliar_todos_portfolios, gravar_snapshots
+from app.services.risk_profile import TAMANHO_LOTE_RECLASSIFICACAO, reclassificar_respostas
+
+precos_cli = AppGroup('precos', help='Rotinas de manutenção de preços (HistoricoPreco / PrecoAtual / EstatisticaProduto).')
+carteiras_cli = AppGroup('carteiras', help='Rotinas de valorização das carteiras (SnapshotPortfolio).')
+suitability_cli = AppGroup('suitability', help='Rotinas de suitability (FaixaPerfilRisco / RespostaSuitabilityCliente).')
+
+
+@precos_cli.command('reconstruir-atual')
+def reconstruir_preco_atual():
+    """Recalcula a tabela PrecoAtual a partir de todo o HistoricoPreco."""
+    total = recalcular_precos_atuais(db.session.connection())
+    incrementar_versoes(db.session.connection(), [CATALOGO])
+    db.session.commit()
+    price_cache.invalidate()
+    click.echo(f"✅ PrecoAtual reconstruído para {total} produtos.")
+
+
+@precos_cli.command('reconstruir-estatisticas')
+def reconstruir_estatisticas():
+    """Recalcula EstatisticaProduto a partir de todo o HistoricoPreco."""
+    total = recalcular_estatisticas(db.session.connection())
+    incrementar_versoes(db.session.connection(), [CATALOGO])
+    db.session.commit()
+    click.echo(f"✅ EstatisticaProduto reconstruída para {total} produtos.")
+
+
+@precos_cli.command('importar')
+@click.argument('arquivo', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--formato', type=click.Choice(FORMATOS), default=None,
+              help='csv ou jsonl (padrão: deduzido pela extensão do arquivo).')
+@click.option('--lote', type=click.IntRange(min=1), default=TAMANHO_LOTE_PADRAO, show_default=True,
+              help='Registros por transação.')
+@click.option('--delimitador', default=',', show_default=True, help='Separador de colunas do CSV.')
+def importar_precos(arquivo, formato, lote, delimitador):
+    """Importa preços de fechamento (CSV ou JSON Lines) para o HistoricoPreco. Use '-' para stdin."""
+    if formato is None:
+        formato = 'csv' if arquivo.name.lower().endswith('.csv') else 'jsonl'
+
+    conflito = None
+    try:
+        resumo = PriceIngestor(lote).ingerir(iter_registros(arquivo, formato, delimitador))
+    except ConflitoIngestaoError as e:
+        # Lotes anteriores ao conflito foram gravados: mostra o resumo parcial e sai com erro
+        resumo, conflito = e.resumo, e
+
+    for erro in resumo['erros']:
+        click.echo(f"❌ {erro}", err=True)
+    click.echo(
+        f"✅ {resumo['linhas_lidas']} linhas lidas: {resumo['inseridos']} inseridas, "
+        f"{resumo['atualizados']} atualizadas, {resumo['inalterados']} inalteradas, "
+        f"{resumo['rejeitados']} rejeitadas em {resumo['duracao_segundos']}s "
+        f"({resumo['linhas_por_segundo']} linhas/s)."
+    )
+    if conflito is not None:
+        raise click.ClickException(str(conflito))
+
+
+@carteiras_cli.command('marcar-mercado')
+@click.option('--data', 'data_referencia', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Data de referência AAAA-MM-DD (padrão: hoje). Usa o último fechamento até a data.')
+@click.option('--lote', type=click.IntRange(min=1), default=TAMANHO_LOTE_MARCACAO, show_default=True,
+              help='Posições lidas e calculadas por bloco.')
+@click.option('--processos', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Processos para calcular os blocos em paralelo.')
+def marcar_mercado(data_referencia, lote, processos):
+    """Valoriza todas as carteiras no fechamento e grava o SnapshotPortfolio do dia (rotina noturna)."""
+    data = data_referencia.date() if data_referencia else date.today()
+    inicio = time.perf_counter()
+
+    totais = avaliar_todos_portfolios(data, lote, processos)
+    gravados = gravar_snapshots(data, totais)
+    db.session.commit()
+
+    posicoes = sum(t[2] for t in totais.values())
+    click.echo(
+        f"✅ {gravados} carteiras ({posicoes} posições) marcadas a mercado em {data.isoformat()} "
+        f"em {time.perf_counter() - inicio:.2f}s."
+    )
+
+
+@suitability_cli.command('reclassificar')
+@click.option('--lote', type=click.IntRange(min=1), default=TAMANHO_LOTE_RECLASSIFICACAO, show_default=True,
+              help='Respostas por transação.')
+@click.option('--simular', is_flag=True, help='Só calcula o resumo, sem gravar.')
+def reclassificar_perfis(lote, simular):
+    """Recalcula o PerfilCalculado de todas as respostas com as faixas atuais de FaixaPerfilRisco."""
+    resumo = reclassificar_respostas(lote, simular)
+
+    faixas = ", ".join(f"{f['PerfilCalculado']} >= {f['PontuacaoMinima']}" for f in resumo['faixas'])
+    click.echo(f"Faixas: {faixas}")
+    for transicao in resumo['transicoes']:
+        click.echo(f"   {transicao['de']} -> {transicao['para']}: {transicao['respostas']} respostas")
+    click.echo(
+        f"{'🔎 Simulação: ' if simular else '✅ '}{resumo['respostas_lidas']} respostas lidas, "
+        f"{resumo['respostas_alteradas']} {'a alterar' if simular else 'alteradas'} "
+        f"({resumo['clientes_afetados']} clientes) em {resumo['duracao_segundos']}s "
+        f"({resumo['respostas_por_segundo']} respostas/s)."
+    )
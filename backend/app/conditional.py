@@ -0,0 +1,23 @@
+import hashlib
+from flask import make_response, request
+
+# GET condicional: o ETag é montado só com as versões dos recursos (services/versioning.py) e os
+# parâmetros da requisição, antes de qualquer valorização ou serialização. Com Cache-Control
+# no-cache o navegador revalida cada leitura e recebe 304 quando nada mudou.
+
+
+def calcular_etag(*partes):
+    return hashlib.sha1("|".join(str(p) for p in partes).encode('utf-8')).hexdigest()[:32]
+
+
+def com_etag(resposta, etag):
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+
+def nao_modificado(etag):
+    """Resposta 304 se o If-None-Match da requisição contém o ETag; senão None."""
+    if request.if_none_match.contains_weak(etag):
+        return com_etag(make_response('', 304), etag)
+    return None
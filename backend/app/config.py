@@ -42,4 +42,60 @@ class Config:
         db_path = os.path.join(basedir, '..', 'fallback.db')
         SQLALCHEMY_DATABASE_URI = f"sqlite:///{db_path}"
 
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Cache do último preço por produto (quantidade máxima de produtos e validade em segundos)
+    PRICE_CACHE_MAXSIZE = int(os.getenv('PRICE_CACHE_MAXSIZE', 10000))
+    PRICE_CACHE_TTL = int(os.getenv('PRICE_CACHE_TTL', 300))
+
+    # Paginação por cursor (limite padrão e máximo de itens por página)
+    PAGINATION_DEFAULT_LIMIT = int(os.getenv('PAGINATION_DEFAULT_LIMIT', 100))
+    PAGINATION_MAX_LIMIT = int(os.getenv('PAGINATION_MAX_LIMIT', 500))
+
+    # Motor de execução de ordens: 'orm' (padrão) ou 'procedure' (sp_ExecutarOrdem, apenas SQL Server)
+    ORDER_EXECUTION_ENGINE = os.getenv('ORDER_EXECUTION_ENGINE', 'orm')
+
+    # Cache do contexto de negociação (compliance, perfil, conta e risco do produto).
+    # Escritas locais invalidam na hora; o TTL limita a defasagem entre processos.
+    TRADING_CONTEXT_CACHE_MAXSIZE = int(os.getenv('TRADING_CONTEXT_CACHE_MAXSIZE', 10000))
+    TRADING_CONTEXT_CACHE_TTL = int(os.getenv('TRADING_CONTEXT_CACHE_TTL', 60))
+
+    # Cache da série de desempenho por carteira (estado do replay até o último dia fechado)
+    PERFORMANCE_CACHE_MAXSIZE = int(os.getenv('PERFORMANCE_CACHE_MAXSIZE', 1000))
+    PERFORMANCE_CACHE_TTL = int(os.getenv('PERFORMANCE_CACHE_TTL', 3600))
+
+    # Simulação de Monte Carlo (/portal/meu-portfolio/simulacao/cenarios): padrões, limite de
+    # cenários por requisição e cache do modelo de retornos por universo de produtos
+    SIMULACAO_CENARIOS = int(os.getenv('SIMULACAO_CENARIOS', 10000))
+    SIMULACAO_MAX_CENARIOS = int(os.getenv('SIMULACAO_MAX_CENARIOS', 100000))
+    SIMULACAO_JANELA_DIAS = int(os.getenv('SIMULACAO_JANELA_DIAS', 252))
+    SCENARIO_CACHE_MAXSIZE = int(os.getenv('SCENARIO_CACHE_MAXSIZE', 256))
+    SCENARIO_CACHE_TTL = int(os.getenv('SCENARIO_CACHE_TTL', 3600))
+
+    # Produto de referência (Ticker) da correlação em EstatisticaProduto; vazio desativa
+    ESTATISTICA_TICKER_REFERENCIA = os.getenv('ESTATISTICA_TICKER_REFERENCIA', 'BOVA11')
+
+    # Cache da expansão look-through dos fundos (ComposicaoFundo) por produto e data
+    LOOKTHROUGH_CACHE_MAXSIZE = int(os.getenv('LOOKTHROUGH_CACHE_MAXSIZE', 10000))
+    LOOKTHROUGH_CACHE_TTL = int(os.getenv('LOOKTHROUGH_CACHE_TTL', 3600))
+
+    # Custo do bcrypt (log2 das rodadas); hashes com outro custo são refeitos no próximo login
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+
+    # Threads de requisição por processo do servidor (ex.: waitress --threads, gunicorn --threads);
+    # deve acompanhar a configuração do servidor em produção
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', 8))
+
+    # Pool de verificação de senhas no login: threads do bcrypt, logins aguardando além delas e
+    # fração máxima das SERVER_THREADS que pode estar presa em logins. Cada login segura a thread
+    # da requisição até o hash terminar; acima de min(LOGIN_WORKERS + LOGIN_FILA_MAXIMA,
+    # SERVER_THREADS x LOGIN_FRACAO_THREADS) logins simultâneos a rota responde 429 com
+    # Retry-After (segundos)
+    LOGIN_WORKERS = int(os.getenv('LOGIN_WORKERS', os.cpu_count() or 2))
+    LOGIN_FILA_MAXIMA = int(os.getenv('LOGIN_FILA_MAXIMA', 2))
+    LOGIN_FRACAO_THREADS = float(os.getenv('LOGIN_FRACAO_THREADS', 0.5))
+    LOGIN_RETRY_AFTER = int(os.getenv('LOGIN_RETRY_AFTER', 1))
+
+    # Questionários de suitability serializados (por VersaoID e versão do recurso 'questionario')
+    QUESTIONARIO_CACHE_MAXSIZE = int(os.getenv('QUESTIONARIO_CACHE_MAXSIZE', 64))
+    QUESTIONARIO_CACHE_TTL = int(os.getenv('QUESTIONARIO_CACHE_TTL', 3600))
@@ -25,6 +25,11 @@ class Assessor(db.Model):
     
     auditorias = db.relationship('AuditoriaCompliance', back_populates='assessor')
 
+    # Login: e-mail -> (AssessorID, SenhaHash) só pelo índice
+    __table_args__ = (
+        db.Index('IX_Assessor_Email_Login', 'Email', mssql_include=['SenhaHash']),
+    )
+
 class Cliente(db.Model):
     __tablename__ = 'Cliente'
     ClienteID = db.Column(db.Integer, primary_key=True)
@@ -53,6 +58,10 @@ class Cliente(db.Model):
     contas = db.relationship('Conta', back_populates='cliente')
     portfolios = db.relationship('Portfolio', back_populates='cliente')
 
+    __table_args__ = (
+        db.Index('IX_Cliente_Email_Login', 'Email', mssql_include=['SenhaHash']),
+    )
+
 class GrupoEconomico(db.Model):
     __tablename__ = 'GrupoEconomico'
     GrupoID = db.Column(db.Integer, primary_key=True)
@@ -124,6 +133,12 @@ class RespostaSuitabilityCliente(db.Model):
     cliente = db.relationship('Cliente', back_populates='respostas_suitability')
     versao = db.relationship('QuestionarioSuitabilityVersao', back_populates='respostas_cliente')
 
+class FaixaPerfilRisco(db.Model):
+    # Perfil = faixa de maior PontuacaoMinima <= PontuacaoTotal (fn_CalcularPerfilRisco usa a mesma tabela)
+    __tablename__ = 'FaixaPerfilRisco'
+    PontuacaoMinima = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    PerfilCalculado = db.Column(db.String(50), nullable=False, unique=True)
+
 
 from sqlalchemy.schema import UniqueConstraint
 
@@ -141,6 +156,8 @@ class ProdutoFinanceiro(db.Model):
     ClasseAtivo = db.Column(db.String(50), nullable=False) 
 
     historico_precos = db.relationship('HistoricoPreco', back_populates='produto')
+    preco_atual = db.relationship('PrecoAtual', uselist=False, back_populates='produto')
+    estatistica = db.relationship('EstatisticaProduto', uselist=False, back_populates='produto')
     ordens = db.relationship('Ordem', back_populates='produto')
     posicoes = db.relationship('Posicao', back_populates='produto')
     
@@ -203,6 +220,37 @@ class HistoricoPreco(db.Model):
     
     __table_args__ = (UniqueConstraint('ProdutoID', 'Data', name='uq_produto_data'),)
 
+class PrecoAtual(db.Model):
+    # Snapshot do preço mais recente de cada produto (mantido a cada inserção em HistoricoPreco)
+    __tablename__ = 'PrecoAtual'
+    ProdutoID = db.Column(db.Integer, db.ForeignKey('ProdutoFinanceiro.ProdutoID'), primary_key=True)
+    Data = db.Column(db.Date, nullable=False)
+    PrecoFechamento = db.Column(db.Numeric(18, 8), nullable=False)
+
+    produto = db.relationship('ProdutoFinanceiro', back_populates='preco_atual')
+
+class EstatisticaProduto(db.Model):
+    # Acumuladores de risco/retorno por produto (log-retornos diários de HistoricoPreco),
+    # avançados a cada novo preço: Welford para média/variância, máximo corrente para drawdown e
+    # co-momento com o produto de referência (ESTATISTICA_TICKER_REFERENCIA) para a correlação
+    __tablename__ = 'EstatisticaProduto'
+    ProdutoID = db.Column(db.Integer, db.ForeignKey('ProdutoFinanceiro.ProdutoID'), primary_key=True)
+    DataUltimoPreco = db.Column(db.Date, nullable=False)
+    UltimoPreco = db.Column(db.Numeric(18, 8), nullable=False)
+    PrecoMaximo = db.Column(db.Numeric(18, 8), nullable=False)
+    DrawdownMaximo = db.Column(db.Float, nullable=False, default=0)
+    NumeroRetornos = db.Column(db.Integer, nullable=False, default=0)
+    MediaRetorno = db.Column(db.Float, nullable=False, default=0)
+    M2Retorno = db.Column(db.Float, nullable=False, default=0)
+    NumeroPares = db.Column(db.Integer, nullable=False, default=0)
+    MediaPar = db.Column(db.Float, nullable=False, default=0)
+    MediaReferencia = db.Column(db.Float, nullable=False, default=0)
+    M2Par = db.Column(db.Float, nullable=False, default=0)
+    M2Referencia = db.Column(db.Float, nullable=False, default=0)
+    CoMomento = db.Column(db.Float, nullable=False, default=0)
+
+    produto = db.relationship('ProdutoFinanceiro', back_populates='estatistica')
+
 class ComposicaoFundo(db.Model):
     __tablename__ = 'ComposicaoFundo'
     FundoProdutoID = db.Column(db.Integer, db.ForeignKey('Produto_Fundo.ProdutoID'), primary_key=True)
@@ -261,6 +309,14 @@ class MovimentacaoConta(db.Model):
 
     ordem_liquidada = db.relationship('Ordem', back_populates='movimentacao_liquidacao')
 
+    # Extrato por conta: busca pela conta (origem ou destino) já na ordem de DataHora
+    __table_args__ = (
+        db.Index('IX_Mov_ContaOrigem_DataHora', 'ContaOrigemID', 'DataHora', 'MovimentacaoID',
+                 mssql_include=['ContaDestinoID', 'TipoMovimentacao', 'Valor', 'Status']),
+        db.Index('IX_Mov_ContaDestino_DataHora', 'ContaDestinoID', 'DataHora', 'MovimentacaoID',
+                 mssql_include=['ContaOrigemID', 'TipoMovimentacao', 'Valor', 'Status']),
+    )
+
 
 class Ordem(db.Model):
     __tablename__ = 'Ordem'
@@ -280,6 +336,12 @@ class Ordem(db.Model):
     produto = db.relationship('ProdutoFinanceiro', back_populates='ordens')
     movimentacao_liquidacao = db.relationship('MovimentacaoConta', back_populates='ordem_liquidada')
 
+    # Replay das ordens da carteira em ordem de execução (série de desempenho)
+    __table_args__ = (
+        db.Index('IX_Ordem_Portfolio_DataExecucao', 'PortfolioID', 'DataExecucao', 'OrdemID',
+                 mssql_include=['ProdutoID', 'TipoOrdem', 'Quantidade', 'PrecoUnitario', 'StatusOrdem']),
+    )
+
 class Posicao(db.Model):
     __tablename__ = 'Posicao'
     PosicaoID = db.Column(db.Integer, primary_key=True)
@@ -291,4 +353,26 @@ class Posicao(db.Model):
     portfolio = db.relationship('Portfolio', back_populates='posicoes')
     produto = db.relationship('ProdutoFinanceiro', back_populates='posicoes')
 
-    __table_args__ = (UniqueConstraint('PortfolioID', 'ProdutoID', name='uq_portfolio_produto'),)
\ No newline at end of file
+    __table_args__ = (UniqueConstraint('PortfolioID', 'ProdutoID', name='uq_portfolio_produto'),)
+
+class SnapshotPortfolio(db.Model):
+    # Valor de fechamento diário de cada carteira (gerado por `flask carteiras marcar-mercado`)
+    __tablename__ = 'SnapshotPortfolio'
+    PortfolioID = db.Column(db.Integer, db.ForeignKey('Portfolio.PortfolioID'), primary_key=True)
+    DataReferencia = db.Column(db.Date, primary_key=True)
+    ValorMercado = db.Column(db.Numeric(18, 2), nullable=False)
+    CustoTotal = db.Column(db.Numeric(18, 2), nullable=False)
+    ResultadoFinanceiro = db.Column(db.Numeric(18, 2), nullable=False)
+    QuantidadePosicoes = db.Column(db.Integer, nullable=False)
+    DataCalculo = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    portfolio = db.relationship('Portfolio')
+
+# --- Versões para ETag ---
+
+class VersaoRecurso(db.Model):
+    # Contador de alterações por recurso lido pelas rotas ('conta:<ContaID>', 'portfolio:<PortfolioID>',
+    # 'catalogo', 'snapshots'), incrementado na mesma transação das escritas (services/versioning.py)
+    __tablename__ = 'VersaoRecurso'
+    Recurso = db.Column(db.String(50), primary_key=True)
+    Versao = db.Column(db.BigInteger, nullable=False, default=0)
@@ -0,0 +1,132 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from urllib.parse import urlencode
+from flask import current_app, jsonify, request
+from sqlalchemy import and_, or_
+
+# Paginação por cursor (keyset): o cursor guarda os valores da chave de ordenação do último item
+# entregue, e a próxima página filtra "depois" desses valores, sem OFFSET.
+
+
+class PaginationError(ValueError):
+    # Parâmetros de listagem inválidos (cursor, limit, fields): respondidos com 400
+    pass
+
+
+def _codificar_valor(valor):
+    if isinstance(valor, datetime):
+        return {"dt": valor.isoformat()}
+    if isinstance(valor, date):
+        return {"d": valor.isoformat()}
+    return valor
+
+
+def _decodificar_valor(valor):
+    if isinstance(valor, dict):
+        if "dt" in valor:
+            return datetime.fromisoformat(valor["dt"])
+        if "d" in valor:
+            return date.fromisoformat(valor["d"])
+        raise ValueError
+    return valor
+
+
+def encode_cursor(valores):
+    texto = json.dumps([_codificar_valor(v) for v in valores], separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, num_colunas):
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + preenchimento))
+        if not isinstance(valores, list) or len(valores) != num_colunas:
+            raise ValueError
+        return [_decodificar_valor(v) for v in valores]
+    except (ValueError, TypeError, binascii.Error):
+        raise PaginationError("Cursor de paginação inválido.")
+
+
+def get_limit():
+    limite_padrao = current_app.config.get('PAGINATION_DEFAULT_LIMIT', 100)
+    limite_maximo = current_app.config.get('PAGINATION_MAX_LIMIT', 500)
+    try:
+        limite = int(request.args.get('limit', limite_padrao))
+    except ValueError:
+        raise PaginationError("Parâmetro 'limit' deve ser um inteiro.")
+    if limite <= 0:
+        raise PaginationError("Parâmetro 'limit' deve ser positivo.")
+    return min(limite, limite_maximo)
+
+
+def get_fields(permitidos):
+    """Lê ?fields=A,B (projeção dos campos de primeiro nível). Retorna None se não informado."""
+    valor = request.args.get('fields')
+    if not valor:
+        return None
+    campos = [c.strip() for c in valor.split(',') if c.strip()]
+    invalidos = [c for c in campos if c not in permitidos]
+    if invalidos:
+        raise PaginationError(f"Campos inválidos em 'fields': {invalidos}. Use: {sorted(permitidos)}")
+    return set(campos)
+
+
+def project_fields(itens, campos):
+    if campos is None:
+        return itens
+    return [{k: v for k, v in item.items() if k in campos} for item in itens]
+
+
+def get_cursor(num_colunas):
+    """Lê ?cursor= e devolve os valores da chave do último item já entregue (ou None)."""
+    cursor = request.args.get('cursor')
+    if not cursor:
+        return None
+    return decode_cursor(cursor, num_colunas)
+
+
+def keyset_filter(colunas, valores, descending=False):
+    """Condição "depois do cursor": (c1, c2) > (v1, v2)  ==>  c1 > v1 OR (c1 = v1 AND c2 > v2)."""
+    condicoes = []
+    for i, (coluna, valor) in enumerate(zip(colunas, valores)):
+        comparacao = coluna < valor if descending else coluna > valor
+        iguais = [c == v for c, v in zip(colunas[:i], valores[:i])]
+        condicoes.append(and_(*iguais, comparacao))
+    return or_(*condicoes)
+
+
+def next_cursor(itens, colunas, limite):
+    """Corta a página lida com limite + 1 e gera o cursor da próxima, se houver."""
+    if len(itens) <= limite:
+        return itens, None
+    itens = itens[:limite]
+    return itens, encode_cursor([getattr(itens[-1], c.key) for c in colunas])
+
+
+def paginate_keyset(query, colunas, descending=False):
+    """Aplica ordenação, cursor (?cursor=) e limite (?limit=) a uma query ORM.
+
+    `colunas` deve formar uma chave única e estável (ex.: (DataResposta, RespostaID)).
+    Retorna (itens, proximo_cursor), sendo proximo_cursor None na última página.
+    """
+    limite = get_limit()
+    valores = get_cursor(len(colunas))
+    if valores is not None:
+        query = query.filter(keyset_filter(colunas, valores, descending))
+
+    ordenacao = [c.desc() if descending else c.asc() for c in colunas]
+    itens = query.order_by(*ordenacao).limit(limite + 1).all()
+    return next_cursor(itens, colunas, limite)
+
+
+def paginated_response(dados, proximo_cursor):
+    """Resposta JSON com a lista da página; o cursor da próxima vai nos cabeçalhos X-Next-Cursor e Link."""
+    resposta = jsonify(dados)
+    if proximo_cursor:
+        resposta.headers['X-Next-Cursor'] = proximo_cursor
+        args = request.args.to_dict()
+        args['cursor'] = proximo_cursor
+        resposta.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return resposta
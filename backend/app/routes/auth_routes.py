@@ -2,7 +2,9 @@ from flask import Blueprint, jsonify, request
 from app import db
 from app.models import Assessor, Cliente
 from app.schemas import assessor_schema, cliente_schema
-from flask_jwt_extended import create_access_token
+from app.services.passwords import password_verifier, buscar_identidades, FilaLoginCheiaError
+from app.services.client_claims import claims_token_cliente
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt
 
 bp = Blueprint('auth', __name__)
 
@@ -37,8 +39,12 @@ def unified_login():
     email = data['Email']
     senha = data['Senha']
 
-    assessor = Assessor.query.filter_by(Email=email).first()
-    if assessor and assessor.check_password(senha):
+    # Assessor tem precedência; papel e hash vêm numa consulta só e as senhas são conferidas
+    # numa única tarefa do pool
+    identidade = password_verifier.autenticar(buscar_identidades(email), senha)
+
+    if identidade is not None and identidade.modelo is Assessor:
+        assessor = db.session.get(Assessor, identidade.usuario_id)
         access_token = create_access_token(
             identity=str(assessor.AssessorID),
             additional_claims={'role': 'assessor'}
@@ -49,11 +55,11 @@ def unified_login():
             user=assessor_schema.dump(assessor)
         ), 200
 
-    cliente = Cliente.query.filter_by(Email=email).first()
-    if cliente and cliente.check_password(senha):
+    if identidade is not None:
+        cliente = db.session.get(Cliente, identidade.usuario_id)
         access_token = create_access_token(
             identity=str(cliente.ClienteID),
-            additional_claims={'role': 'cliente'}
+            additional_claims=claims_token_cliente(cliente.ClienteID)
         )
         return jsonify(
             access_token=access_token,
@@ -61,4 +67,17 @@ def unified_login():
             user=cliente_schema.dump(cliente)
         ), 200
 
-    return jsonify({"erro": "Email ou senha inválidos"}), 401
\ No newline at end of file
+    return jsonify({"erro": "Email ou senha inválidos"}), 401
+
+
+@bp.route('/login/metricas', methods=['GET'])
+@jwt_required()
+def login_metrics():
+    if get_jwt().get('role') != 'assessor':
+        return jsonify({"erro": "Acesso não autorizado."}), 403
+    return jsonify(password_verifier.metricas()), 200
+
+
+@bp.app_errorhandler(FilaLoginCheiaError)
+def handle_fila_login_cheia(e):
+    return jsonify({"erro": str(e)}), 429, {'Retry-After': str(e.retry_after)}
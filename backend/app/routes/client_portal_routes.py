@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, current_app
 from app import db
 from app.models import (
     Cliente,
@@ -7,37 +7,54 @@ from app.models import (
     Posicao,
     RespostaSuitabilityCliente,
     ProdutoFinanceiro,
-    OpcaoResposta,
-    Pergunta,
     MovimentacaoConta,
     HistoricoPreco
 )
 from app.schemas import (
     cliente_schema,
     conta_schema,
-    portfolio_schema,
     posicoes_schema,
-    respostas_historico_schema,
-    resposta_suitability_schema
+    respostas_historico_serializador,
+    resposta_suitability_schema,
+    resposta_suitability_load_options,
+    cliente_load_options
 )
+from app.services.valuation import avaliar_portfolio, valorizar_portfolio
+from app.services.performance import desempenho_portfolio
+from app.services.scenarios import simular_cenarios_portfolio
+from app.services.orders import creditar_conta, debitar_conta, ler_saldo
+from app.services.versioning import CATALOGO, SNAPSHOTS, QUESTIONARIO, versao, ler_versoes
+from app.services.passwords import password_verifier, buscar_identidades
+from app.services.questionnaire import questionnaire_cache
+from app.services.client_claims import ClaimsCliente, buscar_claims_cliente, claims_token_cliente, claim_revocations
+from app.pagination import PaginationError, paginate_keyset, paginated_response
+from app.conditional import calcular_etag, com_etag, nao_modificado
+from app.routes.product_routes import listar_produtos
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
-from sqlalchemy import desc, exc, func, and_
-from sqlalchemy.orm import joinedload
+from sqlalchemy import exc, func, and_
 from decimal import Decimal
+from datetime import date
 
 bp = Blueprint('client_portal', __name__)
 
 
-def get_authenticated_client():
-    claims = get_jwt();
-    role = claims.get("role");
-    id_str = get_jwt_identity()
-    if role != "cliente": raise PermissionError("Acesso não autorizado.")
+def get_client_claims():
+    """ClienteID, ContaID, PortfolioID e perfil do cliente autenticado, lidos do token.
+
+    Tokens sem essas claims, com conta ou portfólio nulos (a conta pode ter sido aberta em outro
+    processo, que não revoga as claims deste) ou emitidos antes de uma alteração nelas
+    (claim_revocations) são resolvidos no banco, em uma consulta.
+    """
+    claims = get_jwt()
+    if claims.get("role") != "cliente": raise PermissionError("Acesso não autorizado.")
     try:
-        id_int = int(id_str)
-    except:
+        id_int = int(get_jwt_identity())
+    except (TypeError, ValueError):
         raise ValueError("ID inválido.")
-    cliente = Cliente.query.get(id_int)
+    if (claims.get('conta_id') is not None and claims.get('portfolio_id') is not None
+            and not claim_revocations.revogado(id_int, claims['iat'])):
+        return ClaimsCliente(id_int, claims['conta_id'], claims['portfolio_id'], claims['perfil'])
+    cliente = buscar_claims_cliente(id_int)
     if not cliente: raise LookupError("Cliente não encontrado.")
     return cliente
 
@@ -89,18 +106,43 @@ def client_login():
     data = request.get_json();
     if not data or not data.get('Email') or not data.get('Senha'):
         return jsonify(erro="Faltam dados"), 400
-    cliente = Cliente.query.filter_by(Email=data['Email']).first()
-    if not cliente or not cliente.check_password(data['Senha']):
+    identidade = password_verifier.autenticar(buscar_identidades(data['Email'], (Cliente,)), data['Senha'])
+    if identidade is None:
         return jsonify(erro="Email ou senha inválidos"), 401
-    access_token = create_access_token(identity=str(cliente.ClienteID), additional_claims={'role': 'cliente'})
+    cliente = db.session.get(Cliente, identidade.usuario_id)
+    access_token = create_access_token(identity=str(cliente.ClienteID),
+                                       additional_claims=claims_token_cliente(cliente.ClienteID))
     return jsonify(access_token=access_token, cliente=cliente_schema.dump(cliente)), 200
 
 
+def _consulta_conta(cliente_id):
+    # A versão da conta vem na mesma consulta; com o ETag igual, nada é serializado
+    return db.session.query(Conta, versao('conta', Conta.ContaID)).filter(
+        Conta.ClienteID == cliente_id
+    ).order_by(Conta.ContaID)
+
+
+def _consulta_portfolio(cliente_id):
+    return db.session.query(
+        Portfolio.PortfolioID, Portfolio.ClienteID, Portfolio.NomePortfolio,
+        versao('portfolio', Portfolio.PortfolioID).label('versao_portfolio'),
+        versao(CATALOGO).label('versao_catalogo'),
+        versao(SNAPSHOTS).label('versao_snapshots')
+    ).filter_by(ClienteID=cliente_id).order_by(Portfolio.PortfolioID)
+
+
+def _carregar_perfil(cliente_id):
+    # Recarrega com os relacionamentos do ClienteSchema em lote (evita um SELECT por relacionamento)
+    return Cliente.query.options(*cliente_load_options).execution_options(
+        populate_existing=True
+    ).filter_by(ClienteID=cliente_id).one()
+
+
 @bp.route('/portal/meu-perfil', methods=['GET'])
 @jwt_required()
 def get_my_profile():
     try:
-        cliente = get_authenticated_client()
+        cliente = _carregar_perfil(get_client_claims().ClienteID)
         return cliente_schema.jsonify(cliente), 200
     except Exception as e:
         return jsonify(erro=str(e)), 403
@@ -110,9 +152,14 @@ def get_my_profile():
 @jwt_required()
 def get_my_account():
     try:
-        cliente = get_authenticated_client()
-        conta = Conta.query.filter_by(ClienteID=cliente.ClienteID).first_or_404()
-        return conta_schema.jsonify(conta), 200
+        cliente = get_client_claims()
+        conta, versao_conta = _consulta_conta(cliente.ClienteID).first_or_404()
+
+        etag = calcular_etag('minha-conta', conta.ContaID, versao_conta)
+        resposta = nao_modificado(etag)
+        if resposta is not None:
+            return resposta
+        return com_etag(conta_schema.jsonify(conta), etag), 200
     except Exception as e:
         return jsonify(erro=str(e)), 403
 
@@ -121,68 +168,117 @@ def get_my_account():
 @jwt_required()
 def get_my_portfolio():
     try:
-        cliente = get_authenticated_client()
-        portfolio = Portfolio.query.options(
-            db.joinedload(Portfolio.posicoes).joinedload(Posicao.produto)
-        ).filter_by(ClienteID=cliente.ClienteID).first_or_404()
-
-        posicoes = portfolio.posicoes
-        if not posicoes:
-            portfolio.valor_mercado_total = Decimal(0)
-            portfolio.resultado_total_financeiro = Decimal(0)
-            return portfolio_schema.jsonify(portfolio), 200
-
-        produto_ids = [p.ProdutoID for p in posicoes]
+        cliente = get_client_claims()
+        portfolio = _consulta_portfolio(cliente.ClienteID).first_or_404()
+
+        # ?data=AAAA-MM-DD: valor de fechamento do dia (SnapshotPortfolio); sem data, valor ao vivo
+        data_ref = request.args.get('data')
+        try:
+            data = date.fromisoformat(data_ref) if data_ref else None
+        except ValueError:
+            return jsonify({"erro": "Parâmetro 'data' inválido (use AAAA-MM-DD)."}), 400
+
+        # Posições, preços e snapshots inalterados: 304 sem valorizar a carteira
+        etag = calcular_etag('meu-portfolio', portfolio.PortfolioID, portfolio.versao_portfolio,
+                             portfolio.versao_catalogo, portfolio.versao_snapshots, data)
+        resposta = nao_modificado(etag)
+        if resposta is not None:
+            return resposta
+        return com_etag(jsonify(valorizar_portfolio(portfolio, data)), etag), 200
 
-        subquery_precos = db.session.query(
-            HistoricoPreco.ProdutoID,
-            func.max(HistoricoPreco.Data).label('MaxData')
-        ).filter(
-            HistoricoPreco.ProdutoID.in_(produto_ids)
-        ).group_by(
-            HistoricoPreco.ProdutoID
-        ).subquery('precos_recentes')
-
-        precos_atuais = db.session.query(
-            HistoricoPreco.ProdutoID,
-            HistoricoPreco.PrecoFechamento
-        ).join(
-            subquery_precos,
-            and_(
-                HistoricoPreco.ProdutoID == subquery_precos.c.ProdutoID,
-                HistoricoPreco.Data == subquery_precos.c.MaxData
-            )
-        ).all()
-
-        mapa_precos = {p.ProdutoID: p.PrecoFechamento for p in precos_atuais}
-
-        valor_mercado_total_portfolio = Decimal(0)
-        custo_total_portfolio = Decimal(0)
+    except LookupError as e:
+        return jsonify(erro=str(e)), 404
+    except Exception as e:
+        print(f"Erro ao buscar portfolio: {e}")
+        return jsonify(erro="Erro ao buscar portfolio", detalhes=str(e)), 500
 
-        for p in posicoes:
-            quantidade = Decimal(p.Quantidade)
-            custo_medio = Decimal(p.CustoMedio)
-            custo_total_posicao = quantidade * custo_medio
 
-            preco_atual = Decimal(mapa_precos.get(p.ProdutoID, 0))
+SECOES_DASHBOARD = ('conta', 'portfolio', 'perfil', 'produtos')
 
-            valor_mercado_posicao = quantidade * preco_atual
-            resultado_posicao = valor_mercado_posicao - custo_total_posicao
 
-            p.valor_mercado = valor_mercado_posicao
-            p.resultado_financeiro = resultado_posicao
+def _ler_secoes():
+    """?sections=conta,portfolio,...; sem o parâmetro, todas as seções."""
+    valor = request.args.get('sections')
+    if valor is None:
+        return SECOES_DASHBOARD
+    secoes = {s.strip() for s in valor.split(',') if s.strip()}
+    invalidas = secoes - set(SECOES_DASHBOARD)
+    if not secoes or invalidas:
+        raise ValueError(f"Parâmetro 'sections' inválido (use: {', '.join(SECOES_DASHBOARD)}).")
+    return tuple(s for s in SECOES_DASHBOARD if s in secoes)
 
-            valor_mercado_total_portfolio += valor_mercado_posicao
-            custo_total_portfolio += custo_total_posicao
 
-        portfolio.valor_mercado_total = valor_mercado_total_portfolio
-        portfolio.resultado_total_financeiro = valor_mercado_total_portfolio - custo_total_portfolio
+@bp.route('/portal/dashboard', methods=['GET'])
+@jwt_required()
+def get_dashboard():
+    """Seções do painel do cliente em uma única requisição (mesmo conteúdo das rotas individuais).
+
+    O cliente é autenticado uma vez; com 'perfil', conta e portfólio saem dos relacionamentos já
+    carregados. Sem 'perfil', todas as seções têm versão e a resposta leva ETag (304 sem valorizar).
+    """
+    secoes = _ler_secoes()
+    cliente = get_client_claims()
+
+    conta = portfolio = perfil = None
+    if 'perfil' in secoes:
+        perfil = _carregar_perfil(cliente.ClienteID)
+        conta = min(perfil.contas, key=lambda c: c.ContaID, default=None)
+        portfolio = min(perfil.portfolios, key=lambda p: p.PortfolioID, default=None)
+        etag = None
+    else:
+        partes = ['dashboard', request.full_path]
+        versao_catalogo = None
+        if 'conta' in secoes:
+            linha = _consulta_conta(cliente.ClienteID).first()
+            conta = linha[0] if linha else None
+            partes += [conta.ContaID, linha[1]] if linha else [None]
+        if 'portfolio' in secoes:
+            portfolio = _consulta_portfolio(cliente.ClienteID).first()
+            if portfolio:
+                partes += [portfolio.PortfolioID, portfolio.versao_portfolio, portfolio.versao_snapshots]
+                versao_catalogo = portfolio.versao_catalogo
+        if versao_catalogo is None and ('portfolio' in secoes or 'produtos' in secoes):
+            versao_catalogo = ler_versoes([CATALOGO])[CATALOGO]
+        partes.append(versao_catalogo)
+
+        etag = calcular_etag(*partes)
+        resposta = nao_modificado(etag)
+        if resposta is not None:
+            return resposta
+
+    dados = {}
+    if 'conta' in secoes:
+        dados['conta'] = conta_schema.dump(conta) if conta else None
+    if 'portfolio' in secoes:
+        dados['portfolio'] = valorizar_portfolio(portfolio) if portfolio else None
+    if 'perfil' in secoes:
+        dados['perfil'] = cliente_schema.dump(perfil)
+    if 'produtos' in secoes:
+        dados['produtos'], dados['produtos_proximo_cursor'] = listar_produtos()
+
+    resposta = jsonify(dados)
+    return (com_etag(resposta, etag) if etag else resposta), 200
+
+
+@bp.route('/portal/meu-portfolio/desempenho', methods=['GET'])
+@jwt_required()
+def get_my_portfolio_performance():
+    """Série diária de valor e retorno do portfólio do cliente (?inicio=&fim=, AAAA-MM-DD)."""
+    portfolio_id = get_client_claims().PortfolioID
+    if portfolio_id is None:
+        raise LookupError("Portfólio não encontrado")
 
-        return portfolio_schema.jsonify(portfolio), 200
+    periodo = {}
+    for nome in ('inicio', 'fim'):
+        valor = request.args.get(nome)
+        try:
+            periodo[nome] = date.fromisoformat(valor) if valor else None
+        except ValueError:
+            raise ValueError(f"Parâmetro '{nome}' inválido (use AAAA-MM-DD).")
+    if periodo['inicio'] and periodo['fim'] and periodo['inicio'] > periodo['fim']:
+        raise ValueError("'inicio' deve ser anterior ou igual a 'fim'.")
 
-    except Exception as e:
-        print(f"Erro ao buscar portfolio: {e}")
-        return jsonify(erro="Erro ao buscar portfolio", detalhes=str(e)), 500
+    return jsonify(desempenho_portfolio(portfolio_id, periodo['inicio'], periodo['fim'])), 200
 
 
 # NOVA ROTA DE SIMULAÇÃO
@@ -190,7 +286,7 @@ def get_my_portfolio():
 @jwt_required()
 def simulate_portfolio():
     try:
-        cliente = get_authenticated_client()
+        cliente = get_client_claims()
         data = request.get_json()
 
         simulacao_precos_list = data.get('simulacao_precos', [])
@@ -204,62 +300,80 @@ def simulate_portfolio():
             try:
                 produto_id = int(item['ProdutoID'])
                 novo_preco = Decimal(str(item['NovoPreco']))
+                if not novo_preco.is_finite():
+                    raise ValueError
                 mapa_precos_simulados[produto_id] = novo_preco
             except (ValueError, KeyError):
                 return jsonify(erro="Formato de ProdutoID ou NovoPreco em simulacao_precos inválido."), 400
 
-        # Busca o portfólio e as posições
-        portfolio = Portfolio.query.options(
-            db.joinedload(Portfolio.posicoes).joinedload(Posicao.produto)
-        ).filter_by(ClienteID=cliente.ClienteID).first_or_404()
+        # Busca o portfólio e valoriza as posições com os preços SIMULADOS (os demais produtos mantêm o preço atual)
+        portfolio = db.session.query(
+            Portfolio.PortfolioID, Portfolio.ClienteID, Portfolio.NomePortfolio
+        ).filter_by(ClienteID=cliente.ClienteID).order_by(Portfolio.PortfolioID).first_or_404()
 
-        posicoes = portfolio.posicoes
-        if not posicoes:
+        resultado = avaliar_portfolio(portfolio, mapa_precos_simulados)
+        if not resultado["posicoes"]:
             return jsonify({"erro": "Portfólio vazio. Adicione ativos para simular."}), 400
 
-        # Realiza o cálculo da simulação
-        valor_mercado_total_portfolio = Decimal(0)
-        custo_total_portfolio = Decimal(0)
+        return jsonify(resultado), 200
 
-        for p in posicoes:
-            quantidade = Decimal(p.Quantidade)
-            custo_medio = Decimal(p.CustoMedio)
-            custo_total_posicao = quantidade * custo_medio
+    except LookupError:
+        return jsonify(erro="Portfólio não encontrado."), 404
+    except Exception as e:
+        print(f"Erro ao simular portfolio: {e}")
+        return jsonify(erro="Erro ao simular portfolio", detalhes=str(e)), 500
 
-            # Usa o preço SIMULADO
-            preco_simulado = Decimal(mapa_precos_simulados.get(p.ProdutoID, 0))
 
-            valor_mercado_posicao = quantidade * preco_simulado
-            resultado_posicao = valor_mercado_posicao - custo_total_posicao
+def _ler_parametro(dados, nome, tipo, padrao, minimo, maximo):
+    valor = dados.get(nome, padrao)
+    try:
+        if isinstance(valor, bool):
+            raise ValueError
+        valor = tipo(valor)
+        if not minimo <= valor <= maximo:
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError(f"Parâmetro '{nome}' inválido (entre {minimo} e {maximo}).")
+    return valor
 
-            # Atribui resultados virtuais
-            p.valor_mercado = valor_mercado_posicao
-            p.resultado_financeiro = resultado_posicao
 
-            valor_mercado_total_portfolio += valor_mercado_posicao
-            custo_total_portfolio += custo_total_posicao
+@bp.route('/portal/meu-portfolio/simulacao/cenarios', methods=['POST'])
+@jwt_required()
+def simulate_portfolio_scenarios():
+    """Monte Carlo do portfólio: VaR, expected shortfall e percentis do valor em `horizonte_dias`."""
+    cliente = get_client_claims()
+    dados = request.get_json(silent=True) or {}
 
-        portfolio.valor_mercado_total = valor_mercado_total_portfolio
-        portfolio.resultado_total_financeiro = valor_mercado_total_portfolio - custo_total_portfolio
+    cenarios = _ler_parametro(dados, 'cenarios', int, current_app.config['SIMULACAO_CENARIOS'],
+                              100, current_app.config['SIMULACAO_MAX_CENARIOS'])
+    horizonte = _ler_parametro(dados, 'horizonte_dias', int, 1, 1, 252)
+    confianca = _ler_parametro(dados, 'confianca', float, 0.95, 0.5, 0.999)
+    janela = _ler_parametro(dados, 'janela_dias', int, current_app.config['SIMULACAO_JANELA_DIAS'], 2, 2520)
+    semente = dados.get('semente')
+    if semente is not None and (isinstance(semente, bool) or not isinstance(semente, int) or semente < 0):
+        raise ValueError("Parâmetro 'semente' inválido (inteiro não negativo).")
 
-        # Retorna o resultado serializado
-        return portfolio_schema.jsonify(portfolio), 200
+    portfolio = db.session.query(
+        Portfolio.PortfolioID, Portfolio.ClienteID, Portfolio.NomePortfolio
+    ).filter_by(ClienteID=cliente.ClienteID).order_by(Portfolio.PortfolioID).first()
+    if not portfolio:
+        raise LookupError("Portfólio não encontrado.")
 
-    except LookupError:
-        return jsonify(erro="Portfólio não encontrado."), 404
-    except Exception as e:
-        print(f"Erro ao simular portfolio: {e}")
-        return jsonify(erro="Erro ao simular portfolio", detalhes=str(e)), 500
+    return jsonify(simular_cenarios_portfolio(portfolio, cenarios, horizonte, confianca, janela, semente)), 200
 
 
 @bp.route('/portal/meu-suitability', methods=['GET'])
 @jwt_required()
 def get_my_suitability_history():
     try:
-        cliente = get_authenticated_client()
-        historico = RespostaSuitabilityCliente.query.filter_by(ClienteID=cliente.ClienteID).order_by(
-            desc(RespostaSuitabilityCliente.DataResposta)).all()
-        return jsonify(respostas_historico_schema.dump(historico)), 200
+        cliente = get_client_claims()
+        query = RespostaSuitabilityCliente.query.options(*resposta_suitability_load_options).filter_by(
+            ClienteID=cliente.ClienteID)
+        historico, proximo_cursor = paginate_keyset(
+            query, (RespostaSuitabilityCliente.DataResposta, RespostaSuitabilityCliente.RespostaID), descending=True)
+        return paginated_response(respostas_historico_serializador.serializar(historico), proximo_cursor), 200
+    except PaginationError as e:
+        return jsonify(erro=str(e)), 400
     except Exception as e:
         return jsonify(erro=str(e)), 403
 
@@ -268,43 +382,35 @@ def get_my_suitability_history():
 @jwt_required()
 def submit_my_suitability_answers():
     try:
-        cliente = get_authenticated_client()
+        cliente = get_client_claims()
         cliente_id = cliente.ClienteID
         data = request.get_json()
         if not data or 'respostas' not in data or not isinstance(data['respostas'], list):
             return jsonify({"erro": "Formato inválido."}), 400
-        pontuacao_total = 0
-        versao_id_respondida = None
-        opcao_ids_selecionadas = [r.get('opcao_id') for r in data['respostas'] if r.get('opcao_id')]
+        # Opções, perguntas e pontos saem do questionário em memória (services/questionnaire.py)
+        try:
+            opcao_ids_selecionadas = [int(r['opcao_id']) for r in data['respostas'] if r.get('opcao_id')]
+        except (TypeError, ValueError, AttributeError):
+            return jsonify({"erro": "Opções inválidas."}), 400
         if not opcao_ids_selecionadas: return jsonify({"erro": "Nenhuma opção."}), 400
-        opcoes_escolhidas = OpcaoResposta.query.filter(OpcaoResposta.OpcaoID.in_(opcao_ids_selecionadas)).options(
-            db.joinedload(OpcaoResposta.pergunta)).all()
+        versao_recurso = ler_versoes([QUESTIONARIO])[QUESTIONARIO]
+        opcoes_escolhidas = questionnaire_cache.opcoes(opcao_ids_selecionadas, versao_recurso)
         if not opcoes_escolhidas or len(opcoes_escolhidas) != len(data['respostas']):
             return jsonify({"erro": "Opções inválidas."}), 400
+        pontuacao_total = 0
         versoes_ids = set()
         perguntas_respondidas = set()
-        for opcao in opcoes_escolhidas:
+        for opcao in opcoes_escolhidas.values():
             pontuacao_total += opcao.Pontos
-            if opcao.pergunta:
-                if opcao.pergunta.PerguntaID in perguntas_respondidas: return jsonify(
-                    {"erro": "Pergunta repetida."}), 400
-                perguntas_respondidas.add(opcao.pergunta.PerguntaID)
-                versoes_ids.add(opcao.pergunta.VersaoID)
-            else:
-                return jsonify({"erro": "Erro pergunta."}), 500
+            if opcao.PerguntaID in perguntas_respondidas: return jsonify({"erro": "Pergunta repetida."}), 400
+            perguntas_respondidas.add(opcao.PerguntaID)
+            versoes_ids.add(opcao.VersaoID)
         if len(versoes_ids) > 1:
             return jsonify({"erro": "Versões diferentes."}), 400
-        elif len(versoes_ids) == 1:
-            versao_id_respondida = versoes_ids.pop()
-        else:
-            return jsonify({"erro": "Versão indeterminada."}), 500
-        num_perguntas_versao = Pergunta.query.filter_by(VersaoID=versao_id_respondida).count()
+        versao_id_respondida = versoes_ids.pop()
+        num_perguntas_versao = questionnaire_cache.por_versao(versao_id_respondida, versao_recurso).total_perguntas
         if len(perguntas_respondidas) != num_perguntas_versao: return jsonify({"erro": "Questionário incompleto."}), 400
-        perfil_calculado = 'Conservador'
-        if 50 <= pontuacao_total <= 80:
-            perfil_calculado = 'Moderado'
-        elif pontuacao_total > 80:
-            perfil_calculado = 'Agressivo'
+        perfil_calculado = questionnaire_cache.faixas(versao_recurso).perfil(pontuacao_total)
         nova_resposta = RespostaSuitabilityCliente(ClienteID=cliente_id, VersaoID=versao_id_respondida,
                                                    PontuacaoTotal=pontuacao_total, PerfilCalculado=perfil_calculado)
         db.session.add(nova_resposta)
@@ -324,17 +430,19 @@ def submit_my_suitability_answers():
 @jwt_required()
 def client_make_deposit():
     try:
-        cliente = get_authenticated_client()
+        cliente = get_client_claims()
         data = request.get_json();
         valor_deposito = Decimal(str(data['valor']))
         if valor_deposito <= 0: return jsonify(erro="Valor deve ser positivo"), 400
-        conta = Conta.query.filter_by(ClienteID=cliente.ClienteID).with_for_update().first_or_404()
-        conta.Saldo += valor_deposito
-        nova_movimentacao = MovimentacaoConta(ContaOrigemID=None, ContaDestinoID=conta.ContaID,
+        conta_id = cliente.ContaID
+        if conta_id is None: raise LookupError("Conta não encontrada.")
+        creditar_conta(conta_id, valor_deposito)
+        nova_movimentacao = MovimentacaoConta(ContaOrigemID=None, ContaDestinoID=conta_id,
                                               TipoMovimentacao='Deposito', Valor=valor_deposito, Status='Processada')
         db.session.add(nova_movimentacao)
+        novo_saldo = ler_saldo(conta_id)
         db.session.commit()
-        return jsonify(mensagem="Depósito recebido com sucesso", novo_saldo=conta.Saldo), 200
+        return jsonify(mensagem="Depósito recebido com sucesso", novo_saldo=novo_saldo), 200
     except (PermissionError, ValueError, LookupError) as e:
         db.session.rollback(); return jsonify(erro=str(e)), 403
     except Exception as e:
@@ -345,18 +453,23 @@ def client_make_deposit():
 @jwt_required()
 def client_make_withdrawal():
     try:
-        cliente = get_authenticated_client()
+        cliente = get_client_claims()
         data = request.get_json();
         valor_saque = Decimal(str(data['valor']))
         if valor_saque <= 0: return jsonify(erro="Valor deve ser positivo"), 400
-        conta = Conta.query.filter_by(ClienteID=cliente.ClienteID).with_for_update().first_or_404()
-        if conta.Saldo < valor_saque: return jsonify(erro=f"Saldo insuficiente. Saldo: {conta.Saldo:.2f}"), 400
-        conta.Saldo -= valor_saque
-        nova_movimentacao = MovimentacaoConta(ContaOrigemID=conta.ContaID, ContaDestinoID=None,
+        conta_id = cliente.ContaID
+        if conta_id is None: raise LookupError("Conta não encontrada.")
+        # Débito condicional (Saldo >= valor) no próprio UPDATE: saques simultâneos não furam o saldo
+        if not debitar_conta(conta_id, valor_saque):
+            saldo = ler_saldo(conta_id)
+            db.session.rollback()
+            return jsonify(erro=f"Saldo insuficiente. Saldo: {saldo:.2f}"), 400
+        nova_movimentacao = MovimentacaoConta(ContaOrigemID=conta_id, ContaDestinoID=None,
                                               TipoMovimentacao='Saque', Valor=valor_saque, Status='Processada')
         db.session.add(nova_movimentacao)
+        novo_saldo = ler_saldo(conta_id)
         db.session.commit()
-        return jsonify(mensagem="Saque processado com sucesso", novo_saldo=conta.Saldo), 200
+        return jsonify(mensagem="Saque processado com sucesso", novo_saldo=novo_saldo), 200
     except (PermissionError, ValueError, LookupError) as e:
         db.session.rollback(); return jsonify(erro=str(e)), 403
     except Exception as e:
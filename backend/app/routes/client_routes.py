@@ -1,7 +1,17 @@
 from flask import Blueprint, jsonify, request
 from app import db
 from app.models import Cliente, Assessor, Conta, Portfolio, AuditoriaCompliance, RespostaSuitabilityCliente
-from app.schemas import cliente_schema, clientes_schema
+from app.schemas import (
+    cliente_schema,
+    clientes_schema,
+    clientes_lista_schema,
+    clientes_serializador,
+    clientes_lista_serializador,
+    cliente_load_options
+)
+from app.pagination import paginate_keyset, paginated_response, get_fields, project_fields
+from app.services.questionnaire import questionnaire_cache
+from app.services.versioning import QUESTIONARIO, ler_versoes
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 bp = Blueprint('client', __name__)
@@ -13,9 +23,26 @@ def get_clientes():
     assessor_id_logado_str = get_jwt_identity()
     assessor_id_logado_int = int(assessor_id_logado_str)
 
-    clientes = Cliente.query.filter_by(AssessorID=assessor_id_logado_int).all()
+    query = Cliente.query.filter_by(AssessorID=assessor_id_logado_int)
 
-    return jsonify(clientes_schema.dump(clientes)), 200
+    # Filtros opcionais: ?StatusCompliance=Aprovado&nome=<prefixo do nome>
+    status = request.args.get('StatusCompliance')
+    if status:
+        query = query.filter(Cliente.StatusCompliance == status)
+    nome = request.args.get('nome')
+    if nome:
+        query = query.filter(Cliente.NomeCompleto.startswith(nome, autoescape=True))
+
+    # Listagem enxuta por padrão; ?detalhe=completo devolve o ClienteSchema aninhado,
+    # com os relacionamentos carregados em lote (número fixo de consultas)
+    schema, serializador = clientes_lista_schema, clientes_lista_serializador
+    if request.args.get('detalhe') == 'completo':
+        schema, serializador = clientes_schema, clientes_serializador
+        query = query.options(*cliente_load_options)
+
+    campos = get_fields(schema.fields)
+    clientes, proximo_cursor = paginate_keyset(query, (Cliente.ClienteID,))
+    return paginated_response(project_fields(serializador.serializar(clientes), campos), proximo_cursor), 200
 
 
 @bp.route('/clientes/<int:id>', methods=['GET'])
@@ -24,7 +51,9 @@ def get_cliente(id):
     assessor_id_logado_str = get_jwt_identity()
     assessor_id_logado_int = int(assessor_id_logado_str)
 
-    cliente = Cliente.query.filter_by(ClienteID=id, AssessorID=assessor_id_logado_int).first_or_404()
+    cliente = Cliente.query.options(*cliente_load_options).filter_by(
+        ClienteID=id, AssessorID=assessor_id_logado_int
+    ).first_or_404()
 
     return cliente_schema.jsonify(cliente), 200
 
@@ -50,10 +79,10 @@ def create_cliente():
         # NOVO: Obtém o perfil de risco inicial
         perfil_risco_inicial = data.get('PerfilRiscoInicial', 'Conservador')
 
-        # Define Pontuação com base no perfil escolhido (para o Suitability)
-        # Pontuação mínima para cada perfil, respeitando a lógica de perfil (0-50 Conser., 50-80 Moderado, >80 Agressivo)
-        pontuacao_map = {'Conservador': 10, 'Moderado': 60, 'Agressivo': 90}
-        pontuacao_total = pontuacao_map.get(perfil_risco_inicial, 10)
+        # Define Pontuação com base no perfil escolhido (para o Suitability):
+        # pontuação mínima da faixa do perfil em FaixaPerfilRisco
+        faixas = questionnaire_cache.faixas(ler_versoes([QUESTIONARIO])[QUESTIONARIO])
+        pontuacao_total = faixas.pontuacao_minima(perfil_risco_inicial)
 
         novo_cliente = Cliente(
             AssessorID=assessor_id_logado_int,
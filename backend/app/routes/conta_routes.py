@@ -0,0 +1,142 @@
+from flask import Blueprint, Response, request, stream_with_context
+from app import db
+from app.models import Conta, MovimentacaoConta
+from app.pagination import get_limit, get_cursor, keyset_filter, next_cursor, paginated_response
+from app.serializers import dump_movimentacao
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from sqlalchemy import select, union_all, or_
+from datetime import date, datetime, time, timedelta
+import csv
+import io
+
+bp = Blueprint('conta', __name__)
+
+# Ordem do extrato: mais recentes primeiro; MovimentacaoID desempata a mesma DataHora
+COLUNAS_EXTRATO = (MovimentacaoConta.DataHora, MovimentacaoConta.MovimentacaoID)
+CAMPOS_EXTRATO = ["MovimentacaoID", "DataHora", "TipoMovimentacao", "Sentido", "Valor",
+                  "ContaOrigemID", "ContaDestinoID", "Status"]
+TAMANHO_BLOCO_CSV = 1000
+
+
+def get_conta_autorizada(conta_id):
+    """A conta é visível ao cliente titular e ao assessor responsável pelo cliente."""
+    role = get_jwt().get("role")
+    try:
+        usuario_id = int(get_jwt_identity())
+    except (TypeError, ValueError):
+        raise PermissionError("Token inválido para esta operação.")
+
+    conta = Conta.query.get(conta_id)
+    if conta is not None:
+        if role == 'cliente' and conta.ClienteID == usuario_id:
+            return conta
+        if role == 'assessor' and conta.cliente.AssessorID == usuario_id:
+            return conta
+    raise LookupError("Conta não encontrada ou não autorizada")
+
+
+def _ler_data(nome):
+    valor = request.args.get(nome)
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f"Parâmetro '{nome}' inválido (use AAAA-MM-DD).")
+
+
+def get_periodo():
+    """Lê ?inicio= e ?fim= (datas inclusivas) e devolve o intervalo [inicio, fim) de DataHora."""
+    inicio, fim = _ler_data('inicio'), _ler_data('fim')
+    if inicio and fim and inicio > fim:
+        raise ValueError("'inicio' deve ser anterior ou igual a 'fim'.")
+    return (
+        datetime.combine(inicio, time.min) if inicio else None,
+        datetime.combine(fim + timedelta(days=1), time.min) if fim else None
+    )
+
+
+def consultar_extrato(conta_id, inicio, fim, apos, limite):
+    """Lê até `limite` movimentações da conta, na ordem do extrato, depois do cursor `apos`.
+
+    Em vez de um OR entre origem e destino, cada papel da conta é um ramo próprio que
+    percorre o índice (ContaOrigemID|ContaDestinoID, DataHora) já ordenado e para em `limite`;
+    o UNION ALL junta os dois ramos e a ordenação final só vê no máximo 2 * limite linhas.
+    """
+    colunas = (
+        MovimentacaoConta.MovimentacaoID,
+        MovimentacaoConta.ContaOrigemID,
+        MovimentacaoConta.ContaDestinoID,
+        MovimentacaoConta.TipoMovimentacao,
+        MovimentacaoConta.Valor,
+        MovimentacaoConta.DataHora,
+        MovimentacaoConta.Status
+    )
+
+    def ramo(*condicoes):
+        condicoes = list(condicoes)
+        if inicio is not None:
+            condicoes.append(MovimentacaoConta.DataHora >= inicio)
+        if fim is not None:
+            condicoes.append(MovimentacaoConta.DataHora < fim)
+        if apos is not None:
+            condicoes.append(keyset_filter(COLUNAS_EXTRATO, apos, descending=True))
+        return select(*colunas).where(*condicoes).order_by(
+            *(c.desc() for c in COLUNAS_EXTRATO)
+        ).limit(limite).subquery()
+
+    como_origem = ramo(MovimentacaoConta.ContaOrigemID == conta_id)
+    # Transferências da conta para ela mesma já aparecem no primeiro ramo
+    como_destino = ramo(
+        MovimentacaoConta.ContaDestinoID == conta_id,
+        or_(MovimentacaoConta.ContaOrigemID.is_(None), MovimentacaoConta.ContaOrigemID != conta_id)
+    )
+
+    uniao = union_all(select(como_origem), select(como_destino)).subquery('extrato')
+    return db.session.execute(
+        select(uniao).order_by(uniao.c.DataHora.desc(), uniao.c.MovimentacaoID.desc()).limit(limite)
+    ).all()
+
+
+@bp.route('/contas/<int:conta_id>/extrato', methods=['GET'])
+@jwt_required()
+def get_extrato(conta_id):
+    conta = get_conta_autorizada(conta_id)
+    inicio, fim = get_periodo()
+    limite = get_limit()
+
+    movimentacoes = consultar_extrato(conta.ContaID, inicio, fim, get_cursor(len(COLUNAS_EXTRATO)), limite + 1)
+    movimentacoes, proximo_cursor = next_cursor(movimentacoes, COLUNAS_EXTRATO, limite)
+
+    return paginated_response([dump_movimentacao(m, conta.ContaID) for m in movimentacoes], proximo_cursor), 200
+
+
+@bp.route('/contas/<int:conta_id>/extrato.csv', methods=['GET'])
+@jwt_required()
+def export_extrato_csv(conta_id):
+    """Exporta o período inteiro em CSV, lendo e enviando blocos de TAMANHO_BLOCO_CSV linhas."""
+    conta_id = get_conta_autorizada(conta_id).ContaID
+    inicio, fim = get_periodo()
+
+    def gerar():
+        buffer = io.StringIO()
+        escritor = csv.DictWriter(buffer, fieldnames=CAMPOS_EXTRATO)
+        escritor.writeheader()
+
+        apos = None
+        while True:
+            bloco = consultar_extrato(conta_id, inicio, fim, apos, TAMANHO_BLOCO_CSV)
+            escritor.writerows(dump_movimentacao(m, conta_id) for m in bloco)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+            if len(bloco) < TAMANHO_BLOCO_CSV:
+                break
+            apos = (bloco[-1].DataHora, bloco[-1].MovimentacaoID)
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=extrato_conta_{conta_id}.csv'}
+    )
@@ -13,12 +13,16 @@ from app.models import (
 from app.schemas import (
     grupo_economico_schema, 
     grupos_economico_schema, 
-    cliente_grupo_link_schema,
-    posicoes_schema
+    cliente_grupo_link_schema
 )
+from app.serializers import dump_posicao_consolidada
+from app.services.pricing import price_cache
+from app.services.valuation import avaliar, para_decimais
+from app.services.lookthrough import CicloComposicaoError, exposicao_look_through
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import desc, func, and_
+from sqlalchemy import func, case
 from decimal import Decimal
+from datetime import date
 
 bp = Blueprint('grupo', __name__)
 
@@ -103,82 +107,125 @@ def get_grupo_posicao_consolidada(grupo_id):
     assessor_id_logado_str = get_jwt_identity()
     assessor_id_logado_int = int(assessor_id_logado_str)
 
-    links = ClienteGrupoLink.query.filter_by(GrupoID=grupo_id).all()
-    if not links:
+    # Autorização em uma consulta: o grupo precisa ter membros e ao menos um ser cliente do assessor
+    total_membros, membros_do_assessor = db.session.query(
+        func.count(ClienteGrupoLink.ClienteID),
+        func.sum(case((Cliente.AssessorID == assessor_id_logado_int, 1), else_=0))
+    ).join(Cliente, ClienteGrupoLink.ClienteID == Cliente.ClienteID
+    ).filter(
+        ClienteGrupoLink.GrupoID == grupo_id
+    ).one()
+
+    if not total_membros:
         return jsonify(erro="Grupo não encontrado ou sem clientes"), 404
-        
-    cliente_ids_do_grupo = [link.ClienteID for link in links]
-    
-    auth_cliente = Cliente.query.filter(
-        Cliente.ClienteID.in_(cliente_ids_do_grupo),
-        Cliente.AssessorID == assessor_id_logado_int
-    ).first()
-    
-    if not auth_cliente:
+
+    if not membros_do_assessor:
         return jsonify(erro="Assessor não autorizado a ver este grupo"), 403
 
-    posicoes_raw = db.session.query(
+    clientes_do_grupo = db.session.query(ClienteGrupoLink.ClienteID).filter(
+        ClienteGrupoLink.GrupoID == grupo_id
+    )
+
+    posicoes_agregadas = db.session.query(
         Posicao.ProdutoID,
         func.sum(Posicao.Quantidade).label('QuantidadeTotal'),
         func.sum(Posicao.Quantidade * Posicao.CustoMedio).label('CustoTotal')
     ).join(Portfolio, Posicao.PortfolioID == Portfolio.PortfolioID
     ).filter(
-        Portfolio.ClienteID.in_(cliente_ids_do_grupo)
+        Portfolio.ClienteID.in_(clientes_do_grupo)
     ).group_by(
         Posicao.ProdutoID
+    ).subquery('posicoes_agregadas')
+
+    # Agregação e dados do produto na mesma consulta (sem ProdutoFinanceiro.query.get por linha)
+    posicoes_raw = db.session.query(
+        ProdutoFinanceiro.ProdutoID,
+        ProdutoFinanceiro.Ticker,
+        ProdutoFinanceiro.NomeProduto,
+        ProdutoFinanceiro.ClasseAtivo,
+        ProdutoFinanceiro.NivelRiscoProduto,
+        ProdutoFinanceiro.Emissor,
+        posicoes_agregadas.c.QuantidadeTotal,
+        posicoes_agregadas.c.CustoTotal
+    ).join(
+        posicoes_agregadas, posicoes_agregadas.c.ProdutoID == ProdutoFinanceiro.ProdutoID
+    ).order_by(
+        ProdutoFinanceiro.ProdutoID
     ).all()
-    
+
     if not posicoes_raw:
         return jsonify([]), 200
-        
+
     produto_ids = [p.ProdutoID for p in posicoes_raw]
 
-    subquery_precos = db.session.query(
-        HistoricoPreco.ProdutoID,
-        func.max(HistoricoPreco.Data).label('MaxData')
-    ).filter(
-        HistoricoPreco.ProdutoID.in_(produto_ids)
-    ).group_by(
-        HistoricoPreco.ProdutoID
-    ).subquery('precos_recentes')
+    mapa_precos = price_cache.get_prices(produto_ids)
 
-    precos_atuais = db.session.query(
-        HistoricoPreco.ProdutoID,
-        HistoricoPreco.PrecoFechamento
-    ).join(
-        subquery_precos,
-        and_(
-            HistoricoPreco.ProdutoID == subquery_precos.c.ProdutoID,
-            HistoricoPreco.Data == subquery_precos.c.MaxData
-        )
-    ).all()
-    
-    mapa_precos = {p.ProdutoID: p.PrecoFechamento for p in precos_atuais}
+    avaliacao = avaliar(
+        [p.QuantidadeTotal for p in posicoes_raw],
+        [mapa_precos.get(p.ProdutoID, 0) for p in posicoes_raw],
+        custos_totais=[p.CustoTotal for p in posicoes_raw]
+    )
 
     posicoes_consolidadas = []
-    
-    for p_raw in posicoes_raw:
-        produto = ProdutoFinanceiro.query.get(p_raw.ProdutoID)
-        
+
+    for p_raw, custo_total, valor_mercado, resultado_financeiro in zip(
+        posicoes_raw,
+        para_decimais(avaliacao.custo_total),
+        para_decimais(avaliacao.valor_mercado),
+        para_decimais(avaliacao.resultado_financeiro)
+    ):
         quantidade = Decimal(p_raw.QuantidadeTotal)
-        custo_total = Decimal(p_raw.CustoTotal)
         custo_medio = (custo_total / quantidade) if quantidade > 0 else Decimal(0)
-        
-        preco_atual = Decimal(mapa_precos.get(p_raw.ProdutoID, 0))
-        
-        valor_mercado = quantidade * preco_atual
-        resultado_financeiro = valor_mercado - custo_total
-
-        posicao_obj_virtual = Posicao(
-            ProdutoID=p_raw.ProdutoID,
-            Quantidade=quantidade,
-            CustoMedio=custo_medio,
-            produto=produto
+
+        posicoes_consolidadas.append(
+            dump_posicao_consolidada(p_raw, quantidade, custo_medio, valor_mercado, resultado_financeiro)
         )
 
-        posicao_obj_virtual.valor_mercado = valor_mercado
-        posicao_obj_virtual.resultado_financeiro = resultado_financeiro
-        
-        posicoes_consolidadas.append(posicao_obj_virtual)
+    return jsonify(posicoes_consolidadas), 200
+
 
-    return jsonify(posicoes_schema.dump(posicoes_consolidadas)), 200
\ No newline at end of file
+@bp.route('/grupos/<int:grupo_id>/exposicao', methods=['GET'])
+@jwt_required()
+def get_grupo_exposicao(grupo_id):
+    """Exposição look-through consolidada do grupo (?data=AAAA-MM-DD da composição dos fundos)."""
+    assessor_id_logado_int = int(get_jwt_identity())
+
+    total_membros, membros_do_assessor = db.session.query(
+        func.count(ClienteGrupoLink.ClienteID),
+        func.sum(case((Cliente.AssessorID == assessor_id_logado_int, 1), else_=0))
+    ).join(Cliente, ClienteGrupoLink.ClienteID == Cliente.ClienteID
+    ).filter(
+        ClienteGrupoLink.GrupoID == grupo_id
+    ).one()
+
+    if not total_membros:
+        return jsonify(erro="Grupo não encontrado ou sem clientes"), 404
+
+    if not membros_do_assessor:
+        return jsonify(erro="Assessor não autorizado a ver este grupo"), 403
+
+    data_ref = request.args.get('data')
+    try:
+        data = date.fromisoformat(data_ref) if data_ref else date.today()
+    except ValueError:
+        return jsonify(erro="Parâmetro 'data' inválido (use AAAA-MM-DD)."), 400
+
+    clientes_do_grupo = db.session.query(ClienteGrupoLink.ClienteID).filter(
+        ClienteGrupoLink.GrupoID == grupo_id
+    )
+    posicoes = db.session.query(
+        Posicao.ProdutoID,
+        func.sum(Posicao.Quantidade).label('Quantidade')
+    ).join(Portfolio, Posicao.PortfolioID == Portfolio.PortfolioID
+    ).filter(
+        Portfolio.ClienteID.in_(clientes_do_grupo)
+    ).group_by(
+        Posicao.ProdutoID
+    ).order_by(
+        Posicao.ProdutoID
+    ).all()
+
+    try:
+        return jsonify(exposicao_look_through(posicoes, data)), 200
+    except CicloComposicaoError as e:
+        return jsonify(erro=str(e)), 409
@@ -1,19 +1,37 @@
 from flask import Blueprint, jsonify, request
 from app import db
 from app.models import (
-    Portfolio,
-    ProdutoFinanceiro,
-    Conta,
     MovimentacaoConta,
     Ordem,
-    Posicao,
-    Cliente,  # Já importado, mas é usado agora
-    RespostaSuitabilityCliente,
-    HistoricoPreco
+    Posicao
+)
+from app.services.pricing import price_cache
+from app.services.trading_context import trading_context
+from app.services.orders import (
+    MAX_ORDENS_LOTE,
+    OrdemRejeitada,
+    OrderBatch,
+    ler_ordem,
+    usar_procedure,
+    executar_ordem_procedure,
+    erro_produto_nao_encontrado,
+    erro_sem_suitability,
+    erro_sem_conta,
+    erro_saldo_insuficiente,
+    erro_quantidade_insuficiente,
+    ler_saldo,
+    debitar_conta,
+    creditar_conta,
+    baixar_posicao,
+    somar_posicao,
+    valor_liquidacao,
+    buscar_portfolio_autorizado,
+    verificar_compliance,
+    verificar_preco,
+    verificar_suitability
 )
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from sqlalchemy import desc, exc
-from decimal import Decimal
+from sqlalchemy import exc
 
 bp = Blueprint('order', __name__)
 
@@ -31,125 +49,70 @@ def execute_order():
     user_id_str = get_jwt_identity()
     user_id_int = int(user_id_str)
 
-    required_fields = ["portfolio_id", "produto_id", "tipo_ordem", "quantidade", "preco_unitario"]
-    if not all(field in data for field in required_fields):
-        return jsonify({"erro": f"Campos obrigatórios em falta: {required_fields}"}), 400
+    try:
+        produto_id, tipo_ordem, quantidade, preco_unitario = ler_ordem(data)
+    except OrdemRejeitada as e:
+        return jsonify(e.resposta), e.status
 
     portfolio_id = data.get("portfolio_id")
-    produto_id = data.get("produto_id")
-    tipo_ordem = data.get("tipo_ordem", "").strip().capitalize()
-    try:
-        quantidade = Decimal(str(data.get("quantidade", 0)))
-        preco_unitario = Decimal(str(data.get("preco_unitario", 0)))
-    except Exception:
-        return jsonify({"erro": "Quantidade ou Preço Unitário inválidos."}), 400
+    valor_total_ordem = valor_liquidacao(quantidade, preco_unitario)
 
-    valor_total_ordem = quantidade * preco_unitario
+    try:
+        if usar_procedure():
+            # SQL Server: validações e liquidação em uma única chamada a sp_ExecutarOrdem
+            ordem_id = executar_ordem_procedure(
+                portfolio_id, produto_id, tipo_ordem, quantidade, preco_unitario, role, user_id_int)
+            return jsonify(
+                {"mensagem": f"Ordem de {tipo_ordem} executada com sucesso!", "ordem_id": ordem_id}), 201
+
+        portfolio = buscar_portfolio_autorizado(portfolio_id, role, user_id_int)
+        cliente_id = portfolio.ClienteID
 
-    if quantidade <= 0 or preco_unitario <= 0:
-        return jsonify({"erro": "Quantidade e Preço Unitário devem ser positivos."}), 400
+        # Status Compliance, perfil, conta e risco do produto vêm do cache de contexto de
+        # negociação (invalidado quando esses dados mudam); o preço, do cache de preços
+        contexto = trading_context.get_cliente(cliente_id)
 
-    if tipo_ordem not in ["Compra", "Venda"]:
-        return jsonify({"erro": "Tipo de Ordem inválido. Use 'Compra' ou 'Venda'."}), 400
+        # Verificar Status Compliance ANTES de qualquer negociação
+        verificar_compliance(contexto.StatusCompliance)
 
-    try:
-        portfolio_query = Portfolio.query.filter(Portfolio.PortfolioID == portfolio_id)
-
-        if role == 'assessor':
-            # Assessor só pode operar em portfólios de seus clientes
-            portfolio = portfolio_query.join(Cliente).filter(
-                Cliente.AssessorID == user_id_int
-            ).first()
-        elif role == 'cliente':
-            # Cliente só pode operar em seus próprios portfólios
-            portfolio = portfolio_query.filter(
-                Portfolio.ClienteID == user_id_int
-            ).first()
-        else:
-            return jsonify({"erro": "Role de usuário não reconhecida."}), 403
+        produto = trading_context.get_produto(produto_id)
+        if not produto:
+            raise erro_produto_nao_encontrado(produto_id)
 
-        if not portfolio:
-            return jsonify({"erro": "Portfólio não encontrado ou não autorizado para este usuário."}), 404
+        # Busca o preço mais recente (cache compartilhado) para evitar fraudes ou defasagem
+        verificar_preco(price_cache.get_price(produto.ProdutoID), preco_unitario)
 
-        cliente_id = portfolio.ClienteID
+        if contexto.PerfilCalculado is None:
+            raise erro_sem_suitability()
+        verificar_suitability(contexto.PerfilCalculado, produto.NivelRiscoProduto)
 
-        # NOVO: Verificar Status Compliance ANTES de qualquer negociação (o ponto principal)
-        cliente = Cliente.query.get(cliente_id)
-        if cliente.StatusCompliance != 'Aprovado':
-            return jsonify({
-                "erro": "Operação não permitida.",
-                "mensagem": f"O Status Compliance do cliente é '{cliente.StatusCompliance}'. Apenas clientes 'Aprovado' podem negociar."
-            }), 403
-        # FIM NOVO
-
-        produto = ProdutoFinanceiro.query.get(produto_id)
-        if not produto:
-            return jsonify({"erro": f"Produto com ID {produto_id} não encontrado."}), 404
-
-        # Busca o preço mais recente no banco para evitar fraudes ou defasagem
-        ultimo_preco = HistoricoPreco.query.filter_by(ProdutoID=produto_id) \
-            .order_by(desc(HistoricoPreco.Data)).first()
-
-        if ultimo_preco:
-            # Margem de tolerância de 5%
-            preco_banco = ultimo_preco.PrecoFechamento
-            diferenca = abs(preco_banco - preco_unitario)
-            if diferenca > (preco_banco * Decimal('0.05')):
-                return jsonify({
-                    "erro": "Preço defasado.",
-                    "preco_atual": str(preco_banco),
-                    "mensagem": "O preço mudou significativamente (mais de 5%). Por favor, recarregue a cotação."
-                }), 400
-
-        resposta_recente = RespostaSuitabilityCliente.query.filter_by(
-            ClienteID=cliente_id
-        ).order_by(desc(RespostaSuitabilityCliente.DataResposta)).first()
-
-        if not resposta_recente:
-            return jsonify({"erro": "Cliente não possui perfil de risco (Suitability) definido."}), 400
-
-        perfil_cliente = resposta_recente.PerfilCalculado
-        risco_produto = produto.NivelRiscoProduto or 3
-
-        permitido = False
-        if perfil_cliente == 'Conservador' and risco_produto <= 2: permitido = True
-        if perfil_cliente == 'Moderado' and risco_produto <= 4: permitido = True
-        if perfil_cliente == 'Agressivo': permitido = True
-
-        if not permitido:
-            return jsonify({
-                "erro": f"Produto (Risco {risco_produto}) incompatível com o perfil '{perfil_cliente}' do cliente."}), 400
-
-        conta = Conta.query.filter_by(ClienteID=cliente_id).first()
-        if not conta:
-            return jsonify({"erro": "Cliente não possui conta associada para liquidação."}), 400
+        conta_id = contexto.ContaID
+        if conta_id is None:
+            raise erro_sem_conta()
 
+        # Saldo e posição são alterados com UPDATEs condicionais (verificação e escrita no mesmo
+        # comando), sempre na ordem Conta -> Posicao
         if tipo_ordem == "Compra":
-            if conta.Saldo < valor_total_ordem:
-                return jsonify(
-                    {"erro": f"Saldo insuficiente. Saldo: {conta.Saldo:.2f}, Necessário: {valor_total_ordem:.2f}"}), 400
+            if not debitar_conta(conta_id, valor_total_ordem):
+                raise erro_saldo_insuficiente(ler_saldo(conta_id), valor_total_ordem)
 
-            conta.Saldo -= valor_total_ordem
+            somar_posicao(portfolio_id, produto_id, quantidade, valor_total_ordem, preco_unitario)
             tipo_mov = 'Aplicacao'
-            conta_origem_id = conta.ContaID
+            conta_origem_id = conta_id
             conta_destino_id = None
 
         else:
-            posicao_existente = Posicao.query.filter_by(
-                PortfolioID=portfolio_id,
-                ProdutoID=produto_id
-            ).first()
-
-            if not posicao_existente or posicao_existente.Quantidade < quantidade:
-                qtd_disponivel = posicao_existente.Quantidade if posicao_existente else 0
-                return jsonify({
-                    "erro": f"Quantidade insuficiente para venda. Disponível: {qtd_disponivel}, Tentando vender: {quantidade}"}), 400
+            creditar_conta(conta_id, valor_total_ordem)
+            if not baixar_posicao(portfolio_id, produto_id, quantidade):
+                qtd_disponivel = db.session.query(Posicao.Quantidade).filter_by(
+                    PortfolioID=portfolio_id,
+                    ProdutoID=produto_id
+                ).scalar() or 0
+                raise erro_quantidade_insuficiente(qtd_disponivel, quantidade)
 
-            posicao_existente.Quantidade -= quantidade
             tipo_mov = 'Resgate'
             conta_origem_id = None
-            conta_destino_id = conta.ContaID
-            conta.Saldo += valor_total_ordem
+            conta_destino_id = conta_id
 
         nova_movimentacao = MovimentacaoConta(
             ContaOrigemID=conta_origem_id,
@@ -172,44 +135,66 @@ def execute_order():
         )
         db.session.add(nova_ordem)
 
-        if tipo_ordem == "Compra":
-            posicao_existente = Posicao.query.filter_by(
-                PortfolioID=portfolio_id,
-                ProdutoID=produto_id
-            ).with_for_update().first()
+        db.session.commit()
 
-            if posicao_existente:
+        return jsonify(
+            {"mensagem": f"Ordem de {tipo_ordem} executada com sucesso!", "ordem_id": nova_ordem.OrdemID}), 201
 
-                custo_total_antigo = posicao_existente.Quantidade * posicao_existente.CustoMedio
-                custo_total_novo = valor_total_ordem
-                quantidade_total_nova = posicao_existente.Quantidade + quantidade
+    except OrdemRejeitada as e:
+        db.session.rollback()
+        return jsonify(e.resposta), e.status
+    except exc.IntegrityError as e:
+        db.session.rollback()
+        print(f"Erro de Integridade: {e}")
+        return jsonify({"erro": "Erro de integridade no banco de dados."}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro inesperado ao executar ordem: {e}")
+        return jsonify({"erro": "Erro interno ao processar a ordem."}), 500
 
-                if quantidade_total_nova > 0:
-                    posicao_existente.CustoMedio = (custo_total_antigo + custo_total_novo) / quantidade_total_nova
 
-                posicao_existente.Quantidade += quantidade
-            else:
-                nova_posicao = Posicao(
-                    PortfolioID=portfolio_id,
-                    ProdutoID=produto_id,
-                    Quantidade=quantidade,
-                    CustoMedio=preco_unitario
-                )
-                db.session.add(nova_posicao)
-        else:
-            if posicao_existente.Quantidade == 0:
-                db.session.delete(posicao_existente)
+@bp.route('/ordens/lote', methods=['POST'])
+@jwt_required()
+def execute_order_batch():
+    """Executa uma lista de ordens de um portfólio em uma única transação.
+
+    Corpo: {"portfolio_id": 1, "ordens": [{"produto_id", "tipo_ordem", "quantidade", "preco_unitario"}, ...],
+    "atomico": false}. As ordens são avaliadas na sequência enviada; com "atomico": true,
+    uma única rejeição cancela todas.
+    """
+    data = request.get_json(silent=True)
+    if not data or "portfolio_id" not in data or not isinstance(data.get("ordens"), list):
+        return jsonify({"erro": "Informe 'portfolio_id' e a lista 'ordens'."}), 400
+
+    ordens_dados = data["ordens"]
+    if not ordens_dados:
+        return jsonify({"erro": "A lista 'ordens' está vazia."}), 400
+    if len(ordens_dados) > MAX_ORDENS_LOTE:
+        return jsonify({"erro": f"Máximo de {MAX_ORDENS_LOTE} ordens por lote."}), 400
 
-        db.session.commit()
+    claims = get_jwt()
+    role = claims.get("role")
+    user_id_int = int(get_jwt_identity())
 
-        return jsonify(
-            {"mensagem": f"Ordem de {tipo_ordem} executada com sucesso!", "ordem_id": nova_ordem.OrdemID}), 201
+    try:
+        portfolio = buscar_portfolio_autorizado(data["portfolio_id"], role, user_id_int)
+        resultados, executadas = OrderBatch(portfolio, atomico=bool(data.get("atomico"))).executar(ordens_dados)
+
+        return jsonify({
+            "portfolio_id": portfolio.PortfolioID,
+            "executadas": executadas,
+            "rejeitadas": sum(1 for r in resultados if r["status"] == "Rejeitada"),
+            "resultados": resultados
+        }), 201 if executadas else 400
 
+    except OrdemRejeitada as e:
+        db.session.rollback()
+        return jsonify(e.resposta), e.status
     except exc.IntegrityError as e:
         db.session.rollback()
         print(f"Erro de Integridade: {e}")
         return jsonify({"erro": "Erro de integridade no banco de dados."}), 400
     except Exception as e:
         db.session.rollback()
-        print(f"Erro inesperado ao executar ordem: {e}")
-        return jsonify({"erro": "Erro interno ao processar a ordem."}), 500
\ No newline at end of file
+        print(f"Erro inesperado ao executar lote de ordens: {e}")
+        return jsonify({"erro": "Erro interno ao processar o lote de ordens."}), 500
@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from app import db
 from app.models import (
     Portfolio, 
@@ -9,15 +9,18 @@ from app.models import (
     ProdutoFinanceiro
 )
 from app.schemas import (
-    portfolio_schema, 
-    portfolios_schema, 
-    posicoes_schema, 
-    PosicaoSchema
+    portfolios_serializador,
+    posicoes_serializador,
+    PosicaoSchema,
+    portfolio_load_options
 )
+from app.services.valuation import valorizar_portfolio
+from app.services.performance import desempenho_portfolio
+from app.services.lookthrough import CicloComposicaoError, exposicao_portfolio
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.orm import joinedload
 from sqlalchemy import desc, func, and_
-from decimal import Decimal
+from datetime import date
 
 bp = Blueprint('portfolio', __name__)
 
@@ -35,9 +38,9 @@ def get_portfolios_by_cliente(cliente_id):
     if not cliente:
         return jsonify({"erro": "Cliente não encontrado ou não autorizado"}), 404
 
-    portfolios = Portfolio.query.filter_by(ClienteID=cliente_id).all()
+    portfolios = Portfolio.query.options(*portfolio_load_options).filter_by(ClienteID=cliente_id).all()
     
-    return jsonify(portfolios_schema.dump(portfolios)), 200
+    return jsonify(portfolios_serializador.serializar(portfolios)), 200
 
 @bp.route('/posicoes/portfolio/<int:portfolio_id>', methods=['GET'])
 @jwt_required()
@@ -57,7 +60,17 @@ def get_posicoes_by_portfolio(portfolio_id):
 
     posicoes = Posicao.query.options(joinedload(Posicao.produto)).filter_by(PortfolioID=portfolio_id).all()
     
-    return jsonify(posicoes_schema.dump(posicoes)), 200
+    return jsonify(posicoes_serializador.serializar(posicoes)), 200
+
+def _ler_data(nome):
+    valor = request.args.get(nome)
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f"Parâmetro '{nome}' inválido (use AAAA-MM-DD).")
+
 
 @bp.route('/portfolios/<int:portfolio_id>/valorizado', methods=['GET'])
 @jwt_required()
@@ -65,67 +78,68 @@ def get_portfolio_valorizado(portfolio_id):
     assessor_id_logado_str = get_jwt_identity()
     assessor_id_logado_int = int(assessor_id_logado_str)
 
-    portfolio = Portfolio.query \
-        .join(Cliente, Portfolio.ClienteID == Cliente.ClienteID) \
-        .options(db.joinedload(Portfolio.posicoes).joinedload(Posicao.produto)) \
-        .filter(
-            Portfolio.PortfolioID == portfolio_id,
-            Cliente.AssessorID == assessor_id_logado_int
-        ).first()
+    portfolio = db.session.query(
+        Portfolio.PortfolioID, Portfolio.ClienteID, Portfolio.NomePortfolio
+    ).join(Cliente, Portfolio.ClienteID == Cliente.ClienteID).filter(
+        Portfolio.PortfolioID == portfolio_id,
+        Cliente.AssessorID == assessor_id_logado_int
+    ).first()
 
     if not portfolio:
         return jsonify({"erro": "Portfólio não encontrado ou não autorizado"}), 404
-    
-    posicoes = portfolio.posicoes
-    if not posicoes:
-        portfolio.valor_mercado_total = Decimal(0)
-        portfolio.resultado_total_financeiro = Decimal(0)
-        return portfolio_schema.jsonify(portfolio), 200
 
-    produto_ids = [p.ProdutoID for p in posicoes]
+    # ?data=AAAA-MM-DD: valor de fechamento do dia (SnapshotPortfolio); sem data, valor ao vivo
+    data_ref = request.args.get('data')
+    try:
+        data = date.fromisoformat(data_ref) if data_ref else None
+    except ValueError:
+        return jsonify({"erro": "Parâmetro 'data' inválido (use AAAA-MM-DD)."}), 400
+
+    try:
+        return jsonify(valorizar_portfolio(portfolio, data)), 200
+    except LookupError as e:
+        return jsonify({"erro": str(e)}), 404
+
+
+@bp.route('/portfolios/<int:portfolio_id>/desempenho', methods=['GET'])
+@jwt_required()
+def get_portfolio_desempenho(portfolio_id):
+    """Série diária de valor e retorno (?inicio=&fim=, AAAA-MM-DD, inclusivos)."""
+    assessor_id_logado_int = int(get_jwt_identity())
+
+    autorizado = db.session.query(Portfolio.PortfolioID).join(
+        Cliente, Portfolio.ClienteID == Cliente.ClienteID
+    ).filter(
+        Portfolio.PortfolioID == portfolio_id,
+        Cliente.AssessorID == assessor_id_logado_int
+    ).first()
+    if not autorizado:
+        return jsonify({"erro": "Portfólio não encontrado ou não autorizado"}), 404
+
+    inicio, fim = _ler_data('inicio'), _ler_data('fim')
+    if inicio and fim and inicio > fim:
+        return jsonify({"erro": "'inicio' deve ser anterior ou igual a 'fim'."}), 400
+
+    return jsonify(desempenho_portfolio(portfolio_id, inicio, fim)), 200
+
 
-    subquery_precos = db.session.query(
-        HistoricoPreco.ProdutoID,
-        func.max(HistoricoPreco.Data).label('MaxData')
+@bp.route('/portfolios/<int:portfolio_id>/exposicao', methods=['GET'])
+@jwt_required()
+def get_portfolio_exposicao(portfolio_id):
+    """Exposição look-through: fundos abertos até os ativos finais (?data=AAAA-MM-DD da composição)."""
+    assessor_id_logado_int = int(get_jwt_identity())
+
+    autorizado = db.session.query(Portfolio.PortfolioID).join(
+        Cliente, Portfolio.ClienteID == Cliente.ClienteID
     ).filter(
-        HistoricoPreco.ProdutoID.in_(produto_ids)
-    ).group_by(
-        HistoricoPreco.ProdutoID
-    ).subquery('precos_recentes')
-
-    precos_atuais = db.session.query(
-        HistoricoPreco.ProdutoID,
-        HistoricoPreco.PrecoFechamento
-    ).join(
-        subquery_precos,
-        and_(
-            HistoricoPreco.ProdutoID == subquery_precos.c.ProdutoID,
-            HistoricoPreco.Data == subquery_precos.c.MaxData
-        )
-    ).all()
-    
-    mapa_precos = {p.ProdutoID: p.PrecoFechamento for p in precos_atuais}
+        Portfolio.PortfolioID == portfolio_id,
+        Cliente.AssessorID == assessor_id_logado_int
+    ).first()
+    if not autorizado:
+        return jsonify({"erro": "Portfólio não encontrado ou não autorizado"}), 404
 
-    valor_mercado_total_portfolio = Decimal(0)
-    custo_total_portfolio = Decimal(0)
-    
-    for p in posicoes:
-        quantidade = Decimal(p.Quantidade)
-        custo_medio = Decimal(p.CustoMedio)
-        custo_total_posicao = quantidade * custo_medio
-        
-        preco_atual = Decimal(mapa_precos.get(p.ProdutoID, 0))
-        
-        valor_mercado_posicao = quantidade * preco_atual
-        resultado_posicao = valor_mercado_posicao - custo_total_posicao
-
-        p.valor_mercado = valor_mercado_posicao
-        p.resultado_financeiro = resultado_posicao
-
-        valor_mercado_total_portfolio += valor_mercado_posicao
-        custo_total_portfolio += custo_total_posicao
-
-    portfolio.valor_mercado_total = valor_mercado_total_portfolio
-    portfolio.resultado_total_financeiro = valor_mercado_total_portfolio - custo_total_portfolio
-    
-    return portfolio_schema.jsonify(portfolio), 200
\ No newline at end of file
+    data = _ler_data('data') or date.today()
+    try:
+        return jsonify(exposicao_portfolio(portfolio_id, data)), 200
+    except CicloComposicaoError as e:
+        return jsonify({"erro": str(e)}), 409
@@ -5,66 +5,108 @@ from app.schemas import (
     produto_schema,
     produto_acao_schema,
     produto_rf_schema,
-    produto_fundo_schema
+    produto_fundo_schema,
+    produto_serializador,
+    produto_acao_serializador,
+    produto_rf_serializador,
+    produto_fundo_serializador
 )
-from flask_jwt_extended import jwt_required
-from sqlalchemy import exc, desc, func, and_
+from app.serializers import dump_estatistica_produto
+from app.services.pricing import price_cache
+from app.services.versioning import CATALOGO, ler_versoes
+from app.services.price_ingest import (
+    FORMATOS, TAMANHO_LOTE_PADRAO, ConflitoIngestaoError, PriceIngestor, iter_registros
+)
+from app.pagination import PaginationError, paginate_keyset, paginated_response, get_fields, project_fields
+from app.conditional import calcular_etag, com_etag, nao_modificado
+from flask_jwt_extended import jwt_required, get_jwt
+from sqlalchemy import exc
+from sqlalchemy.orm import selectin_polymorphic, joinedload
 from datetime import date
 from decimal import Decimal
+import io
 
 bp = Blueprint('product', __name__)
 
 
-@bp.route('/produtos', methods=['GET'])
-@jwt_required()
-def get_produtos():
-    try:
-        produtos = ProdutoFinanceiro.query.all()
-        resultado = []
-        produto_ids = [p.ProdutoID for p in produtos]
-
-        # Buscar o preço mais recente para todos os produtos
-        subquery_precos = db.session.query(
-            HistoricoPreco.ProdutoID,
-            func.max(HistoricoPreco.Data).label('MaxData')
-        ).filter(
-            HistoricoPreco.ProdutoID.in_(produto_ids)
-        ).group_by(
-            HistoricoPreco.ProdutoID
-        ).subquery('precos_recentes')
-
-        precos_atuais = db.session.query(
-            HistoricoPreco.ProdutoID,
-            HistoricoPreco.PrecoFechamento
-        ).join(
-            subquery_precos,
-            and_(
-                HistoricoPreco.ProdutoID == subquery_precos.c.ProdutoID,
-                HistoricoPreco.Data == subquery_precos.c.MaxData
-            )
-        ).all()
+# Estatísticas de risco/retorno (EstatisticaProduto) devolvidas junto de cada produto
+CAMPOS_ESTATISTICA = set(dump_estatistica_produto(None))
+
+# Campos aceitos em ?fields= (união dos esquemas das subclasses + PrecoAtual + estatísticas)
+CAMPOS_PRODUTO = (
+    set(produto_schema.fields) | set(produto_acao_schema.fields)
+    | set(produto_rf_schema.fields) | set(produto_fundo_schema.fields) | {'PrecoAtual'}
+    | CAMPOS_ESTATISTICA
+)
+
 
-        mapa_precos = {p.ProdutoID: float(p.PrecoFechamento) for p in precos_atuais}
+def listar_produtos():
+    """Página do catálogo conforme ?ClasseAtivo=, ?nome=, ?fields=, ?limit= e ?cursor=: (itens, próximo cursor)."""
+    # As colunas das subclasses vêm em uma consulta por tipo, e não uma por produto
+    query = ProdutoFinanceiro.query.options(
+        selectin_polymorphic(ProdutoFinanceiro, [Produto_Acao, Produto_RendaFixa, Produto_Fundo])
+    )
+
+    # Filtros opcionais: ?ClasseAtivo=Acao&nome=<prefixo do nome>
+    classe = request.args.get('ClasseAtivo')
+    if classe:
+        query = query.filter(ProdutoFinanceiro.ClasseAtivo == classe)
+    nome = request.args.get('nome')
+    if nome:
+        query = query.filter(ProdutoFinanceiro.NomeProduto.startswith(nome, autoescape=True))
+
+    # As estatísticas vêm na mesma consulta (LEFT JOIN), apenas se algum campo for devolvido
+    campos = get_fields(CAMPOS_PRODUTO)
+    com_estatisticas = campos is None or not CAMPOS_ESTATISTICA.isdisjoint(campos)
+    if com_estatisticas:
+        query = query.options(joinedload(ProdutoFinanceiro.estatistica))
+
+    produtos, proximo_cursor = paginate_keyset(query, (ProdutoFinanceiro.ProdutoID,))
+    resultado = []
+
+    # Buscar o preço mais recente apenas se o campo for devolvido
+    mapa_precos = {}
+    if campos is None or 'PrecoAtual' in campos:
+        precos_atuais = price_cache.get_prices([p.ProdutoID for p in produtos])
+        mapa_precos = {pid: float(preco) for pid, preco in precos_atuais.items()}
+
+    # Serialização manual para usar o schema correto conforme o tipo
+    for prod in produtos:
+        prod_data = None
+        if prod.ClasseAtivo == 'Acao':
+            prod_data = produto_acao_serializador.dump(prod)
+        elif prod.ClasseAtivo == 'RendaFixa':
+            prod_data = produto_rf_serializador.dump(prod)
+        elif prod.ClasseAtivo == 'Fundo':
+            prod_data = produto_fundo_serializador.dump(prod)
+        else:
+            prod_data = produto_serializador.dump(prod)
 
-        # Serialização manual para usar o schema correto conforme o tipo
-        for prod in produtos:
-            prod_data = None
-            if prod.ClasseAtivo == 'Acao':
-                prod_data = produto_acao_schema.dump(prod)
-            elif prod.ClasseAtivo == 'RendaFixa':
-                prod_data = produto_rf_schema.dump(prod)
-            elif prod.ClasseAtivo == 'Fundo':
-                prod_data = produto_fundo_schema.dump(prod)
-            else:
-                prod_data = produto_schema.dump(prod)
+        # Adicionar o preço atual ao resultado
+        prod_data['PrecoAtual'] = mapa_precos.get(prod.ProdutoID, 0.00)
+        if com_estatisticas:
+            prod_data.update(dump_estatistica_produto(prod.estatistica))
 
-            # Adicionar o preço atual ao resultado
-            prod_data['PrecoAtual'] = mapa_precos.get(prod.ProdutoID, 0.00)
+        resultado.append(prod_data)
 
-            resultado.append(prod_data)
+    return project_fields(resultado, campos), proximo_cursor
 
-        return jsonify(resultado), 200
 
+@bp.route('/produtos', methods=['GET'])
+@jwt_required()
+def get_produtos():
+    try:
+        # Catálogo inalterado desde a última leitura (mesma URL): 304 sem consultar os produtos
+        etag = calcular_etag('produtos', ler_versoes([CATALOGO])[CATALOGO], request.full_path)
+        resposta = nao_modificado(etag)
+        if resposta is not None:
+            return resposta
+
+        resultado, proximo_cursor = listar_produtos()
+        return com_etag(paginated_response(resultado, proximo_cursor), etag), 200
+
+    except PaginationError as e:
+        return jsonify({"erro": str(e)}), 400
     except Exception as e:
         return jsonify({"erro": "Erro ao buscar produtos", "detalhes": str(e)}), 500
 
@@ -151,4 +193,39 @@ def create_produto():
     except Exception as e:
         db.session.rollback()
         print(f"Erro inesperado ao criar produto: {e}")
-        return jsonify({"erro": "Erro interno ao criar produto", "detalhes": str(e)}), 500
\ No newline at end of file
+        return jsonify({"erro": "Erro interno ao criar produto", "detalhes": str(e)}), 500
+
+
+@bp.route('/precos/importacao', methods=['POST'])
+@jwt_required()
+def import_precos():
+    if get_jwt().get("role") != 'assessor':
+        return jsonify({"erro": "Apenas assessores podem importar preços."}), 403
+
+    # Formato pelo parâmetro ou pelo Content-Type (text/csv ou application/x-ndjson)
+    formato = request.args.get('formato')
+    if not formato:
+        formato = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+    if formato not in FORMATOS:
+        return jsonify({"erro": f"Formato inválido. Use um de: {list(FORMATOS)}"}), 400
+
+    try:
+        tamanho_lote = int(request.args.get('lote', TAMANHO_LOTE_PADRAO))
+        if tamanho_lote <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"erro": "Parâmetro 'lote' deve ser um inteiro positivo."}), 400
+
+    # Lê o corpo em streaming, linha a linha, sem carregar o arquivo inteiro na memória
+    linhas = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    delimitador = request.args.get('delimitador', ',')
+
+    try:
+        resumo = PriceIngestor(tamanho_lote).ingerir(iter_registros(linhas, formato, delimitador))
+        return jsonify(resumo), 200
+    except ConflitoIngestaoError as e:
+        return jsonify({"erro": str(e), "resumo": e.resumo}), 409
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro inesperado ao importar preços: {e}")
+        return jsonify({"erro": "Erro interno ao importar preços", "detalhes": str(e)}), 500
@@ -1,37 +1,36 @@
 from flask import Blueprint, jsonify, request
-from app import db
 from app.models import (
     Cliente, 
     Assessor, 
-    QuestionarioSuitabilityVersao, 
-    Pergunta, 
-    OpcaoResposta, 
     RespostaSuitabilityCliente
 )
 from app.schemas import (
-    questionario_schema, 
-    respostas_historico_schema
+    respostas_historico_serializador,
+    resposta_suitability_load_options
 )
+from app.pagination import paginate_keyset, paginated_response
+from app.conditional import calcular_etag, com_etag, nao_modificado
+from app.services.questionnaire import questionnaire_cache
+from app.services.versioning import QUESTIONARIO, ler_versoes
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import desc
-from sqlalchemy.orm import joinedload
 
 bp = Blueprint('suitability', __name__)
 
 @bp.route('/suitability/questionario/ativo', methods=['GET'])
 @jwt_required() # Requer login (qualquer tipo)
 def get_active_questionnaire():
-    latest_version = QuestionarioSuitabilityVersao.query.order_by(
-        desc(QuestionarioSuitabilityVersao.DataVigencia)
-    ).options(
-        db.joinedload(QuestionarioSuitabilityVersao.perguntas)
-        .joinedload(Pergunta.opcoes)
-    ).first()
+    # Questionário inalterado: 304 com uma única leitura da versão do recurso
+    versao_recurso = ler_versoes([QUESTIONARIO])[QUESTIONARIO]
+    etag = calcular_etag('questionario-ativo', versao_recurso)
+    resposta = nao_modificado(etag)
+    if resposta is not None:
+        return resposta
 
-    if not latest_version:
+    questionario = questionnaire_cache.ativo(versao_recurso)
+    if not questionario:
         return jsonify({"erro": "Nenhuma versão do questionário encontrada"}), 404
 
-    return questionario_schema.jsonify(latest_version), 200
+    return com_etag(jsonify(questionario.dados), etag), 200
 
 @bp.route('/clientes/<int:cliente_id>/suitability/historico', methods=['GET'])
 @jwt_required()
@@ -50,10 +49,17 @@ def get_suitability_history(cliente_id):
     if not cliente:
         return jsonify({"erro": "Cliente não encontrado ou não autorizado"}), 404
 
-    historico = RespostaSuitabilityCliente.query.filter_by(
+    query = RespostaSuitabilityCliente.query.options(
+        *resposta_suitability_load_options
+    ).filter_by(
         ClienteID=cliente_id
-    ).order_by(
-        desc(RespostaSuitabilityCliente.DataResposta)
-    ).all()
+    )
+
+    # Mais recentes primeiro; RespostaID desempata respostas com a mesma DataResposta
+    historico, proximo_cursor = paginate_keyset(
+        query,
+        (RespostaSuitabilityCliente.DataResposta, RespostaSuitabilityCliente.RespostaID),
+        descending=True
+    )
 
-    return jsonify(respostas_historico_schema.dump(historico)), 200
\ No newline at end of file
+    return paginated_response(respostas_historico_serializador.serializar(historico), proximo_cursor), 200
\ No newline at end of file
@@ -17,6 +17,8 @@ from app.models import (
     ClienteGrupoLink
 )
 from marshmallow import fields
+from app.serializers import compilar
+from sqlalchemy.orm import selectinload
 
 
 #  ESQUEMAS DE APOIO
@@ -184,8 +186,20 @@ class ClienteSchema(ma.SQLAlchemyAutoSchema):
         )
 
 
+class ClienteListaSchema(ma.SQLAlchemyAutoSchema):
+    # Versão enxuta para listagens: apenas colunas do próprio Cliente, sem relacionamentos
+    class Meta:
+        model = Cliente
+        include_fk = True
+        fields = (
+            "ClienteID", "AssessorID", "CPF_CNPJ", "NomeCompleto", "Email",
+            "StatusCompliance", "DataUltimaAtualizacao"
+        )
+
+
 cliente_schema = ClienteSchema()
 clientes_schema = ClienteSchema(many=True)
+clientes_lista_schema = ClienteListaSchema(many=True)
 assessor_schema = AssessorSchema()
 portfolio_schema = PortfolioSchema()
 portfolios_schema = PortfolioSchema(many=True)
@@ -212,4 +226,46 @@ respostas_historico_schema = RespostaSuitabilitySchema(many=True)
 
 grupo_economico_schema = GrupoEconomicoSchema()
 grupos_economico_schema = GrupoEconomicoSchema(many=True)
-cliente_grupo_link_schema = ClienteGrupoLinkSchema()
\ No newline at end of file
+cliente_grupo_link_schema = ClienteGrupoLinkSchema()
+
+
+# SERIALIZADORES COMPILADOS (listagens): mesma saída JSON dos esquemas acima, sem percorrer
+# os campos do marshmallow a cada objeto (ver serializers.py)
+produto_serializador = compilar(produto_schema, json_nativo=True)
+produto_acao_serializador = compilar(produto_acao_schema, json_nativo=True)
+produto_rf_serializador = compilar(produto_rf_schema, json_nativo=True)
+produto_fundo_serializador = compilar(produto_fundo_schema, json_nativo=True)
+portfolios_serializador = compilar(portfolios_schema, json_nativo=True)
+posicoes_serializador = compilar(posicoes_schema, json_nativo=True)
+clientes_serializador = compilar(clientes_schema, json_nativo=True)
+clientes_lista_serializador = compilar(clientes_lista_schema, json_nativo=True)
+respostas_historico_serializador = compilar(respostas_historico_schema, json_nativo=True)
+
+# PERFIS DE CARREGAMENTO
+# Opções selectinload equivalentes aos campos aninhados de cada esquema: ao serializar listas,
+# cada relacionamento é carregado com uma consulta IN, em vez de uma consulta por objeto.
+
+resposta_suitability_load_options = (
+    selectinload(RespostaSuitabilityCliente.versao),
+)
+posicao_load_options = (
+    selectinload(Posicao.produto),
+    selectinload(Posicao.portfolio),
+)
+portfolio_load_options = (
+    selectinload(Portfolio.posicoes).selectinload(Posicao.produto),
+)
+questionario_load_options = (
+    selectinload(QuestionarioSuitabilityVersao.perguntas).selectinload(Pergunta.opcoes),
+)
+cliente_grupo_link_load_options = (
+    selectinload(ClienteGrupoLink.grupo),
+    selectinload(ClienteGrupoLink.cliente),
+)
+cliente_load_options = (
+    selectinload(Cliente.assessor),
+    selectinload(Cliente.contas),
+    selectinload(Cliente.portfolios),
+    selectinload(Cliente.respostas_suitability).selectinload(RespostaSuitabilityCliente.versao),
+    selectinload(Cliente.grupos).selectinload(ClienteGrupoLink.grupo),
+)
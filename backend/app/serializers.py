@@ -0,0 +1,301 @@
+import math
+from decimal import Decimal, ROUND_HALF_UP
+from functools import partial
+from marshmallow import fields, missing
+from app.models import Posicao, MovimentacaoConta, Conta
+
+# Serializadores "planos": geram a mesma estrutura dos esquemas marshmallow
+# a partir de linhas de consulta (Row/tuplas nomeadas), sem instanciar objetos mapeados.
+
+
+def _escala(coluna):
+    return Decimal(1).scaleb(-coluna.type.scale)
+
+
+# Mesmas casas decimais que o SQLAlchemyAutoSchema deriva das colunas Numeric
+CASAS_QUANTIDADE = _escala(Posicao.__table__.c.Quantidade)
+CASAS_CUSTO_MEDIO = _escala(Posicao.__table__.c.CustoMedio)
+CASAS_VALOR_MOVIMENTACAO = _escala(MovimentacaoConta.__table__.c.Valor)
+CASAS_SALDO = _escala(Conta.__table__.c.Saldo)
+
+
+def decimal_field(valor, casas=None):
+    """Equivalente a fields.Decimal(places=casas)."""
+    if valor is None:
+        return None
+    num = Decimal(str(valor))
+    if casas is not None and num.is_finite():
+        num = num.quantize(casas)
+    return num
+
+
+def decimal_string(valor):
+    """Equivalente a fields.Decimal(as_string=True)."""
+    if valor is None:
+        return None
+    return format(Decimal(str(valor)), 'f')
+
+
+def dump_produto(row):
+    """Equivalente a ProdutoFinanceiroSchema().dump() para uma linha com as colunas do produto."""
+    return {
+        "ProdutoID": row.ProdutoID,
+        "Ticker": row.Ticker,
+        "NomeProduto": row.NomeProduto,
+        "ClasseAtivo": row.ClasseAtivo,
+        "NivelRiscoProduto": row.NivelRiscoProduto,
+        "Emissor": row.Emissor
+    }
+
+
+def dump_posicao_consolidada(row, quantidade, custo_medio, valor_mercado, resultado_financeiro):
+    """Equivalente a PosicaoSchema().dump() de uma posição virtual (sem PosicaoID/portfolio)."""
+    return {
+        "PosicaoID": None,
+        "PortfolioID": None,
+        "ProdutoID": row.ProdutoID,
+        "Quantidade": decimal_field(quantidade, CASAS_QUANTIDADE),
+        "CustoMedio": decimal_field(custo_medio, CASAS_CUSTO_MEDIO),
+        "produto": dump_produto(row),
+        "portfolio": None,
+        "valor_mercado": decimal_string(valor_mercado),
+        "resultado_financeiro": decimal_string(resultado_financeiro)
+    }
+
+
+def dump_exposicao(row, valor_exposicao, percentual):
+    """Exposição look-through a um ativo final (services/lookthrough.py)."""
+    return {
+        "ProdutoID": row.ProdutoID,
+        "produto": dump_produto(row),
+        "valor_exposicao": decimal_string(valor_exposicao),
+        "percentual": decimal_string(percentual)
+    }
+
+
+def dump_posicao_valorizada(row, valor_mercado, resultado_financeiro):
+    """Equivalente a PosicaoSchema().dump() de uma Posicao com valor_mercado e resultado_financeiro."""
+    return {
+        "PosicaoID": row.PosicaoID,
+        "PortfolioID": row.PortfolioID,
+        "ProdutoID": row.ProdutoID,
+        "Quantidade": decimal_field(row.Quantidade, CASAS_QUANTIDADE),
+        "CustoMedio": decimal_field(row.CustoMedio, CASAS_CUSTO_MEDIO),
+        "produto": dump_produto(row),
+        "valor_mercado": decimal_string(valor_mercado),
+        "resultado_financeiro": decimal_string(resultado_financeiro)
+    }
+
+
+def dump_portfolio_valorizado(row, posicoes, valor_mercado_total, resultado_total_financeiro):
+    """Equivalente a PortfolioSchema().dump() com as posições já serializadas."""
+    return {
+        "PortfolioID": row.PortfolioID,
+        "ClienteID": row.ClienteID,
+        "NomePortfolio": row.NomePortfolio,
+        "posicoes": posicoes,
+        "valor_mercado_total": decimal_string(valor_mercado_total),
+        "resultado_total_financeiro": decimal_string(resultado_total_financeiro)
+    }
+
+
+def dump_snapshot_portfolio(row, snapshot):
+    """Valor de fechamento (SnapshotPortfolio) da carteira, sem o detalhe das posições."""
+    return {
+        "PortfolioID": row.PortfolioID,
+        "ClienteID": row.ClienteID,
+        "NomePortfolio": row.NomePortfolio,
+        "DataReferencia": snapshot.DataReferencia.isoformat(),
+        "quantidade_posicoes": snapshot.QuantidadePosicoes,
+        "valor_mercado_total": decimal_string(decimal_field(snapshot.ValorMercado, CASAS_SALDO)),
+        "custo_total": decimal_string(decimal_field(snapshot.CustoTotal, CASAS_SALDO)),
+        "resultado_total_financeiro": decimal_string(decimal_field(snapshot.ResultadoFinanceiro, CASAS_SALDO)),
+        "DataCalculo": snapshot.DataCalculo.isoformat() if snapshot.DataCalculo else None
+    }
+
+
+def dump_dia_desempenho(dia, retorno_acumulado):
+    """Um dia da série de desempenho da carteira (services/performance.py)."""
+    return {
+        "Data": dia.Data.isoformat(),
+        "valor_mercado": decimal_string(dia.valor_mercado),
+        "fluxo": decimal_string(dia.fluxo),
+        "retorno_diario": decimal_string(dia.retorno_diario),
+        "retorno_acumulado": decimal_string(retorno_acumulado)
+    }
+
+
+def _centavos(valor):
+    return decimal_string(Decimal(float(valor)).quantize(CASAS_SALDO, rounding=ROUND_HALF_UP))
+
+
+def dump_simulacao_cenarios(portfolio, valor_atual, estatisticas, parametros):
+    """Resultado da simulação de Monte Carlo (services/scenarios.py); valores em reais."""
+    return {
+        "PortfolioID": portfolio.PortfolioID,
+        "NomePortfolio": portfolio.NomePortfolio,
+        "valor_mercado_total": decimal_string(valor_atual),
+        "valor_esperado": _centavos(estatisticas["valor_esperado"]),
+        "desvio_padrao": _centavos(estatisticas["desvio_padrao"]),
+        "var": _centavos(estatisticas["var"]),
+        "expected_shortfall": _centavos(estatisticas["expected_shortfall"]),
+        "probabilidade_perda": round(estatisticas["probabilidade_perda"], 4),
+        "percentis": [
+            {"percentil": p, "valor": _centavos(v)} for p, v in estatisticas["percentis"].items()
+        ],
+        **parametros
+    }
+
+
+def dump_estatistica_produto(estatistica, dias_ano=252):
+    """Volatilidade anualizada, drawdowns e correlação com a referência a partir dos acumuladores."""
+    if estatistica is None:
+        return {"Volatilidade": None, "DrawdownMaximo": None, "DrawdownAtual": None, "Correlacao": None}
+
+    volatilidade = None
+    if estatistica.NumeroRetornos > 1:
+        volatilidade = round(math.sqrt(estatistica.M2Retorno / (estatistica.NumeroRetornos - 1) * dias_ano), 6)
+    correlacao = None
+    if estatistica.NumeroPares > 1 and estatistica.M2Par > 0 and estatistica.M2Referencia > 0:
+        correlacao = round(estatistica.CoMomento / math.sqrt(estatistica.M2Par * estatistica.M2Referencia), 6)
+
+    return {
+        "Volatilidade": volatilidade,
+        "DrawdownMaximo": round(estatistica.DrawdownMaximo, 6),
+        "DrawdownAtual": round(1 - float(estatistica.UltimoPreco) / float(estatistica.PrecoMaximo), 6),
+        "Correlacao": correlacao
+    }
+
+
+def dump_movimentacao(row, conta_id):
+    """Linha do extrato do ponto de vista de `conta_id`: Sentido 'Credito' (entrada) ou 'Debito' (saída)."""
+    return {
+        "MovimentacaoID": row.MovimentacaoID,
+        "DataHora": row.DataHora.isoformat() if row.DataHora else None,
+        "TipoMovimentacao": row.TipoMovimentacao,
+        "Sentido": 'Credito' if row.ContaDestinoID == conta_id else 'Debito',
+        "Valor": decimal_field(row.Valor, CASAS_VALOR_MOVIMENTACAO),
+        "ContaOrigemID": row.ContaOrigemID,
+        "ContaDestinoID": row.ContaDestinoID,
+        "Status": row.Status
+    }
+
+
+# --- Serializadores compilados ---
+# Para as listagens grandes: os campos de um esquema marshmallow viram, uma única vez, uma
+# tupla de (chave, atributo, conversor), e o dump percorre só essa tupla. O resultado é igual
+# ao de schema.dump(); com json_nativo=True os Decimais já saem como str (o mesmo texto que o
+# jsonify do Flask gera para Decimal), e o encoder C do json não precisa chamar o `default`.
+
+class _Ausente:
+    pass
+
+
+AUSENTE = _Ausente()
+
+
+def _conversor_decimal(campo, json_nativo):
+    casas, arredondamento, como_texto, allow_nan = campo.places, campo.rounding, campo.as_string, campo.allow_nan
+
+    def converter(valor):
+        num = Decimal(str(valor))
+        if allow_nan and num.is_nan():
+            num = Decimal("NaN")
+        if casas is not None and num.is_finite():
+            num = num.quantize(casas, rounding=arredondamento)
+        if como_texto:
+            return format(num, 'f')
+        return str(num) if json_nativo else num
+    return converter
+
+
+def _conversor_texto(valor):
+    return valor.decode("utf-8") if isinstance(valor, bytes) else str(valor)
+
+
+def _conversor(nome, campo, json_nativo):
+    """Função valor -> valor serializado equivalente a campo._serialize (None já tratado)."""
+    if isinstance(campo, fields.Nested):
+        aninhado = compilar(campo.schema, json_nativo)
+        if campo.schema.many or campo.many:
+            return aninhado.dump_many
+        return aninhado.dump
+    if type(campo) is fields.Decimal:
+        return _conversor_decimal(campo, json_nativo)
+    if type(campo) is fields.Integer and not campo.as_string:
+        return int
+    if type(campo) is fields.Float and not campo.as_string:
+        return float
+    if type(campo) is fields.String:
+        return _conversor_texto
+    if type(campo) in (fields.Date, fields.DateTime) and campo.format in (None, 'iso', 'iso8601'):
+        return lambda valor: valor.isoformat()
+    return lambda valor: campo._serialize(valor, nome, None)
+
+
+def _ler_objeto(obj, chave):
+    return getattr(obj, chave, AUSENTE)
+
+
+def _ler_item(obj, chave):
+    """Mesmo acesso de marshmallow.utils.get_value para objetos com __getitem__ (dict, Row)."""
+    try:
+        return obj[chave]
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return getattr(obj, chave, AUSENTE)
+
+
+class SerializadorCompilado:
+    """dump/dump_many com a mesma saída de um esquema marshmallow já instanciado."""
+
+    def __init__(self, schema, json_nativo=False):
+        if schema._hooks.get("pre_dump") or schema._hooks.get("post_dump"):
+            raise ValueError(f"{type(schema).__name__} tem hooks de dump; use schema.dump().")
+        self.many = schema.many
+        self._campos = []
+        for nome, campo in schema.dump_fields.items():
+            atributo = campo.attribute if campo.attribute is not None else nome
+            if "." in atributo or campo.dump_default is not missing or not campo._CHECK_ATTRIBUTE:
+                # Casos raros: delega ao próprio campo
+                self._campos.append((campo.data_key or nome, None, partial(campo.serialize, nome)))
+            else:
+                self._campos.append((campo.data_key or nome, atributo, _conversor(nome, campo, json_nativo)))
+
+    def dump(self, obj):
+        if obj is None:
+            return None
+        resultado = {}
+        ler = _ler_item if hasattr(obj, "__getitem__") else _ler_objeto
+        for chave, atributo, converter in self._campos:
+            if atributo is None:
+                valor = converter(obj)
+                if valor is missing:
+                    continue
+                resultado[chave] = valor
+                continue
+            valor = ler(obj, atributo)
+            if valor is AUSENTE:
+                continue
+            resultado[chave] = None if valor is None else converter(valor)
+        return resultado
+
+    def dump_many(self, objs):
+        if objs is None:
+            return None
+        dump = self.dump
+        return [dump(obj) for obj in objs]
+
+    def serializar(self, dados):
+        """Equivalente a schema.dump(dados) (lista se o esquema foi criado com many=True)."""
+        return self.dump_many(dados) if self.many else self.dump(dados)
+
+
+_compilados = {}
+
+
+def compilar(schema, json_nativo=False):
+    """SerializadorCompilado do esquema (um por instância de esquema e modo)."""
+    chave = (id(schema), json_nativo)
+    if chave not in _compilados:
+        _compilados[chave] = (schema, SerializadorCompilado(schema, json_nativo))
+    return _compilados[chave][1]
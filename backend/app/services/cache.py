@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinela para diferenciar "não está no cache" de um valor None armazenado
+MISSING = object()
+
+
+class TTLCache:
+    """Cache LRU em memória, thread-safe, com tamanho máximo e tempo de vida por entrada."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._dados.clear()
+
+    def get(self, key, default=MISSING):
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._dados.get(key)
+            if entrada is None:
+                return default
+            valor, expira_em = entrada
+            if expira_em <= agora:
+                del self._dados[key]
+                return default
+            self._dados.move_to_end(key)
+            return valor
+
+    def get_many(self, keys):
+        """Retorna ({chave: valor} encontrados, [chaves ausentes ou expiradas])."""
+        agora = time.monotonic()
+        encontrados = {}
+        ausentes = []
+        with self._lock:
+            for key in keys:
+                entrada = self._dados.get(key)
+                if entrada is None or entrada[1] <= agora:
+                    if entrada is not None:
+                        del self._dados[key]
+                    ausentes.append(key)
+                    continue
+                self._dados.move_to_end(key)
+                encontrados[key] = entrada[0]
+        return encontrados, ausentes
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, mapping):
+        expira_em = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in mapping.items():
+                self._dados[key] = (value, expira_em)
+                self._dados.move_to_end(key)
+            while len(self._dados) > self.maxsize:
+                self._dados.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._dados.pop(key, None)
+
+    def invalidate_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._dados.pop(key, None)
+
+    def invalidate_where(self, predicado):
+        """Remove as entradas cujo valor satisfaz `predicado(valor)`."""
+        with self._lock:
+            for key in [k for k, (valor, _) in self._dados.items() if predicado(valor)]:
+                del self._dados[key]
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
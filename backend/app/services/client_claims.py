@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+from app import db
+from app.models import Cliente, Conta, Portfolio, RespostaSuitabilityCliente
+
+# Claims do token do cliente: as rotas do portal que só precisam dos IDs leem ClienteID, ContaID e
+# PortfolioID do próprio JWT, sem o SELECT em Cliente a cada requisição. Quando esses dados mudam,
+# o ClienteID entra na lista em memória de revogações e os tokens emitidos até ali passam a ter as
+# claims relidas do banco (o token continua válido). Entre processos, a defasagem é limitada pela
+# validade do token (JWT_ACCESS_TOKEN_EXPIRES).
+ClaimsCliente = namedtuple('ClaimsCliente', 'ClienteID ContaID PortfolioID PerfilCalculado')
+
+
+def buscar_claims_cliente(cliente_id):
+    """Conta e portfólio principais (menor ID) e perfil de suitability mais recente, em uma consulta."""
+    perfil_recente = select(RespostaSuitabilityCliente.PerfilCalculado).where(
+        RespostaSuitabilityCliente.ClienteID == Cliente.ClienteID
+    ).order_by(RespostaSuitabilityCliente.DataResposta.desc()).limit(1).scalar_subquery()
+
+    conta = select(Conta.ContaID).where(
+        Conta.ClienteID == Cliente.ClienteID
+    ).order_by(Conta.ContaID).limit(1).scalar_subquery()
+
+    portfolio = select(Portfolio.PortfolioID).where(
+        Portfolio.ClienteID == Cliente.ClienteID
+    ).order_by(Portfolio.PortfolioID).limit(1).scalar_subquery()
+
+    linha = db.session.execute(
+        select(Cliente.ClienteID, conta.label('ContaID'), portfolio.label('PortfolioID'),
+               perfil_recente.label('PerfilCalculado'))
+        .where(Cliente.ClienteID == cliente_id)
+    ).first()
+    return ClaimsCliente(*linha) if linha else None
+
+
+def claims_token_cliente(cliente_id):
+    """additional_claims do access token do cliente."""
+    claims = buscar_claims_cliente(cliente_id)
+    return {
+        'role': 'cliente',
+        'conta_id': claims.ContaID,
+        'portfolio_id': claims.PortfolioID,
+        'perfil': claims.PerfilCalculado
+    }
+
+
+class ClaimRevocations:
+    """Instante da última alteração das claims por ClienteID.
+
+    Entradas mais antigas que a validade do token são descartadas: os tokens anteriores a elas
+    já expiraram.
+    """
+
+    def __init__(self, validade=900):
+        self.validade = validade
+        self._revogados = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        expira = app.config.get('JWT_ACCESS_TOKEN_EXPIRES', timedelta(minutes=15))
+        with self._lock:
+            # False: tokens sem expiração, as entradas nunca são descartadas
+            self.validade = expira.total_seconds() if isinstance(expira, timedelta) else expira or None
+            self._revogados.clear()
+
+    def revogar(self, cliente_ids):
+        agora = time.time()
+        with self._lock:
+            for cliente_id in cliente_ids:
+                self._revogados.pop(cliente_id, None)
+                self._revogados[cliente_id] = agora
+            if self.validade is not None:
+                # Ordem de inserção = ordem de revogação: as mais antigas estão no início
+                limite = agora - self.validade
+                for cliente_id, instante in list(self._revogados.items()):
+                    if instante >= limite:
+                        break
+                    del self._revogados[cliente_id]
+
+    def revogado(self, cliente_id, emitido_em):
+        """True se as claims mudaram depois (ou no mesmo segundo) da emissão do token (`iat`)."""
+        with self._lock:
+            instante = self._revogados.get(cliente_id)
+        return instante is not None and emitido_em <= instante
+
+
+claim_revocations = ClaimRevocations()
+
+
+def marcar_claims_alteradas(session, cliente_ids):
+    """Agenda a revogação para escritas feitas fora do ORM (ex.: UPDATEs em lote)."""
+    session.info.setdefault('claims_clientes_alteradas', set()).update(cliente_ids)
+
+
+def _registrar_cliente_alterado(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        marcar_claims_alteradas(session, [target.ClienteID])
+
+
+event.listen(Cliente, 'after_delete', _registrar_cliente_alterado)
+for _evento in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Conta, _evento, _registrar_cliente_alterado)
+    event.listen(Portfolio, _evento, _registrar_cliente_alterado)
+    event.listen(RespostaSuitabilityCliente, _evento, _registrar_cliente_alterado)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _revogar_apos_commit(session):
+    clientes = session.info.pop('claims_clientes_alteradas', None)
+    if clientes:
+        claim_revocations.revogar(clientes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_apos_rollback(session):
+    session.info.pop('claims_clientes_alteradas', None)
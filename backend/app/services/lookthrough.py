@@ -0,0 +1,213 @@
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import aliased, object_session
+from app import db
+from app.models import ComposicaoFundo, ProdutoFinanceiro
+from app.serializers import CASAS_SALDO, dump_exposicao
+from app.services.cache import TTLCache
+from app.services.pricing import TAMANHO_LOTE_IN, price_cache
+from app.services.valuation import _buscar_posicoes, avaliar, para_decimais
+
+# Exposição look-through: fundos (ComposicaoFundo) são abertos recursivamente até os ativos
+# finais, usando a composição mais recente com DataPosicao <= data de cada fundo. As composições
+# são lidas por nível, com uma consulta para todos os fundos do nível (não uma por fundo), e a
+# expansão de cada produto fica em cache entre requisições.
+
+# Profundidade máxima de fundos dentro de fundos (proteção além da detecção de ciclos)
+MAX_NIVEIS = 32
+CASAS_PERCENTUAL = Decimal('0.0001')
+
+# pesos: {ProdutoID final: fração do valor}; fundos: produtos abertos na expansão (inclusive o próprio)
+Expansao = namedtuple('Expansao', 'pesos fundos')
+
+
+class CicloComposicaoError(ValueError):
+    pass
+
+
+def _carregar_composicoes(produto_ids, data):
+    """{ProdutoID: [(AtivoComponenteID, fração)]} na última DataPosicao <= data; [] para não-fundos."""
+    recente = aliased(ComposicaoFundo)
+    ultima_data = select(func.max(recente.DataPosicao)).where(
+        recente.FundoProdutoID == ComposicaoFundo.FundoProdutoID,
+        recente.DataPosicao <= data
+    ).scalar_subquery()
+
+    composicoes = {pid: [] for pid in produto_ids}
+    for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+        lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+        for fundo_id, ativo_id, percentual in db.session.execute(
+            select(ComposicaoFundo.FundoProdutoID, ComposicaoFundo.AtivoComponenteID,
+                   ComposicaoFundo.PercentualAlocacao)
+            .where(ComposicaoFundo.FundoProdutoID.in_(lote), ComposicaoFundo.DataPosicao == ultima_data)
+        ):
+            composicoes[fundo_id].append((ativo_id, percentual / 100))
+    return composicoes
+
+
+class FundExpansionCache:
+    """Expansão look-through por (ProdutoID, data).
+
+    Escritas em ComposicaoFundo descartam, após o commit, as expansões que passaram pelo fundo.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        self._cache.configure(
+            maxsize=app.config.get('LOOKTHROUGH_CACHE_MAXSIZE'),
+            ttl=app.config.get('LOOKTHROUGH_CACHE_TTL')
+        )
+
+    def expandir(self, produto_ids, data):
+        """Retorna {ProdutoID: Expansao}; levanta CicloComposicaoError se um fundo contém a si mesmo."""
+        chaves = [(pid, data) for pid in dict.fromkeys(produto_ids)]
+        encontrados, ausentes = self._cache.get_many(chaves)
+        expansoes = {pid: expansao for (pid, _), expansao in encontrados.items()}
+
+        # Lê as composições nível a nível; produtos já expandidos (cache) não são relidos
+        composicoes = {}
+        pendentes = [pid for pid, _ in ausentes]
+        for _ in range(MAX_NIVEIS):
+            if not pendentes:
+                break
+            composicoes.update(_carregar_composicoes(pendentes, data))
+            proximos = {ativo for pid in pendentes for ativo, _ in composicoes[pid]}
+            proximos -= composicoes.keys()
+            if proximos:
+                encontrados, _ = self._cache.get_many([(pid, data) for pid in proximos])
+                expansoes.update({pid: expansao for (pid, _), expansao in encontrados.items()})
+            pendentes = [pid for pid in proximos if pid not in expansoes]
+        else:
+            if pendentes:
+                raise CicloComposicaoError(f"Composição de fundos com mais de {MAX_NIVEIS} níveis.")
+
+        novas = {}
+
+        def resolver(produto_id, caminho):
+            if produto_id in expansoes:
+                return expansoes[produto_id]
+            if produto_id in caminho:
+                ciclo = caminho[caminho.index(produto_id):] + [produto_id]
+                raise CicloComposicaoError(
+                    "Ciclo na composição de fundos: " + " -> ".join(str(pid) for pid in ciclo))
+
+            pesos = {}
+            fundos = {produto_id}
+            alocado = Decimal(0)
+            for ativo_id, fracao in composicoes[produto_id]:
+                componente = resolver(ativo_id, caminho + [produto_id])
+                for final_id, peso in componente.pesos.items():
+                    pesos[final_id] = pesos.get(final_id, Decimal(0)) + fracao * peso
+                fundos |= componente.fundos
+                alocado += fracao
+
+            # Não-fundos e a parcela não detalhada da carteira do fundo ficam no próprio produto
+            if alocado != 1:
+                pesos[produto_id] = pesos.get(produto_id, Decimal(0)) + (1 - alocado)
+
+            expansao = Expansao(pesos, frozenset(fundos))
+            expansoes[produto_id] = novas[(produto_id, data)] = expansao
+            return expansao
+
+        for pid, _ in ausentes:
+            resolver(pid, [])
+        self._cache.set_many(novas)
+        return {pid: expansoes[pid] for pid, _ in chaves}
+
+    def invalidate(self, fundo_ids=None):
+        if fundo_ids is None:
+            self._cache.clear()
+        else:
+            fundo_ids = set(fundo_ids)
+            self._cache.invalidate_where(lambda expansao: not fundo_ids.isdisjoint(expansao.fundos))
+
+
+expansoes_fundos = FundExpansionCache()
+
+
+def _buscar_produtos(produto_ids):
+    produtos = {}
+    for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+        lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+        for linha in db.session.execute(
+            select(ProdutoFinanceiro.ProdutoID, ProdutoFinanceiro.Ticker, ProdutoFinanceiro.NomeProduto,
+                   ProdutoFinanceiro.ClasseAtivo, ProdutoFinanceiro.NivelRiscoProduto,
+                   ProdutoFinanceiro.Emissor)
+            .where(ProdutoFinanceiro.ProdutoID.in_(lote))
+        ):
+            produtos[linha.ProdutoID] = linha
+    return produtos
+
+
+def exposicao_look_through(posicoes, data):
+    """Exposição por ativo final de posições (ProdutoID, Quantidade), a preços atuais.
+
+    Fundos sem composição até `data` aparecem como o próprio fundo.
+    """
+    posicoes = [p for p in posicoes if p.Quantidade]
+    mapa_precos = price_cache.get_prices(list({p.ProdutoID for p in posicoes}))
+    valores = para_decimais(avaliar(
+        [p.Quantidade for p in posicoes],
+        [mapa_precos.get(p.ProdutoID, 0) for p in posicoes],
+        custos_totais=[0] * len(posicoes)
+    ).valor_mercado)
+
+    expansoes = expansoes_fundos.expandir([p.ProdutoID for p in posicoes], data)
+    exposicoes = {}
+    for posicao, valor in zip(posicoes, valores):
+        for final_id, peso in expansoes[posicao.ProdutoID].pesos.items():
+            exposicoes[final_id] = exposicoes.get(final_id, Decimal(0)) + valor * peso
+
+    total = sum(valores, Decimal(0))
+    produtos = _buscar_produtos(list(exposicoes))
+    itens = []
+    for produto_id, valor in sorted(exposicoes.items(), key=lambda item: (-item[1], item[0])):
+        percentual = (valor / total * 100).quantize(CASAS_PERCENTUAL) if total else Decimal(0)
+        itens.append(dump_exposicao(
+            produtos[produto_id], valor.quantize(CASAS_SALDO, rounding=ROUND_HALF_UP), percentual))
+
+    por_classe = {}
+    for item in itens:
+        classe = item["produto"]["ClasseAtivo"]
+        por_classe[classe] = por_classe.get(classe, Decimal(0)) + Decimal(item["valor_exposicao"])
+
+    return {
+        "data": data.isoformat(),
+        "valor_mercado_total": format(total, 'f'),
+        "exposicoes": itens,
+        "por_classe": {classe: format(valor, 'f') for classe, valor in por_classe.items()}
+    }
+
+
+def exposicao_portfolio(portfolio_id, data):
+    return exposicao_look_through(_buscar_posicoes([portfolio_id]), data)
+
+
+def marcar_composicoes_alteradas(session, fundo_ids):
+    """Agenda a invalidação para escritas em ComposicaoFundo feitas fora do ORM."""
+    session.info.setdefault('composicoes_alteradas', set()).update(fundo_ids)
+
+
+def _apos_alterar_composicao(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        marcar_composicoes_alteradas(session, [target.FundoProdutoID])
+
+
+for _evento in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(ComposicaoFundo, _evento, _apos_alterar_composicao)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_apos_commit(session):
+    fundos = session.info.pop('composicoes_alteradas', None)
+    if fundos:
+        expansoes_fundos.invalidate(fundos)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_apos_rollback(session):
+    session.info.pop('composicoes_alteradas', None)
@@ -0,0 +1,519 @@
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from flask import current_app
+from sqlalchemy import insert, update, delete, select, bindparam, exc, text
+from app import db
+from app.models import (
+    Portfolio,
+    Conta,
+    MovimentacaoConta,
+    Ordem,
+    Posicao,
+    Cliente
+)
+from app.serializers import CASAS_CUSTO_MEDIO, CASAS_SALDO
+from app.services.pricing import price_cache
+from app.services.trading_context import trading_context
+from app.services.versioning import incrementar_versoes, recurso
+
+TIPOS_ORDEM = ("Compra", "Venda")
+CAMPOS_ORDEM = ["portfolio_id", "produto_id", "tipo_ordem", "quantidade", "preco_unitario"]
+CAMPOS_ORDEM_LOTE = ["produto_id", "tipo_ordem", "quantidade", "preco_unitario"]
+TOLERANCIA_PRECO = Decimal('0.05')
+RISCO_PADRAO_PRODUTO = 3
+MAX_ORDENS_LOTE = 500
+MAX_TENTATIVAS_LOTE = 3
+
+
+class OrdemRejeitada(Exception):
+    """Ordem recusada por uma regra de negócio, com o corpo JSON e o status HTTP da resposta."""
+
+    def __init__(self, resposta, status=400):
+        super().__init__(resposta.get("erro"))
+        self.resposta = resposta
+        self.status = status
+
+
+class ConflitoConcorrencia(Exception):
+    """Saldo ou posição alterados por outra transação entre a leitura e a escrita."""
+    pass
+
+
+# --- Regras compartilhadas por /ordem e /ordens/lote ---
+
+def ler_ordem(data, campos=CAMPOS_ORDEM):
+    """Valida o payload de uma ordem e retorna (produto_id, tipo_ordem, quantidade, preco_unitario)."""
+    if not isinstance(data, dict) or not all(field in data for field in campos):
+        raise OrdemRejeitada({"erro": f"Campos obrigatórios em falta: {campos}"})
+
+    produto_id = data.get("produto_id")
+    try:
+        # bool é subclasse de int e float fracionário seria truncado: nenhum dos dois é um ID
+        if isinstance(produto_id, bool) or (isinstance(produto_id, float) and not produto_id.is_integer()):
+            raise ValueError
+        produto_id = int(produto_id)
+    except (TypeError, ValueError, OverflowError):
+        raise OrdemRejeitada({"erro": "ID do Produto inválido."})
+
+    tipo_ordem = str(data.get("tipo_ordem") or "").strip().capitalize()
+    try:
+        quantidade = Decimal(str(data.get("quantidade", 0)))
+        preco_unitario = Decimal(str(data.get("preco_unitario", 0)))
+        if not quantidade.is_finite() or not preco_unitario.is_finite():
+            raise ValueError
+    except Exception:
+        raise OrdemRejeitada({"erro": "Quantidade ou Preço Unitário inválidos."})
+
+    if quantidade <= 0 or preco_unitario <= 0:
+        raise OrdemRejeitada({"erro": "Quantidade e Preço Unitário devem ser positivos."})
+
+    if tipo_ordem not in TIPOS_ORDEM:
+        raise OrdemRejeitada({"erro": "Tipo de Ordem inválido. Use 'Compra' ou 'Venda'."})
+
+    return produto_id, tipo_ordem, quantidade, preco_unitario
+
+
+# Recusas usadas em mais de um ponto (ORM, lote e procedure) com o mesmo corpo de resposta
+
+def erro_portfolio_nao_autorizado():
+    return OrdemRejeitada({"erro": "Portfólio não encontrado ou não autorizado para este usuário."}, 404)
+
+
+def erro_compliance(status_compliance):
+    return OrdemRejeitada({
+        "erro": "Operação não permitida.",
+        "mensagem": f"O Status Compliance do cliente é '{status_compliance}'. Apenas clientes 'Aprovado' podem negociar."
+    }, 403)
+
+
+def erro_produto_nao_encontrado(produto_id):
+    return OrdemRejeitada({"erro": f"Produto com ID {produto_id} não encontrado."}, 404)
+
+
+def erro_preco_defasado(preco_banco):
+    return OrdemRejeitada({
+        "erro": "Preço defasado.",
+        "preco_atual": str(preco_banco),
+        "mensagem": "O preço mudou significativamente (mais de 5%). Por favor, recarregue a cotação."
+    })
+
+
+def erro_sem_suitability():
+    return OrdemRejeitada({"erro": "Cliente não possui perfil de risco (Suitability) definido."})
+
+
+def erro_perfil_incompativel(perfil_cliente, risco_produto):
+    return OrdemRejeitada({
+        "erro": f"Produto (Risco {risco_produto}) incompatível com o perfil '{perfil_cliente}' do cliente."})
+
+
+def erro_sem_conta():
+    return OrdemRejeitada({"erro": "Cliente não possui conta associada para liquidação."})
+
+
+def erro_saldo_insuficiente(saldo, valor_total_ordem):
+    return OrdemRejeitada(
+        {"erro": f"Saldo insuficiente. Saldo: {saldo:.2f}, Necessário: {valor_total_ordem:.2f}"})
+
+
+def erro_quantidade_insuficiente(qtd_disponivel, quantidade):
+    return OrdemRejeitada({
+        "erro": f"Quantidade insuficiente para venda. Disponível: {qtd_disponivel}, Tentando vender: {quantidade}"})
+
+
+def verificar_role(role):
+    if role not in ('assessor', 'cliente'):
+        raise OrdemRejeitada({"erro": "Role de usuário não reconhecida."}, 403)
+
+
+def buscar_portfolio_autorizado(portfolio_id, role, user_id):
+    verificar_role(role)
+    portfolio_query = Portfolio.query.filter(Portfolio.PortfolioID == portfolio_id)
+
+    if role == 'assessor':
+        # Assessor só pode operar em portfólios de seus clientes
+        portfolio = portfolio_query.join(Cliente).filter(Cliente.AssessorID == user_id).first()
+    else:
+        # Cliente só pode operar em seus próprios portfólios
+        portfolio = portfolio_query.filter(Portfolio.ClienteID == user_id).first()
+
+    if not portfolio:
+        raise erro_portfolio_nao_autorizado()
+    return portfolio
+
+
+def verificar_compliance(status_compliance):
+    if status_compliance != 'Aprovado':
+        raise erro_compliance(status_compliance)
+
+
+def verificar_preco(preco_banco, preco_unitario):
+    """Recusa ordens com preço mais de 5% distante do último preço de fechamento."""
+    if preco_banco is None:
+        return
+    if abs(preco_banco - preco_unitario) > preco_banco * TOLERANCIA_PRECO:
+        raise erro_preco_defasado(preco_banco)
+
+
+def verificar_suitability(perfil_cliente, nivel_risco_produto):
+    risco_produto = nivel_risco_produto or RISCO_PADRAO_PRODUTO
+
+    permitido = False
+    if perfil_cliente == 'Conservador' and risco_produto <= 2: permitido = True
+    if perfil_cliente == 'Moderado' and risco_produto <= 4: permitido = True
+    if perfil_cliente == 'Agressivo': permitido = True
+
+    if not permitido:
+        raise erro_perfil_incompativel(perfil_cliente, risco_produto)
+
+
+def valor_liquidacao(quantidade, preco_unitario):
+    """Valor financeiro da ordem em centavos: o mesmo valor é lançado na Conta e na MovimentacaoConta."""
+    return (quantidade * preco_unitario).quantize(CASAS_SALDO, rounding=ROUND_HALF_UP)
+
+
+def novo_custo_medio(quantidade_atual, custo_atual, quantidade, valor_total_ordem):
+    """Custo médio após uma compra, arredondado como a coluna CustoMedio."""
+    quantidade_total_nova = quantidade_atual + quantidade
+    custo = (quantidade_atual * custo_atual + valor_total_ordem) / quantidade_total_nova
+    return custo.quantize(CASAS_CUSTO_MEDIO, rounding=ROUND_HALF_UP)
+
+
+# --- Escritas atômicas de saldo e posição ---
+# Cada alteração é um UPDATE condicional sobre o valor atual da linha (Saldo = Saldo - :v
+# WHERE Saldo >= :v), sem ler-verificar-gravar: a verificação e a escrita acontecem no
+# mesmo comando, então ordens concorrentes do mesmo cliente não perdem atualizações e
+# não dependem de bloqueios de leitura (que o dialeto do SQL Server ignora em with_for_update).
+# Ordem fixa de escrita: Conta antes de Posicao, para evitar deadlocks entre compras e vendas.
+
+_conta = Conta.__table__
+_posicao = Posicao.__table__
+
+
+def debitar_conta(conta_id, valor):
+    """Debita `valor` se houver saldo. Retorna False (sem alterar nada) se o saldo for insuficiente."""
+    resultado = db.session.execute(
+        update(_conta)
+        .where(_conta.c.ContaID == conta_id, _conta.c.Saldo >= valor)
+        .values(Saldo=_conta.c.Saldo - valor)
+    )
+    return resultado.rowcount == 1
+
+
+def creditar_conta(conta_id, valor):
+    db.session.execute(
+        update(_conta).where(_conta.c.ContaID == conta_id).values(Saldo=_conta.c.Saldo + valor)
+    )
+
+
+def ler_saldo(conta_id):
+    return db.session.execute(select(_conta.c.Saldo).where(_conta.c.ContaID == conta_id)).scalar()
+
+
+def baixar_posicao(portfolio_id, produto_id, quantidade):
+    """Retira `quantidade` da posição se houver o suficiente; remove a posição que zerar."""
+    filtro = (_posicao.c.PortfolioID == portfolio_id, _posicao.c.ProdutoID == produto_id)
+    resultado = db.session.execute(
+        update(_posicao)
+        .where(*filtro, _posicao.c.Quantidade >= quantidade)
+        .values(Quantidade=_posicao.c.Quantidade - quantidade)
+    )
+    if resultado.rowcount != 1:
+        return False
+    db.session.execute(delete(_posicao).where(*filtro, _posicao.c.Quantidade == 0))
+    return True
+
+
+def somar_posicao(portfolio_id, produto_id, quantidade, valor_total_ordem, preco_unitario):
+    """Soma uma compra à posição, recalculando o custo médio no próprio UPDATE."""
+    atualizar = update(_posicao).where(
+        _posicao.c.PortfolioID == portfolio_id, _posicao.c.ProdutoID == produto_id
+    ).values(
+        # No SET, as colunas à direita referem-se aos valores anteriores ao UPDATE
+        CustoMedio=(_posicao.c.Quantidade * _posicao.c.CustoMedio + valor_total_ordem)
+                   / (_posicao.c.Quantidade + quantidade),
+        Quantidade=_posicao.c.Quantidade + quantidade
+    )
+    if db.session.execute(atualizar).rowcount == 1:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(_posicao).values(
+                PortfolioID=portfolio_id, ProdutoID=produto_id,
+                Quantidade=quantidade, CustoMedio=preco_unitario
+            ))
+    except exc.IntegrityError:
+        # Outra ordem criou a posição entre o UPDATE e o INSERT (uq_portfolio_produto)
+        db.session.execute(atualizar)
+
+
+# --- Execução pela stored procedure (SQL Server) ---
+# sp_ExecutarOrdem (Procedure, transaction.sql) faz as mesmas verificações e escritas em uma
+# única chamada e devolve uma linha (Codigo, OrdemID, Texto, Numero, Risco); cada código de
+# recusa é convertido na mesma resposta do caminho ORM.
+
+_RECUSAS_PROCEDURE = {
+    1: lambda linha, ordem: erro_portfolio_nao_autorizado(),
+    2: lambda linha, ordem: erro_compliance(linha.Texto),
+    3: lambda linha, ordem: erro_produto_nao_encontrado(ordem['produto_id']),
+    4: lambda linha, ordem: erro_preco_defasado(linha.Numero),
+    5: lambda linha, ordem: erro_sem_suitability(),
+    6: lambda linha, ordem: erro_perfil_incompativel(linha.Texto, linha.Risco),
+    7: lambda linha, ordem: erro_sem_conta(),
+    8: lambda linha, ordem: erro_saldo_insuficiente(linha.Numero, ordem['valor_total_ordem']),
+    9: lambda linha, ordem: erro_quantidade_insuficiente(
+        linha.Numero if linha.Numero is not None else 0, ordem['quantidade']),
+}
+
+
+def usar_procedure():
+    """ORDER_EXECUTION_ENGINE='procedure' só vale no SQL Server; no SQLite (fallback) segue o ORM."""
+    return (current_app.config.get('ORDER_EXECUTION_ENGINE') == 'procedure'
+            and db.engine.dialect.name == 'mssql')
+
+
+def executar_ordem_procedure(portfolio_id, produto_id, tipo_ordem, quantidade, preco_unitario, role, user_id):
+    """Executa a ordem com sp_ExecutarOrdem e retorna o OrdemID (ou levanta OrdemRejeitada)."""
+    verificar_role(role)
+    linha = db.session.execute(
+        text(
+            "EXEC sp_ExecutarOrdem @PortfolioID = :portfolio_id, @ProdutoID = :produto_id, "
+            "@TipoOrdem = :tipo_ordem, @Quantidade = :quantidade, @PrecoUnitario = :preco_unitario, "
+            "@UsuarioID = :usuario_id, @Role = :role"
+        ),
+        {
+            'portfolio_id': portfolio_id, 'produto_id': produto_id, 'tipo_ordem': tipo_ordem,
+            'quantidade': quantidade, 'preco_unitario': preco_unitario,
+            'usuario_id': user_id, 'role': role
+        }
+    ).one()
+
+    if linha.Codigo != 0:
+        db.session.rollback()
+        recusa = _RECUSAS_PROCEDURE.get(linha.Codigo)
+        if recusa is None:
+            raise RuntimeError(f"sp_ExecutarOrdem retornou código desconhecido: {linha.Codigo}")
+        raise recusa(linha, {
+            'produto_id': produto_id,
+            'quantidade': quantidade,
+            'valor_total_ordem': valor_liquidacao(quantidade, preco_unitario)
+        })
+
+    db.session.commit()
+    return linha.OrdemID
+
+
+# --- Execução em lote ---
+
+class _PosicaoSimulada:
+    __slots__ = ('posicao_id', 'quantidade', 'custo_medio', 'quantidade_lida', 'custo_lido')
+
+    def __init__(self, posicao_id, quantidade, custo_medio):
+        self.posicao_id = posicao_id
+        self.quantidade = self.quantidade_lida = quantidade
+        self.custo_medio = self.custo_lido = custo_medio
+
+
+class OrderBatch:
+    """Executa várias ordens de um mesmo portfólio em uma única transação.
+
+    O contexto (cliente, perfil, conta, produtos, preços e posições) é lido uma vez;
+    cada ordem é validada em memória contra o saldo e as posições resultantes das
+    anteriores, e as ordens aceitas são gravadas com comandos em lote.
+    Com `atomico=True`, qualquer rejeição cancela o lote inteiro.
+
+    As escritas são condicionais ao estado lido (saldo mínimo, quantidades inalteradas);
+    se outra transação mudou a conta ou as posições no meio tempo, o lote é refeito.
+    """
+
+    def __init__(self, portfolio, atomico=False):
+        self.portfolio = portfolio
+        self.atomico = atomico
+
+    def _carregar_contexto(self, produto_ids):
+        contexto = trading_context.get_cliente(self.portfolio.ClienteID)
+        verificar_compliance(contexto.StatusCompliance)
+
+        if contexto.PerfilCalculado is None:
+            raise erro_sem_suitability()
+        self.perfil_cliente = contexto.PerfilCalculado
+
+        if contexto.ContaID is None:
+            raise erro_sem_conta()
+        # O saldo é lido sempre do banco: só os dados que mudam pouco ficam no cache
+        self.conta = db.session.query(Conta.ContaID, Conta.Saldo).filter(Conta.ContaID == contexto.ContaID).one()
+
+        self.riscos = {
+            produto_id: produto.NivelRiscoProduto
+            for produto_id, produto in trading_context.get_produtos(produto_ids).items()
+        }
+        self.precos = price_cache.get_prices(list(self.riscos))
+
+        self.posicoes = {
+            p.ProdutoID: _PosicaoSimulada(p.PosicaoID, p.Quantidade, p.CustoMedio)
+            for p in db.session.query(
+                Posicao.PosicaoID, Posicao.ProdutoID, Posicao.Quantidade, Posicao.CustoMedio
+            ).filter(
+                Posicao.PortfolioID == self.portfolio.PortfolioID,
+                Posicao.ProdutoID.in_(produto_ids)
+            ).all()
+        } if produto_ids else {}
+
+    def _simular(self, produto_id, tipo_ordem, quantidade, preco_unitario):
+        """Valida uma ordem contra o estado simulado e, se aceita, aplica-a nesse estado."""
+        if produto_id not in self.riscos:
+            raise erro_produto_nao_encontrado(produto_id)
+
+        verificar_preco(self.precos.get(produto_id), preco_unitario)
+        verificar_suitability(self.perfil_cliente, self.riscos[produto_id])
+
+        valor_total_ordem = valor_liquidacao(quantidade, preco_unitario)
+        posicao = self.posicoes.get(produto_id)
+
+        if tipo_ordem == "Compra":
+            if self.saldo < valor_total_ordem:
+                raise erro_saldo_insuficiente(self.saldo, valor_total_ordem)
+            self.saldo -= valor_total_ordem
+            self.saldo_minimo = min(self.saldo_minimo, self.saldo)
+            if posicao is not None and posicao.quantidade > 0:
+                posicao.custo_medio = novo_custo_medio(
+                    posicao.quantidade, posicao.custo_medio, quantidade, valor_total_ordem)
+                posicao.quantidade += quantidade
+            elif posicao is not None:
+                # Posição zerada por uma venda anterior do lote: recomeça com o preço da compra
+                posicao.quantidade, posicao.custo_medio = quantidade, preco_unitario
+            else:
+                self.posicoes[produto_id] = _PosicaoSimulada(None, quantidade, preco_unitario)
+            return {
+                'ContaOrigemID': self.conta.ContaID, 'ContaDestinoID': None,
+                'TipoMovimentacao': 'Aplicacao', 'Valor': valor_total_ordem
+            }
+
+        if posicao is None or posicao.quantidade < quantidade:
+            qtd_disponivel = posicao.quantidade if posicao else 0
+            raise erro_quantidade_insuficiente(qtd_disponivel, quantidade)
+        posicao.quantidade -= quantidade
+        self.saldo += valor_total_ordem
+        return {
+            'ContaOrigemID': None, 'ContaDestinoID': self.conta.ContaID,
+            'TipoMovimentacao': 'Resgate', 'Valor': valor_total_ordem
+        }
+
+    def _gravar(self, aceitas):
+        agora = datetime.utcnow()
+        movimentacoes = [dict(mov, Status='Processada', DataHora=agora) for _, _, mov in aceitas]
+        mov_ids = db.session.execute(
+            insert(MovimentacaoConta).returning(MovimentacaoConta.MovimentacaoID, sort_by_parameter_order=True),
+            movimentacoes
+        ).scalars().all()
+
+        ordens = [
+            {
+                'PortfolioID': self.portfolio.PortfolioID,
+                'ProdutoID': produto_id,
+                'MovimentacaoID_Liquidacao': mov_id,
+                'TipoOrdem': tipo_ordem,
+                'Quantidade': quantidade,
+                'PrecoUnitario': preco_unitario,
+                'DataExecucao': agora,
+                'StatusOrdem': 'Executada'
+            }
+            for (_, (produto_id, tipo_ordem, quantidade, preco_unitario), _), mov_id in zip(aceitas, mov_ids)
+        ]
+        ordem_ids = db.session.execute(
+            insert(Ordem).returning(Ordem.OrdemID, sort_by_parameter_order=True), ordens
+        ).scalars().all()
+
+        # A sequência validada continua válida se o saldo atual ainda cobrir o menor saldo
+        # intermediário da simulação (saldo lido - saldo mínimo)
+        resultado = db.session.execute(
+            update(_conta)
+            .where(_conta.c.ContaID == self.conta.ContaID,
+                   _conta.c.Saldo >= self.conta.Saldo - self.saldo_minimo)
+            .values(Saldo=_conta.c.Saldo + (self.saldo - self.conta.Saldo))
+        )
+        if resultado.rowcount != 1:
+            raise ConflitoConcorrencia()
+
+        atualizar, inserir, remover = [], [], []
+        for produto_id, posicao in self.posicoes.items():
+            if posicao.posicao_id is None:
+                if posicao.quantidade > 0:
+                    inserir.append({'PortfolioID': self.portfolio.PortfolioID, 'ProdutoID': produto_id,
+                                    'Quantidade': posicao.quantidade, 'CustoMedio': posicao.custo_medio})
+            elif posicao.quantidade == 0:
+                remover.append({'id': posicao.posicao_id, 'qtd_lida': posicao.quantidade_lida})
+            elif (posicao.quantidade, posicao.custo_medio) != (posicao.quantidade_lida, posicao.custo_lido):
+                atualizar.append({'id': posicao.posicao_id, 'qtd_lida': posicao.quantidade_lida,
+                                  'qtd': posicao.quantidade, 'custo': posicao.custo_medio})
+
+        # Posições existentes só são gravadas se ainda tiverem a quantidade lida
+        mesma_posicao = (_posicao.c.PosicaoID == bindparam('id'), _posicao.c.Quantidade == bindparam('qtd_lida'))
+        if atualizar:
+            resultado = db.session.execute(
+                update(_posicao).where(*mesma_posicao)
+                .values(Quantidade=bindparam('qtd'), CustoMedio=bindparam('custo')),
+                atualizar
+            )
+            if resultado.rowcount != len(atualizar):
+                raise ConflitoConcorrencia()
+        if remover:
+            resultado = db.session.execute(delete(_posicao).where(*mesma_posicao), remover)
+            if resultado.rowcount != len(remover):
+                raise ConflitoConcorrencia()
+        if inserir:
+            try:
+                db.session.execute(insert(_posicao), inserir)
+            except exc.IntegrityError:
+                raise ConflitoConcorrencia()
+
+        incrementar_versoes(db.session.connection(), [
+            recurso('conta', self.conta.ContaID), recurso('portfolio', self.portfolio.PortfolioID)
+        ])
+        return ordem_ids
+
+    def executar(self, ordens_dados):
+        """Retorna (resultados, executadas); resultados segue a ordem de `ordens_dados`."""
+        for tentativa in range(1, MAX_TENTATIVAS_LOTE + 1):
+            try:
+                return self._executar(ordens_dados)
+            except ConflitoConcorrencia:
+                db.session.rollback()
+                if tentativa == MAX_TENTATIVAS_LOTE:
+                    raise OrdemRejeitada(
+                        {"erro": "Conta ou posições alteradas por outra operação. Tente novamente."}, 409)
+
+    def _executar(self, ordens_dados):
+        resultados = [None] * len(ordens_dados)
+        lidas = []
+        for indice, dados in enumerate(ordens_dados):
+            try:
+                lidas.append((indice, ler_ordem(dados, CAMPOS_ORDEM_LOTE)))
+            except OrdemRejeitada as e:
+                resultados[indice] = dict(e.resposta, indice=indice, status="Rejeitada")
+
+        self._carregar_contexto(list({ordem[0] for _, ordem in lidas}))
+        self.saldo = self.saldo_minimo = self.conta.Saldo
+
+        aceitas = []
+        for indice, ordem in lidas:
+            try:
+                aceitas.append((indice, ordem, self._simular(*ordem)))
+            except OrdemRejeitada as e:
+                resultados[indice] = dict(e.resposta, indice=indice, status="Rejeitada")
+
+        rejeitadas = len(ordens_dados) - len(aceitas)
+        if not aceitas or (self.atomico and rejeitadas):
+            db.session.rollback()
+            for indice, _, _ in aceitas:
+                resultados[indice] = {"indice": indice, "status": "Cancelada"}
+            return resultados, 0
+
+        ordem_ids = self._gravar(aceitas)
+        db.session.commit()
+
+        for (indice, (_, tipo_ordem, _, _), _), ordem_id in zip(aceitas, ordem_ids):
+            resultados[indice] = {"indice": indice, "status": "Executada", "tipo_ordem": tipo_ordem,
+                                  "ordem_id": ordem_id}
+        return resultados, len(aceitas)
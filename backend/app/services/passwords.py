@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import inspect, select, update, union_all, literal
+from app import db, bcrypt
+from app.models import Assessor, Cliente
+
+# Verificação de senha (bcrypt) em um pool dedicado e limitado. A thread da requisição espera o
+# hash terminar, então o que protege as demais rotas é o limite de admissão: no máximo
+# min(LOGIN_WORKERS + LOGIN_FILA_MAXIMA, SERVER_THREADS x LOGIN_FRACAO_THREADS) logins em andamento
+# por processo. Os excedentes recebem 429 com Retry-After na hora, sem ocupar a thread, e o restante
+# das threads do servidor continua atendendo as outras rotas durante um pico de logins. O custo vem
+# de BCRYPT_LOG_ROUNDS; hashes gravados com outro custo são refeitos no próximo login bem-sucedido.
+
+# Usuário encontrado pelo e-mail; o hash continua sendo o de Assessor/Cliente.SenhaHash
+Identidade = namedtuple('Identidade', 'modelo usuario_id senha_hash')
+
+
+class FilaLoginCheiaError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Muitas tentativas de login simultâneas. Tente novamente em instantes.")
+        self.retry_after = retry_after
+
+
+def custo_do_hash(senha_hash):
+    """Custo (log2 das rodadas) de um hash bcrypt '$2b$12$...'; None se o formato for outro."""
+    partes = senha_hash.split('$')
+    return int(partes[2]) if len(partes) > 3 and partes[2].isdigit() else None
+
+
+def _verificar(hashes, senha, custo):
+    """Índice do primeiro hash que confere com a senha e, se o custo mudou, o hash refeito."""
+    for indice, senha_hash in enumerate(hashes):
+        if bcrypt.check_password_hash(senha_hash, senha):
+            if custo_do_hash(senha_hash) != custo:
+                return indice, bcrypt.generate_password_hash(senha, custo).decode('utf-8')
+            return indice, None
+    return None, None
+
+
+def buscar_identidades(email, modelos=(Assessor, Cliente)):
+    """Identidades com o e-mail, na ordem de precedência de `modelos`, numa única consulta.
+
+    Cada parte do UNION ALL é resolvida só pelo índice IX_<tabela>_Email_Login (Email INCLUDE SenhaHash).
+    """
+    partes = [
+        select(
+            literal(ordem).label('ordem'),
+            inspect(modelo).primary_key[0].label('usuario_id'),
+            modelo.SenhaHash.label('senha_hash')
+        ).where(modelo.Email == email)
+        for ordem, modelo in enumerate(modelos)
+    ]
+    consulta = union_all(*partes) if len(partes) > 1 else partes[0]
+    return [
+        Identidade(modelos[linha.ordem], linha.usuario_id, linha.senha_hash)
+        for linha in db.session.execute(consulta.order_by('ordem'))
+    ]
+
+
+def _regravar_hash(identidade, novo_hash):
+    tabela = identidade.modelo.__table__
+    valores = {'SenhaHash': novo_hash}
+    # Rehash não é alteração cadastral: DataUltimaAtualizacao (onupdate) fica como estava
+    if 'DataUltimaAtualizacao' in tabela.c:
+        valores['DataUltimaAtualizacao'] = tabela.c.DataUltimaAtualizacao
+    chave = inspect(identidade.modelo).primary_key[0]
+    db.session.execute(update(tabela).where(chave == identidade.usuario_id).values(valores))
+    db.session.commit()
+
+
+class PasswordVerifier:
+    """Pool limitado de verificação de senhas, com métricas da fila."""
+
+    def __init__(self, trabalhadores=4, fila_maxima=2, retry_after=1, custo=12, threads_servidor=8,
+                 fracao_threads=0.5):
+        self.trabalhadores = trabalhadores
+        self.fila_maxima = fila_maxima
+        self.threads_servidor = threads_servidor
+        self.fracao_threads = fracao_threads
+        self.retry_after = retry_after
+        self.custo = custo
+        self._executor = None
+        self._lock = threading.Lock()
+        self._zerar_metricas()
+
+    def init_app(self, app):
+        with self._lock:
+            self.trabalhadores = app.config.get('LOGIN_WORKERS', self.trabalhadores)
+            self.fila_maxima = app.config.get('LOGIN_FILA_MAXIMA', self.fila_maxima)
+            self.threads_servidor = app.config.get('SERVER_THREADS', self.threads_servidor)
+            self.fracao_threads = app.config.get('LOGIN_FRACAO_THREADS', self.fracao_threads)
+            self.retry_after = app.config.get('LOGIN_RETRY_AFTER', self.retry_after)
+            self.custo = app.config.get('BCRYPT_LOG_ROUNDS', self.custo)
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            # As threads só são criadas na primeira verificação (depois do fork do servidor)
+            self._executor = ThreadPoolExecutor(max_workers=self.trabalhadores, thread_name_prefix='bcrypt')
+            self._zerar_metricas()
+
+    def limite_simultaneos(self):
+        """Logins em andamento (em execução + na fila) admitidos antes do 429; ao menos 1."""
+        return max(1, min(self.trabalhadores + self.fila_maxima, int(self.threads_servidor * self.fracao_threads)))
+
+    def _zerar_metricas(self):
+        self._pendentes = 0
+        self._em_execucao = 0
+        self._maximo_pendentes = 0
+        self._concluidas = 0
+        self._rejeitadas = 0
+        self._rehashes = 0
+        self._espera_total = 0.0
+        self._duracao_total = 0.0
+
+    def autenticar(self, identidades, senha):
+        """Primeira identidade (em ordem) cuja senha confere, ou None.
+
+        Todas são verificadas numa única tarefa do pool; levanta FilaLoginCheiaError se a fila
+        estiver cheia.
+        """
+        identidades = [i for i in identidades if i.senha_hash]
+        if not identidades:
+            return None
+
+        indice, novo_hash = self._executar([i.senha_hash for i in identidades], senha)
+        if indice is None:
+            return None
+        identidade = identidades[indice]
+        if novo_hash is not None:
+            _regravar_hash(identidade, novo_hash)
+            with self._lock:
+                self._rehashes += 1
+        return identidade
+
+    def _executar(self, hashes, senha):
+        with self._lock:
+            if self._pendentes >= self.limite_simultaneos():
+                self._rejeitadas += 1
+                raise FilaLoginCheiaError(self.retry_after)
+            self._pendentes += 1
+            self._maximo_pendentes = max(self._maximo_pendentes, self._pendentes)
+            executor, custo = self._executor, self.custo
+
+        enfileirada = time.perf_counter()
+        try:
+            return executor.submit(self._medir, enfileirada, hashes, senha, custo).result()
+        finally:
+            with self._lock:
+                self._pendentes -= 1
+
+    def _medir(self, enfileirada, hashes, senha, custo):
+        inicio = time.perf_counter()
+        with self._lock:
+            self._em_execucao += 1
+            self._espera_total += inicio - enfileirada
+        try:
+            return _verificar(hashes, senha, custo)
+        finally:
+            with self._lock:
+                self._em_execucao -= 1
+                self._concluidas += 1
+                self._duracao_total += time.perf_counter() - inicio
+
+    def metricas(self):
+        with self._lock:
+            concluidas = self._concluidas or 1
+            return {
+                "trabalhadores": self.trabalhadores,
+                "fila_maxima": self.fila_maxima,
+                "threads_servidor": self.threads_servidor,
+                "limite_simultaneos": self.limite_simultaneos(),
+                "custo_bcrypt": self.custo,
+                "em_execucao": self._em_execucao,
+                "na_fila": self._pendentes - self._em_execucao,
+                "maximo_pendentes": self._maximo_pendentes,
+                "concluidas": self._concluidas,
+                "rejeitadas": self._rejeitadas,
+                "rehashes": self._rehashes,
+                "espera_media_ms": round(self._espera_total / concluidas * 1000, 2),
+                "duracao_media_ms": round(self._duracao_total / concluidas * 1000, 2),
+            }
+
+
+password_verifier = PasswordVerifier()
@@ -0,0 +1,267 @@
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import event, select, or_
+from sqlalchemy.orm import object_session
+from app import db
+from app.models import Ordem, HistoricoPreco
+from app.serializers import CASAS_SALDO, dump_dia_desempenho
+from app.services.cache import TTLCache, MISSING
+
+# Série histórica de valor e retorno por carteira, reconstruída repassando as ordens executadas
+# sobre o histórico de preços: uma leitura ordenada de Ordem e uma de HistoricoPreco, intercaladas
+# dia a dia (sem consultas por dia). O estado ao fim do último dia fechado fica em cache; estender
+# o período processa apenas os dias novos.
+
+CASAS_RETORNO = Decimal('0.00000001')
+
+# fluxo: aplicações (compras) menos resgates (vendas) do dia; retorno_diario é None quando
+# a carteira não tinha valor no dia anterior
+Dia = namedtuple('Dia', 'Data valor_mercado fluxo retorno_diario')
+
+
+class EstadoCarteira:
+    """Estado do replay ao fim de `ultima_data` (inclusive)."""
+
+    __slots__ = ('quantidades', 'precos', 'produtos', 'ultima_data', 'valor_anterior', 'serie')
+
+    def __init__(self):
+        self.quantidades = {}
+        self.precos = {}
+        self.produtos = set()      # produtos com histórico de preços já lido até ultima_data
+        self.ultima_data = None
+        self.valor_anterior = Decimal(0)
+        self.serie = []
+
+    def copia(self):
+        nova = EstadoCarteira()
+        nova.quantidades = dict(self.quantidades)
+        nova.precos = dict(self.precos)
+        nova.produtos = set(self.produtos)
+        nova.ultima_data = self.ultima_data
+        nova.valor_anterior = self.valor_anterior
+        nova.serie = list(self.serie)
+        return nova
+
+
+def _inicio_do_dia(dia):
+    return datetime.combine(dia, time.min)
+
+
+def _ordens(portfolio_id, apos, ate):
+    """Ordens executadas nos dias (apos, ate], em ordem de execução."""
+    consulta = select(
+        Ordem.DataExecucao, Ordem.ProdutoID, Ordem.TipoOrdem, Ordem.Quantidade, Ordem.PrecoUnitario
+    ).where(
+        Ordem.PortfolioID == portfolio_id,
+        Ordem.StatusOrdem == 'Executada',
+        Ordem.DataExecucao < _inicio_do_dia(ate + timedelta(days=1))
+    )
+    if apos is not None:
+        consulta = consulta.where(Ordem.DataExecucao >= _inicio_do_dia(apos + timedelta(days=1)))
+    return db.session.execute(consulta.order_by(Ordem.DataExecucao, Ordem.OrdemID)).all()
+
+
+def _precos(portfolio_id, estado, ate):
+    """Fechamentos até `ate` dos produtos negociados pela carteira, em ordem de data.
+
+    Produtos já acompanhados só precisam dos dias novos; os demais, do histórico inteiro
+    (o último preço antes da primeira compra também vale).
+    """
+    produtos_negociados = select(Ordem.ProdutoID).where(
+        Ordem.PortfolioID == portfolio_id,
+        Ordem.DataExecucao < _inicio_do_dia(ate + timedelta(days=1))
+    ).distinct()
+
+    consulta = select(
+        HistoricoPreco.Data, HistoricoPreco.ProdutoID, HistoricoPreco.PrecoFechamento
+    ).where(
+        HistoricoPreco.ProdutoID.in_(produtos_negociados),
+        HistoricoPreco.Data <= ate
+    )
+    if estado.ultima_data is not None and estado.produtos:
+        consulta = consulta.where(or_(
+            HistoricoPreco.Data > estado.ultima_data,
+            HistoricoPreco.ProdutoID.notin_(estado.produtos)
+        ))
+    return db.session.execute(consulta.order_by(HistoricoPreco.Data, HistoricoPreco.ProdutoID)).all()
+
+
+def avancar(estado, portfolio_id, ate):
+    """Processa os dias (estado.ultima_data, ate] e os acrescenta a estado.serie."""
+    if estado.ultima_data is not None and estado.ultima_data >= ate:
+        return estado
+
+    ordens = _ordens(portfolio_id, estado.ultima_data, ate)
+    if estado.ultima_data is None:
+        if not ordens:
+            return estado
+        dia = ordens[0].DataExecucao.date()
+    else:
+        dia = estado.ultima_data + timedelta(days=1)
+
+    precos = _precos(portfolio_id, estado, ate)
+    i_ordem = i_preco = 0
+
+    while dia <= ate:
+        while i_preco < len(precos) and precos[i_preco].Data <= dia:
+            estado.precos[precos[i_preco].ProdutoID] = precos[i_preco].PrecoFechamento
+            i_preco += 1
+
+        fluxo = Decimal(0)
+        while i_ordem < len(ordens) and ordens[i_ordem].DataExecucao.date() <= dia:
+            ordem = ordens[i_ordem]
+            valor = ordem.Quantidade * ordem.PrecoUnitario
+            atual = estado.quantidades.get(ordem.ProdutoID, Decimal(0))
+            if ordem.TipoOrdem == 'Compra':
+                estado.quantidades[ordem.ProdutoID] = atual + ordem.Quantidade
+                fluxo += valor
+            else:
+                estado.quantidades[ordem.ProdutoID] = atual - ordem.Quantidade
+                fluxo -= valor
+            # Sem fechamento anterior, o preço da própria ordem valoriza a posição
+            estado.precos.setdefault(ordem.ProdutoID, ordem.PrecoUnitario)
+            i_ordem += 1
+
+        valor_mercado = sum(
+            (q * estado.precos.get(pid, 0) for pid, q in estado.quantidades.items() if q),
+            Decimal(0)
+        ).quantize(CASAS_SALDO, rounding=ROUND_HALF_UP)
+
+        retorno = None
+        if estado.valor_anterior > 0:
+            retorno = ((valor_mercado - fluxo) / estado.valor_anterior - 1).quantize(CASAS_RETORNO)
+
+        estado.serie.append(Dia(dia, valor_mercado, fluxo.quantize(CASAS_SALDO), retorno))
+        estado.valor_anterior = valor_mercado
+        estado.ultima_data = dia
+        dia += timedelta(days=1)
+
+    estado.produtos.update(p.ProdutoID for p in precos)
+    estado.produtos.update(o.ProdutoID for o in ordens)
+    return estado
+
+
+class PerformanceCache:
+    """Estado do replay por PortfolioID, sempre até um dia já fechado (anterior a hoje).
+
+    O dia corrente é recalculado a cada consulta a partir de uma cópia do estado. Ordens e
+    preços gravados com data dentro do período já calculado descartam o estado afetado.
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        self._cache.configure(
+            maxsize=app.config.get('PERFORMANCE_CACHE_MAXSIZE'),
+            ttl=app.config.get('PERFORMANCE_CACHE_TTL')
+        )
+
+    def serie(self, portfolio_id, fim):
+        """Lista de Dia do início da carteira até `fim`."""
+        ultimo_fechado = date.today() - timedelta(days=1)
+
+        estado = self._cache.get(portfolio_id)
+        estado = EstadoCarteira() if estado is MISSING else estado.copia()
+
+        avancar(estado, portfolio_id, min(fim, ultimo_fechado))
+        if estado.ultima_data is not None and estado.ultima_data <= ultimo_fechado:
+            self._cache.set(portfolio_id, estado.copia())
+
+        if fim > ultimo_fechado:
+            avancar(estado, portfolio_id, fim)
+        return [d for d in estado.serie if d.Data <= fim]
+
+    def invalidate(self, portfolios=None, produtos=None):
+        """Descarta estados que já cobrem a data alterada: portfolios/produtos = {ID: menor data}."""
+        if portfolios:
+            for portfolio_id, data in portfolios.items():
+                estado = self._cache.get(portfolio_id)
+                if estado is not MISSING and estado.ultima_data is not None and estado.ultima_data >= data:
+                    self._cache.invalidate(portfolio_id)
+        if produtos:
+            self._cache.invalidate_where(lambda estado: estado.ultima_data is not None and any(
+                produto_id in estado.produtos and estado.ultima_data >= data
+                for produto_id, data in produtos.items()
+            ))
+
+    def clear(self):
+        self._cache.clear()
+
+
+performance_cache = PerformanceCache()
+
+
+def desempenho_portfolio(portfolio_id, inicio=None, fim=None):
+    """Série diária de valor e retorno da carteira em [inicio, fim] (padrão: do início até hoje).
+
+    O retorno de cada dia desconta o fluxo do dia: (valor - fluxo) / valor do dia anterior - 1.
+    retorno_acumulado compõe os retornos a partir do fechamento de `inicio`.
+    """
+    fim = min(fim or date.today(), date.today())
+    dias = [d for d in performance_cache.serie(portfolio_id, fim) if inicio is None or d.Data >= inicio]
+
+    serie = []
+    fator = Decimal(1)
+    for indice, dia in enumerate(dias):
+        if indice > 0 and dia.retorno_diario is not None:
+            fator *= 1 + dia.retorno_diario
+        serie.append(dump_dia_desempenho(dia, (fator - 1).quantize(CASAS_RETORNO)))
+
+    return {
+        "PortfolioID": portfolio_id,
+        "inicio": dias[0].Data.isoformat() if dias else (inicio.isoformat() if inicio else None),
+        "fim": fim.isoformat(),
+        "retorno_periodo": serie[-1]["retorno_acumulado"] if serie else None,
+        "serie": serie
+    }
+
+
+def _registrar_menor_data(session, chave, alteracoes):
+    pendentes = session.info.setdefault(chave, {})
+    for item_id, data in alteracoes.items():
+        if item_id not in pendentes or data < pendentes[item_id]:
+            pendentes[item_id] = data
+
+
+def marcar_historico_alterado(session, portfolios=None, produtos=None):
+    """Agenda a invalidação para escritas feitas fora do ORM: {PortfolioID|ProdutoID: menor data}."""
+    if portfolios:
+        _registrar_menor_data(session, 'desempenho_portfolios_alterados', portfolios)
+    if produtos:
+        _registrar_menor_data(session, 'desempenho_produtos_alterados', produtos)
+
+
+# --- Eventos: ordens e preços com data retroativa invalidam os dias já calculados ---
+
+def _apos_alterar_ordem(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        data = target.DataExecucao.date() if target.DataExecucao else date.today()
+        marcar_historico_alterado(session, portfolios={target.PortfolioID: data})
+
+
+def _apos_alterar_preco(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        marcar_historico_alterado(session, produtos={target.ProdutoID: target.Data})
+
+
+for _evento in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Ordem, _evento, _apos_alterar_ordem)
+    event.listen(HistoricoPreco, _evento, _apos_alterar_preco)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_apos_commit(session):
+    portfolios = session.info.pop('desempenho_portfolios_alterados', None)
+    produtos = session.info.pop('desempenho_produtos_alterados', None)
+    if portfolios or produtos:
+        performance_cache.invalidate(portfolios, produtos)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_apos_rollback(session):
+    session.info.pop('desempenho_portfolios_alterados', None)
+    session.info.pop('desempenho_produtos_alterados', None)
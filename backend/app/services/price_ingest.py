@@ -0,0 +1,282 @@
+import csv
+import json
+import time
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import select, insert, update, bindparam, exc
+from app import db
+from app.models import ProdutoFinanceiro, HistoricoPreco
+from app.services.pricing import TAMANHO_LOTE_IN, avancar_precos_atuais, marcar_precos_alterados
+from app.services.performance import marcar_historico_alterado
+from app.services.scenarios import marcar_retornos_alterados
+from app.services.product_stats import avancar_estatisticas
+from app.services.versioning import CATALOGO, incrementar_versoes
+
+FORMATOS = ('csv', 'jsonl')
+TAMANHO_LOTE_PADRAO = 5000
+MAX_ERROS_REPORTADOS = 50
+
+
+class ErroRegistro(ValueError):
+    pass
+
+
+class ConflitoIngestaoError(Exception):
+    """Lote que voltou a violar a chave (ProdutoID, Data) na retentativa.
+
+    Os lotes anteriores já foram gravados; `resumo` traz a contagem até ali.
+    """
+
+    def __init__(self, mensagem, resumo):
+        super().__init__(mensagem)
+        self.resumo = resumo
+
+
+# Contagens de um lote, somadas ao total só depois do commit
+ResultadoLote = namedtuple('ResultadoLote', 'inseridos atualizados inalterados rejeicoes')
+
+
+def _normalizar(linha_num, item):
+    """Converte um registro bruto (CSV ou JSON) em (ticker, produto_id, data, preco)."""
+    ticker = (item.get('Ticker') or '').strip().upper() or None
+    produto_id = item.get('ProdutoID')
+    preco = item.get('PrecoFechamento', item.get('Preco'))
+
+    if produto_id not in (None, ''):
+        try:
+            produto_id = int(produto_id)
+        except (TypeError, ValueError):
+            raise ErroRegistro(f"Linha {linha_num}: ProdutoID inválido.")
+    else:
+        produto_id = None
+
+    if produto_id is None and ticker is None:
+        raise ErroRegistro(f"Linha {linha_num}: informe Ticker ou ProdutoID.")
+
+    try:
+        data = date.fromisoformat(str(item.get('Data', '')).strip())
+    except ValueError:
+        raise ErroRegistro(f"Linha {linha_num}: Data inválida (use AAAA-MM-DD).")
+
+    try:
+        preco = Decimal(str(preco).strip())
+    except (InvalidOperation, TypeError):
+        raise ErroRegistro(f"Linha {linha_num}: PrecoFechamento inválido.")
+    if not preco.is_finite() or preco <= 0:
+        raise ErroRegistro(f"Linha {linha_num}: PrecoFechamento deve ser positivo.")
+
+    return ticker, produto_id, data, preco
+
+
+def iter_registros(linhas, formato, delimitador=','):
+    """Gera (linha, registro normalizado | ErroRegistro) a partir de um iterável de linhas de texto."""
+    if formato == 'csv':
+        leitor = csv.DictReader(linhas, delimiter=delimitador)
+        for item in leitor:
+            linha_num = leitor.line_num
+            try:
+                yield linha_num, _normalizar(linha_num, item)
+            except ErroRegistro as e:
+                yield linha_num, e
+    elif formato == 'jsonl':
+        for linha_num, texto in enumerate(linhas, start=1):
+            texto = texto.strip()
+            if not texto:
+                continue
+            try:
+                item = json.loads(texto)
+                if not isinstance(item, dict):
+                    raise ErroRegistro(f"Linha {linha_num}: esperado um objeto JSON.")
+                yield linha_num, _normalizar(linha_num, item)
+            except ErroRegistro as e:
+                yield linha_num, e
+            except ValueError:
+                yield linha_num, ErroRegistro(f"Linha {linha_num}: JSON inválido.")
+    else:
+        raise ValueError(f"Formato inválido. Use um de: {list(FORMATOS)}")
+
+
+class PriceIngestor:
+    """Carga em lote de HistoricoPreco com upsert respeitando uq_produto_data.
+
+    Cada lote resolve os tickers com uma consulta IN, separa inserções de atualizações
+    consultando as chaves (ProdutoID, Data) já existentes e grava tudo com executemany,
+    em uma transação por lote.
+    """
+
+    def __init__(self, tamanho_lote=TAMANHO_LOTE_PADRAO):
+        self.tamanho_lote = tamanho_lote
+        self._tickers = {}
+        self.lidos = 0
+        self.inseridos = 0
+        self.atualizados = 0
+        self.inalterados = 0
+        self.rejeitados = 0
+        self.erros = []
+        self._inicio = time.perf_counter()
+
+    def _rejeitar(self, mensagem):
+        self.rejeitados += 1
+        if len(self.erros) < MAX_ERROS_REPORTADOS:
+            self.erros.append(mensagem)
+
+    def _resolver_tickers(self, tickers):
+        pendentes = [t for t in tickers if t not in self._tickers]
+        for i in range(0, len(pendentes), TAMANHO_LOTE_IN):
+            lote = pendentes[i:i + TAMANHO_LOTE_IN]
+            encontrados = dict(db.session.execute(
+                select(ProdutoFinanceiro.Ticker, ProdutoFinanceiro.ProdutoID)
+                .where(ProdutoFinanceiro.Ticker.in_(lote))
+            ).all())
+            for ticker in lote:
+                self._tickers[ticker] = encontrados.get(ticker)
+
+    def _validar_produto_ids(self, produto_ids):
+        validos = set()
+        produto_ids = list(produto_ids)
+        for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+            lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+            validos.update(db.session.execute(
+                select(ProdutoFinanceiro.ProdutoID).where(ProdutoFinanceiro.ProdutoID.in_(lote))
+            ).scalars())
+        return validos
+
+    def _gravar_lote(self, lote):
+        """Grava o lote em uma transação e retorna suas contagens (sem alterar as do ingestor)."""
+        self._resolver_tickers({ticker for _, (ticker, pid, _, _) in lote if pid is None})
+        ids_informados = {pid for _, (_, pid, _, _) in lote if pid is not None}
+        ids_validos = self._validar_produto_ids(ids_informados) if ids_informados else set()
+
+        # Deduplica por (ProdutoID, Data): o último registro do arquivo prevalece
+        precos = {}
+        rejeicoes = []
+        for linha_num, (ticker, pid, data, preco) in lote:
+            if pid is None:
+                pid = self._tickers.get(ticker)
+                if pid is None:
+                    rejeicoes.append(f"Linha {linha_num}: Ticker '{ticker}' não encontrado.")
+                    continue
+            elif pid not in ids_validos:
+                rejeicoes.append(f"Linha {linha_num}: ProdutoID {pid} não encontrado.")
+                continue
+            precos[(pid, data)] = preco
+
+        if not precos:
+            return ResultadoLote(0, 0, 0, rejeicoes)
+
+        # Datas pelo intervalo (BETWEEN) e não por IN: os parâmetros por consulta ficam limitados
+        # a TAMANHO_LOTE_IN + 2, abaixo do limite de 2100 do SQL Server mesmo em backfills longos.
+        # As chaves fora do lote que caem no intervalo são descartadas aqui.
+        produto_ids = list({pid for pid, _ in precos})
+        primeira_data = min(data for _, data in precos)
+        ultima_data = max(data for _, data in precos)
+        existentes = {}
+        for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+            ids_lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+            for preco_id, pid, data, preco in db.session.execute(
+                select(HistoricoPreco.PrecoID, HistoricoPreco.ProdutoID,
+                       HistoricoPreco.Data, HistoricoPreco.PrecoFechamento)
+                .where(HistoricoPreco.ProdutoID.in_(ids_lote),
+                       HistoricoPreco.Data.between(primeira_data, ultima_data))
+            ):
+                if (pid, data) in precos:
+                    existentes[(pid, data)] = (preco_id, preco)
+
+        inserir = []
+        atualizar = []
+        corrigidos = set()
+        inalterados = 0
+        for (pid, data), preco in precos.items():
+            if (pid, data) not in existentes:
+                inserir.append({'ProdutoID': pid, 'Data': data, 'PrecoFechamento': preco})
+            elif existentes[(pid, data)][1] != preco:
+                atualizar.append({'id': existentes[(pid, data)][0], 'preco': preco})
+                corrigidos.add((pid, data))
+            else:
+                inalterados += 1
+
+        ultimos_precos = {}
+        for (pid, data), preco in precos.items():
+            if pid not in ultimos_precos or ultimos_precos[pid][0] < data:
+                ultimos_precos[pid] = (data, preco)
+
+        tabela = HistoricoPreco.__table__
+        connection = db.session.connection()
+        if inserir:
+            connection.execute(insert(tabela), inserir)
+        if atualizar:
+            connection.execute(
+                update(tabela)
+                .where(tabela.c.PrecoID == bindparam('id'))
+                .values(PrecoFechamento=bindparam('preco')),
+                atualizar
+            )
+        avancar_precos_atuais(connection, ultimos_precos)
+        avancar_estatisticas(
+            connection,
+            {(i['ProdutoID'], i['Data']): i['PrecoFechamento'] for i in inserir},
+            corrigidos=corrigidos
+        )
+        incrementar_versoes(connection, [CATALOGO])
+        marcar_precos_alterados(db.session, ultimos_precos)
+
+        primeiras_datas = {}
+        for pid, data in precos:
+            if pid not in primeiras_datas or data < primeiras_datas[pid]:
+                primeiras_datas[pid] = data
+        marcar_historico_alterado(db.session, produtos=primeiras_datas)
+        marcar_retornos_alterados(db.session, primeiras_datas)
+        db.session.commit()
+        return ResultadoLote(len(inserir), len(atualizar), inalterados, rejeicoes)
+
+    def _gravar_com_retentativa(self, lote):
+        try:
+            resultado = self._gravar_lote(lote)
+        except exc.IntegrityError:
+            # Outra carga gravou as mesmas chaves entre a leitura e o insert: relê e tenta de novo
+            db.session.rollback()
+            try:
+                resultado = self._gravar_lote(lote)
+            except exc.IntegrityError:
+                db.session.rollback()
+                raise ConflitoIngestaoError(
+                    f"Conflito de gravação persistente no lote iniciado na linha {lote[0][0]}: "
+                    "outra importação está gravando os mesmos preços. Os lotes anteriores foram gravados.",
+                    self.resumo()
+                )
+
+        self.inseridos += resultado.inseridos
+        self.atualizados += resultado.atualizados
+        self.inalterados += resultado.inalterados
+        for mensagem in resultado.rejeicoes:
+            self._rejeitar(mensagem)
+
+    def ingerir(self, registros):
+        self._inicio = time.perf_counter()
+        lote = []
+        for linha_num, registro in registros:
+            self.lidos += 1
+            if isinstance(registro, ErroRegistro):
+                self._rejeitar(str(registro))
+                continue
+            lote.append((linha_num, registro))
+            if len(lote) >= self.tamanho_lote:
+                self._gravar_com_retentativa(lote)
+                lote = []
+        if lote:
+            self._gravar_com_retentativa(lote)
+        return self.resumo()
+
+    def resumo(self):
+        duracao = time.perf_counter() - self._inicio
+        return {
+            "linhas_lidas": self.lidos,
+            "inseridos": self.inseridos,
+            "atualizados": self.atualizados,
+            "inalterados": self.inalterados,
+            "rejeitados": self.rejeitados,
+            "erros": self.erros,
+            "duracao_segundos": round(duracao, 3),
+            "linhas_por_segundo": round(self.lidos / duracao, 1) if duracao > 0 else None
+        }
@@ -0,0 +1,229 @@
+from sqlalchemy import event, exc, func, and_, select, insert, update, delete, bindparam
+from sqlalchemy.orm import object_session
+from app import db
+from app.models import HistoricoPreco, PrecoAtual
+from app.services.cache import TTLCache
+
+# Limite de parâmetros por IN (o SQL Server aceita no máximo 2100 por comando)
+TAMANHO_LOTE_IN = 1000
+
+
+def _buscar_precos_recentes(produto_ids):
+    """Lê o PrecoFechamento mais recente de cada produto por chave primária em PrecoAtual."""
+    mapa_precos = {}
+    for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+        lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+
+        precos_atuais = db.session.query(
+            PrecoAtual.ProdutoID,
+            PrecoAtual.PrecoFechamento
+        ).filter(
+            PrecoAtual.ProdutoID.in_(lote)
+        ).all()
+
+        mapa_precos.update({p.ProdutoID: p.PrecoFechamento for p in precos_atuais})
+    return mapa_precos
+
+
+class LatestPriceCache:
+    """Cache compartilhado do último preço de fechamento por ProdutoID.
+
+    Produtos sem preço também são cacheados (como None) para não repetir a consulta.
+    Escritas em HistoricoPreco invalidam as entradas afetadas quando a transação é confirmada.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        self._cache.configure(
+            maxsize=app.config.get('PRICE_CACHE_MAXSIZE'),
+            ttl=app.config.get('PRICE_CACHE_TTL')
+        )
+
+    def get_prices(self, produto_ids):
+        """Retorna {ProdutoID: PrecoFechamento} apenas para os produtos que possuem preço."""
+        produto_ids = list(dict.fromkeys(produto_ids))
+        encontrados, ausentes = self._cache.get_many(produto_ids)
+
+        if ausentes:
+            carregados = _buscar_precos_recentes(ausentes)
+            novos = {pid: carregados.get(pid) for pid in ausentes}
+            self._cache.set_many(novos)
+            encontrados.update(novos)
+
+        return {pid: preco for pid, preco in encontrados.items() if preco is not None}
+
+    def get_price(self, produto_id):
+        return self.get_prices([produto_id]).get(produto_id)
+
+    def invalidate(self, produto_ids=None):
+        if produto_ids is None:
+            self._cache.clear()
+        else:
+            self._cache.invalidate_many(produto_ids)
+
+
+price_cache = LatestPriceCache()
+
+
+def precos_na_data(data):
+    """{ProdutoID: PrecoFechamento} do último fechamento de cada produto até `data` (inclusive)."""
+    ultimas_datas = select(
+        HistoricoPreco.ProdutoID,
+        func.max(HistoricoPreco.Data).label('MaxData')
+    ).where(
+        HistoricoPreco.Data <= data
+    ).group_by(HistoricoPreco.ProdutoID).subquery('ultimas_datas')
+
+    return dict(db.session.execute(
+        select(HistoricoPreco.ProdutoID, HistoricoPreco.PrecoFechamento).join(
+            ultimas_datas,
+            and_(
+                HistoricoPreco.ProdutoID == ultimas_datas.c.ProdutoID,
+                HistoricoPreco.Data == ultimas_datas.c.MaxData
+            )
+        )
+    ).all())
+
+
+# --- Manutenção da tabela PrecoAtual ---
+
+def avancar_preco_atual(connection, produto_id, data, preco):
+    """Atualiza o snapshot do produto se `data` for igual ou mais recente que a registrada."""
+    avancar = (
+        update(PrecoAtual)
+        .where(PrecoAtual.ProdutoID == produto_id, PrecoAtual.Data <= data)
+        .values(Data=data, PrecoFechamento=preco)
+    )
+    if connection.execute(avancar).rowcount:
+        return
+
+    # Nenhuma linha atualizada: ou o produto ainda não tem snapshot, ou o snapshot é mais novo
+    existente = connection.execute(
+        select(PrecoAtual.ProdutoID).where(PrecoAtual.ProdutoID == produto_id)
+    ).first()
+    if existente is None:
+        try:
+            with connection.begin_nested():
+                connection.execute(
+                    insert(PrecoAtual).values(ProdutoID=produto_id, Data=data, PrecoFechamento=preco)
+                )
+        except exc.IntegrityError:
+            # Outra transação criou o snapshot entre o SELECT e o INSERT
+            connection.execute(avancar)
+
+
+def avancar_precos_atuais(connection, ultimos_precos):
+    """Versão em lote de avancar_preco_atual para {ProdutoID: (Data, PrecoFechamento)}."""
+    produto_ids = list(ultimos_precos)
+    existentes = {}
+    for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+        lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+        existentes.update(connection.execute(
+            select(PrecoAtual.ProdutoID, PrecoAtual.Data).where(PrecoAtual.ProdutoID.in_(lote))
+        ).all())
+
+    atualizar = [
+        {'pid': pid, 'data': data, 'preco': preco}
+        for pid, (data, preco) in ultimos_precos.items()
+        if pid in existentes and existentes[pid] <= data
+    ]
+    inserir = [
+        {'ProdutoID': pid, 'Data': data, 'PrecoFechamento': preco}
+        for pid, (data, preco) in ultimos_precos.items()
+        if pid not in existentes
+    ]
+
+    tabela = PrecoAtual.__table__
+    if atualizar:
+        # O filtro por Data protege contra um snapshot mais novo gravado em paralelo
+        connection.execute(
+            update(tabela)
+            .where(tabela.c.ProdutoID == bindparam('pid'), tabela.c.Data <= bindparam('data'))
+            .values(Data=bindparam('data'), PrecoFechamento=bindparam('preco')),
+            atualizar
+        )
+    if inserir:
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(tabela), inserir)
+        except exc.IntegrityError:
+            # Outra transação criou algum dos snapshots entre o SELECT e o INSERT: o lote inteiro
+            # foi desfeito, e cada produto volta ao caminho unitário (UPDATE ou INSERT)
+            for linha in inserir:
+                avancar_preco_atual(connection, linha['ProdutoID'], linha['Data'], linha['PrecoFechamento'])
+
+
+def marcar_precos_alterados(session, produto_ids):
+    """Agenda a invalidação do cache para escritas feitas fora do ORM (ex.: inserts em lote)."""
+    session.info.setdefault('precos_alterados', set()).update(produto_ids)
+
+
+def recalcular_precos_atuais(connection, produto_ids=None):
+    """Reconstrói PrecoAtual a partir do histórico (todos os produtos ou apenas os informados)."""
+    subquery_precos = select(
+        HistoricoPreco.ProdutoID,
+        func.max(HistoricoPreco.Data).label('MaxData')
+    ).group_by(HistoricoPreco.ProdutoID)
+
+    remover = delete(PrecoAtual)
+    if produto_ids is not None:
+        produto_ids = list(produto_ids)
+        subquery_precos = subquery_precos.where(HistoricoPreco.ProdutoID.in_(produto_ids))
+        remover = remover.where(PrecoAtual.ProdutoID.in_(produto_ids))
+    subquery_precos = subquery_precos.subquery('precos_recentes')
+
+    precos_recentes = select(
+        HistoricoPreco.ProdutoID,
+        HistoricoPreco.Data,
+        HistoricoPreco.PrecoFechamento
+    ).join(
+        subquery_precos,
+        and_(
+            HistoricoPreco.ProdutoID == subquery_precos.c.ProdutoID,
+            HistoricoPreco.Data == subquery_precos.c.MaxData
+        )
+    )
+
+    connection.execute(remover)
+    resultado = connection.execute(
+        insert(PrecoAtual).from_select(['ProdutoID', 'Data', 'PrecoFechamento'], precos_recentes)
+    )
+    return resultado.rowcount
+
+
+# --- Eventos de HistoricoPreco ---
+# PrecoAtual é atualizado na mesma conexão (e transação) da escrita no histórico.
+# Os ProdutoIDs alterados ficam pendentes na sessão e só invalidam o cache após o commit,
+# evitando que outra requisição recarregue o preço antigo antes da transação terminar.
+
+def _registrar_produto_alterado(target):
+    session = object_session(target)
+    if session is not None:
+        marcar_precos_alterados(session, [target.ProdutoID])
+
+
+@event.listens_for(HistoricoPreco, 'after_insert')
+def _apos_inserir_preco(mapper, connection, target):
+    avancar_preco_atual(connection, target.ProdutoID, target.Data, target.PrecoFechamento)
+    _registrar_produto_alterado(target)
+
+
+@event.listens_for(HistoricoPreco, 'after_update')
+@event.listens_for(HistoricoPreco, 'after_delete')
+def _apos_alterar_preco(mapper, connection, target):
+    recalcular_precos_atuais(connection, [target.ProdutoID])
+    _registrar_produto_alterado(target)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_apos_commit(session):
+    alterados = session.info.pop('precos_alterados', None)
+    if alterados:
+        price_cache.invalidate(alterados)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_apos_rollback(session):
+    session.info.pop('precos_alterados', None)
@@ -0,0 +1,300 @@
+import math
+from flask import current_app
+from sqlalchemy import event, select, insert, update, delete, bindparam, func, or_
+from sqlalchemy.orm import aliased
+from app.models import HistoricoPreco, EstatisticaProduto, ProdutoFinanceiro
+from app.services.pricing import TAMANHO_LOTE_IN
+
+# Estatísticas de risco/retorno por produto mantidas em EstatisticaProduto, como PrecoAtual:
+# cada preço novo (data posterior à última processada) avança os acumuladores em O(1);
+# correções e preços retroativos recalculam o produto a partir do histórico. Preços novos do produto
+# de referência completam os pares (correlação) dos produtos que já tinham preço naquelas datas.
+
+# Produtos por leitura do histórico completo na reconstrução
+TAMANHO_LOTE_ESTATISTICA = 200
+COLUNAS = tuple(c.name for c in EstatisticaProduto.__table__.columns)
+
+
+class Acumulador:
+    """Estado de uma linha de EstatisticaProduto."""
+
+    __slots__ = COLUNAS
+
+    def __init__(self, **valores):
+        for coluna in COLUNAS:
+            setattr(self, coluna, valores.get(coluna))
+
+    @classmethod
+    def inicial(cls, produto_id, data, preco):
+        return cls(
+            ProdutoID=produto_id, DataUltimoPreco=data, UltimoPreco=preco, PrecoMaximo=preco,
+            DrawdownMaximo=0.0, NumeroRetornos=0, MediaRetorno=0.0, M2Retorno=0.0,
+            NumeroPares=0, MediaPar=0.0, MediaReferencia=0.0, M2Par=0.0, M2Referencia=0.0, CoMomento=0.0
+        )
+
+    def adicionar(self, data, preco, retorno_referencia=None):
+        """Incorpora o fechamento de `data` (posterior a DataUltimoPreco)."""
+        retorno = math.log(float(preco) / float(self.UltimoPreco))
+
+        # Welford: média e soma dos quadrados dos desvios
+        self.NumeroRetornos += 1
+        desvio = retorno - self.MediaRetorno
+        self.MediaRetorno += desvio / self.NumeroRetornos
+        self.M2Retorno += desvio * (retorno - self.MediaRetorno)
+
+        if preco > self.PrecoMaximo:
+            self.PrecoMaximo = preco
+        self.DrawdownMaximo = max(self.DrawdownMaximo, 1 - float(preco) / float(self.PrecoMaximo))
+
+        # Co-momento com a referência, apenas nas datas em que ambos têm retorno
+        if retorno_referencia is not None:
+            self.adicionar_par(retorno, retorno_referencia)
+
+        self.DataUltimoPreco = data
+        self.UltimoPreco = preco
+
+    def adicionar_par(self, retorno, retorno_referencia):
+        """Incorpora um par (retorno do produto, retorno da referência) da mesma data.
+
+        Os acumuladores do par não dependem da ordem das datas: um par que só se completa quando o
+        preço da referência chega depois pode ser incluído a qualquer momento.
+        """
+        self.NumeroPares += 1
+        desvio_par = retorno - self.MediaPar
+        desvio_referencia = retorno_referencia - self.MediaReferencia
+        self.MediaPar += desvio_par / self.NumeroPares
+        self.MediaReferencia += desvio_referencia / self.NumeroPares
+        self.M2Par += desvio_par * (retorno - self.MediaPar)
+        self.M2Referencia += desvio_referencia * (retorno_referencia - self.MediaReferencia)
+        self.CoMomento += desvio_par * (retorno_referencia - self.MediaReferencia)
+
+    def como_dict(self):
+        return {coluna: getattr(self, coluna) for coluna in COLUNAS}
+
+
+def _produto_referencia(connection):
+    ticker = current_app.config.get('ESTATISTICA_TICKER_REFERENCIA')
+    if not ticker:
+        return None
+    return connection.execute(
+        select(ProdutoFinanceiro.ProdutoID).where(ProdutoFinanceiro.Ticker == ticker)
+    ).scalar()
+
+
+def _retornos_referencia(connection, referencia_id, desde=None, ate=None):
+    """{Data: log-retorno} da referência; com `desde`, inclui o fechamento anterior como base."""
+    if referencia_id is None:
+        return {}
+    consulta = select(HistoricoPreco.Data, HistoricoPreco.PrecoFechamento).where(
+        HistoricoPreco.ProdutoID == referencia_id,
+        HistoricoPreco.PrecoFechamento > 0
+    )
+    if desde is not None:
+        anterior = select(func.max(HistoricoPreco.Data)).where(
+            HistoricoPreco.ProdutoID == referencia_id,
+            HistoricoPreco.Data < desde
+        ).scalar_subquery()
+        consulta = consulta.where(or_(HistoricoPreco.Data >= desde, HistoricoPreco.Data == anterior))
+    if ate is not None:
+        consulta = consulta.where(HistoricoPreco.Data <= ate)
+
+    retornos = {}
+    preco_anterior = None
+    for data, preco in connection.execute(consulta.order_by(HistoricoPreco.Data)):
+        if preco_anterior is not None:
+            retornos[data] = math.log(float(preco) / float(preco_anterior))
+        preco_anterior = preco
+    return retornos
+
+
+def _ler_estatisticas(connection, produto_ids):
+    tabela = EstatisticaProduto.__table__
+    existentes = {}
+    for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+        lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+        for linha in connection.execute(select(tabela).where(tabela.c.ProdutoID.in_(lote))):
+            existentes[linha.ProdutoID] = Acumulador(**linha._mapping)
+    return existentes
+
+
+def _gravar_estados(connection, estados):
+    tabela = EstatisticaProduto.__table__
+    connection.execute(
+        update(tabela)
+        .where(tabela.c.ProdutoID == bindparam('v_ProdutoID'))
+        .values({coluna: bindparam(f"v_{coluna}") for coluna in COLUNAS if coluna != 'ProdutoID'}),
+        [{f"v_{coluna}": valor for coluna, valor in estado.como_dict().items()} for estado in estados]
+    )
+
+
+def avancar_estatisticas(connection, precos, corrigidos=()):
+    """Incorpora preços recém-gravados: precos = {(ProdutoID, Data): PrecoFechamento}.
+
+    `corrigidos` = {(ProdutoID, Data)} de preços alterados ou removidos. Esses produtos, os que
+    receberam preço anterior ou igual ao último processado e os sem linha em EstatisticaProduto
+    são recalculados a partir do histórico.
+    """
+    por_produto = {}
+    for (produto_id, data), preco in precos.items():
+        if preco > 0:
+            por_produto.setdefault(produto_id, []).append((data, preco))
+
+    existentes = _ler_estatisticas(connection, list(por_produto))
+    recalcular = {produto_id for produto_id, _ in corrigidos}
+    for produto_id, novos in por_produto.items():
+        novos.sort()
+        estado = existentes.get(produto_id)
+        if estado is None or novos[0][0] <= estado.DataUltimoPreco:
+            recalcular.add(produto_id)
+
+    referencia_id = _produto_referencia(connection)
+    incrementais = {pid: novos for pid, novos in por_produto.items() if pid not in recalcular}
+    if incrementais:
+        retornos_ref = _retornos_referencia(
+            connection,
+            referencia_id,
+            min(novos[0][0] for novos in incrementais.values()),
+            max(novos[-1][0] for novos in incrementais.values())
+        )
+        for produto_id, novos in incrementais.items():
+            estado = existentes[produto_id]
+            for data, preco in novos:
+                estado.adicionar(data, preco, retornos_ref.get(data))
+        _gravar_estados(connection, [existentes[pid] for pid in incrementais])
+
+    if recalcular:
+        recalcular_estatisticas(connection, recalcular)
+
+    if referencia_id is not None:
+        datas_novas = {data for data, _ in por_produto.get(referencia_id, ())}
+        datas_corrigidas = {data for produto_id, data in corrigidos if produto_id == referencia_id}
+        if datas_novas or datas_corrigidas:
+            # Os produtos recalculados já leram a série completa da referência; os incrementais,
+            # as datas que receberam nesta mesma carga
+            ja_incluidos = {pid: {data for data, _ in novos} for pid, novos in incrementais.items()}
+            ja_incluidos.update({pid: None for pid in recalcular})
+            _atualizar_pares(connection, referencia_id, datas_novas, datas_corrigidas, ja_incluidos)
+
+
+def _atualizar_pares(connection, referencia_id, datas_novas, datas_corrigidas, ja_incluidos):
+    """Leva às estatísticas dos demais produtos os preços novos ou corrigidos da referência."""
+    alteradas = datas_novas | datas_corrigidas
+    datas_ref = list(connection.execute(
+        select(HistoricoPreco.Data).where(
+            HistoricoPreco.ProdutoID == referencia_id,
+            HistoricoPreco.PrecoFechamento > 0,
+            HistoricoPreco.Data > min(alteradas)
+        ).order_by(HistoricoPreco.Data)
+    ).scalars())
+    posteriores = [data for data in datas_ref if data not in alteradas]
+
+    def produtos_com_preco(datas):
+        datas = sorted(datas)
+        produto_ids = set()
+        for i in range(0, len(datas), TAMANHO_LOTE_IN):
+            produto_ids.update(connection.execute(
+                select(HistoricoPreco.ProdutoID).where(
+                    HistoricoPreco.Data.in_(datas[i:i + TAMANHO_LOTE_IN]),
+                    HistoricoPreco.PrecoFechamento > 0,
+                    HistoricoPreco.ProdutoID != referencia_id
+                ).distinct()
+            ).scalars())
+        return produto_ids
+
+    if datas_corrigidas or posteriores:
+        # Correção ou preço retroativo: mudam também retornos já usados em pares (a data seguinte
+        # da referência); os produtos com preço nessas datas são recalculados do histórico
+        afetadas = set(alteradas)
+        for data in alteradas:
+            seguinte = next((d for d in datas_ref if d > data and d not in alteradas), None)
+            if seguinte is not None:
+                afetadas.add(seguinte)
+        produto_ids = {pid for pid in produtos_com_preco(afetadas) if pid not in ja_incluidos
+                       or ja_incluidos[pid] is not None}
+        if produto_ids:
+            recalcular_estatisticas(connection, produto_ids)
+        return
+
+    # Preços novos no fim da série: só faltam os pares dessas datas, para os produtos que já
+    # tinham preço nelas quando a referência ainda não tinha
+    retornos_ref = _retornos_referencia(connection, referencia_id, min(datas_novas), max(datas_novas))
+    anterior = aliased(HistoricoPreco)
+    preco_anterior = select(anterior.PrecoFechamento).where(
+        anterior.ProdutoID == HistoricoPreco.ProdutoID,
+        anterior.Data < HistoricoPreco.Data,
+        anterior.PrecoFechamento > 0
+    ).order_by(anterior.Data.desc()).limit(1).scalar_subquery()
+
+    datas = sorted(d for d in datas_novas if d in retornos_ref)
+    pares = {}
+    for i in range(0, len(datas), TAMANHO_LOTE_IN):
+        for produto_id, data, preco, preco_ant in connection.execute(
+            select(HistoricoPreco.ProdutoID, HistoricoPreco.Data, HistoricoPreco.PrecoFechamento, preco_anterior)
+            .where(
+                HistoricoPreco.Data.in_(datas[i:i + TAMANHO_LOTE_IN]),
+                HistoricoPreco.PrecoFechamento > 0,
+                HistoricoPreco.ProdutoID != referencia_id
+            )
+        ):
+            incluidas = ja_incluidos.get(produto_id, set())
+            if preco_ant is None or incluidas is None or data in incluidas:
+                continue
+            pares.setdefault(produto_id, []).append(
+                (math.log(float(preco) / float(preco_ant)), retornos_ref[data]))
+
+    estados = _ler_estatisticas(connection, list(pares))
+    sem_estado = [pid for pid in pares if pid not in estados]
+    for produto_id, estado in estados.items():
+        for retorno, retorno_referencia in pares[produto_id]:
+            estado.adicionar_par(retorno, retorno_referencia)
+    if estados:
+        _gravar_estados(connection, list(estados.values()))
+    if sem_estado:
+        recalcular_estatisticas(connection, sem_estado)
+
+
+def recalcular_estatisticas(connection, produto_ids=None):
+    """Reconstrói EstatisticaProduto a partir do histórico (todos os produtos ou apenas os informados)."""
+    tabela = EstatisticaProduto.__table__
+    if produto_ids is None:
+        connection.execute(delete(tabela))
+        produto_ids = list(connection.execute(select(HistoricoPreco.ProdutoID).distinct()).scalars())
+    else:
+        produto_ids = list(produto_ids)
+        for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+            connection.execute(delete(tabela).where(tabela.c.ProdutoID.in_(produto_ids[i:i + TAMANHO_LOTE_IN])))
+
+    retornos_ref = _retornos_referencia(connection, _produto_referencia(connection))
+    total = 0
+    for i in range(0, len(produto_ids), TAMANHO_LOTE_ESTATISTICA):
+        lote = produto_ids[i:i + TAMANHO_LOTE_ESTATISTICA]
+        linhas = connection.execute(
+            select(HistoricoPreco.ProdutoID, HistoricoPreco.Data, HistoricoPreco.PrecoFechamento)
+            .where(HistoricoPreco.ProdutoID.in_(lote), HistoricoPreco.PrecoFechamento > 0)
+            .order_by(HistoricoPreco.ProdutoID, HistoricoPreco.Data)
+        ).all()
+
+        estados = []
+        for produto_id, data, preco in linhas:
+            if not estados or estados[-1].ProdutoID != produto_id:
+                estados.append(Acumulador.inicial(produto_id, data, preco))
+            else:
+                estados[-1].adicionar(data, preco, retornos_ref.get(data))
+
+        if estados:
+            connection.execute(insert(tabela), [estado.como_dict() for estado in estados])
+            total += len(estados)
+    return total
+
+
+# --- Eventos de HistoricoPreco (na mesma conexão e transação da escrita, como PrecoAtual) ---
+
+@event.listens_for(HistoricoPreco, 'after_insert')
+def _apos_inserir_preco(mapper, connection, target):
+    avancar_estatisticas(connection, {(target.ProdutoID, target.Data): target.PrecoFechamento})
+
+
+@event.listens_for(HistoricoPreco, 'after_update')
+@event.listens_for(HistoricoPreco, 'after_delete')
+def _apos_alterar_preco(mapper, connection, target):
+    avancar_estatisticas(connection, {}, corrigidos=[(target.ProdutoID, target.Data)])
@@ -0,0 +1,93 @@
+from collections import namedtuple
+from sqlalchemy import select, desc
+from app import db
+from app.models import QuestionarioSuitabilityVersao, Pergunta, OpcaoResposta
+from app.schemas import questionario_schema, questionario_load_options
+from app.services.cache import TTLCache, MISSING
+from app.services.risk_profile import ler_faixas
+
+# Questionário de suitability serializado e indexado em memória por VersaoID. As chaves levam a
+# versão do recurso 'questionario' (services/versioning.py), incrementada em qualquer escrita em
+# QuestionarioSuitabilityVersao, Pergunta, OpcaoResposta ou FaixaPerfilRisco: publicar uma versão
+# troca a chave em todos os processos, e as entradas antigas saem pelo LRU/TTL.
+
+OpcaoSuitability = namedtuple('OpcaoSuitability', 'VersaoID PerguntaID Pontos')
+# dados: QuestionarioSchema já serializado; opcoes: {OpcaoID: OpcaoSuitability}
+QuestionarioCompilado = namedtuple('QuestionarioCompilado', 'VersaoID dados opcoes total_perguntas')
+
+
+def _compilar(versao):
+    opcoes = {
+        opcao.OpcaoID: OpcaoSuitability(versao.VersaoID, pergunta.PerguntaID, opcao.Pontos)
+        for pergunta in versao.perguntas for opcao in pergunta.opcoes
+    }
+    return QuestionarioCompilado(versao.VersaoID, questionario_schema.dump(versao), opcoes, len(versao.perguntas))
+
+
+class QuestionnaireCache:
+    """Questionário ativo e questionários por VersaoID, já serializados, e as faixas de perfil."""
+
+    def __init__(self, maxsize=64, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        self._cache.configure(
+            maxsize=app.config.get('QUESTIONARIO_CACHE_MAXSIZE'),
+            ttl=app.config.get('QUESTIONARIO_CACHE_TTL')
+        )
+
+    def _carregar(self, chave, consulta, versao_recurso):
+        questionario = self._cache.get(chave)
+        if questionario is MISSING:
+            versao = consulta.options(*questionario_load_options).first()
+            questionario = _compilar(versao) if versao else None
+            self._cache.set(chave, questionario)
+            if questionario is not None:
+                self._cache.set(('versao', questionario.VersaoID, versao_recurso), questionario)
+        return questionario
+
+    def ativo(self, versao_recurso):
+        """Versão de DataVigencia mais recente (None se não houver questionário)."""
+        consulta = QuestionarioSuitabilityVersao.query.order_by(desc(QuestionarioSuitabilityVersao.DataVigencia))
+        return self._carregar(('ativo', versao_recurso), consulta, versao_recurso)
+
+    def por_versao(self, versao_id, versao_recurso):
+        consulta = QuestionarioSuitabilityVersao.query.filter_by(VersaoID=versao_id)
+        return self._carregar(('versao', versao_id, versao_recurso), consulta, versao_recurso)
+
+    def opcoes(self, opcao_ids, versao_recurso):
+        """{OpcaoID: OpcaoSuitability} das opções existentes entre `opcao_ids`.
+
+        Respostas ao questionário ativo saem só da memória; opções de outras versões são
+        localizadas no banco e a versão correspondente entra no cache.
+        """
+        opcao_ids = set(opcao_ids)
+        ativo = self.ativo(versao_recurso)
+        if ativo is not None and opcao_ids <= ativo.opcoes.keys():
+            return {opcao_id: ativo.opcoes[opcao_id] for opcao_id in opcao_ids}
+
+        versoes = db.session.execute(
+            select(Pergunta.VersaoID).join(OpcaoResposta, OpcaoResposta.PerguntaID == Pergunta.PerguntaID)
+            .where(OpcaoResposta.OpcaoID.in_(opcao_ids)).distinct()
+        ).scalars().all()
+        encontradas = {}
+        for versao_id in versoes:
+            questionario = self.por_versao(versao_id, versao_recurso)
+            if questionario is not None:
+                encontradas.update({o: questionario.opcoes[o] for o in opcao_ids if o in questionario.opcoes})
+        return encontradas
+
+    def faixas(self, versao_recurso):
+        """FaixasPerfil de FaixaPerfilRisco (services/risk_profile.py)."""
+        chave = ('faixas', versao_recurso)
+        faixas = self._cache.get(chave)
+        if faixas is MISSING:
+            faixas = ler_faixas(db.session.connection())
+            self._cache.set(chave, faixas)
+        return faixas
+
+    def invalidate(self):
+        self._cache.clear()
+
+
+questionnaire_cache = QuestionnaireCache()
@@ -0,0 +1,121 @@
+import time
+from bisect import bisect_right
+from collections import Counter
+from sqlalchemy import select, update, bindparam
+from app import db
+from app.models import FaixaPerfilRisco, RespostaSuitabilityCliente
+from app.services.client_claims import marcar_claims_alteradas
+from app.services.trading_context import marcar_contextos_alterados
+from app.services.versioning import QUESTIONARIO, incrementar_versoes
+
+# Perfil de risco a partir da pontuação do suitability, com as faixas de FaixaPerfilRisco (a mesma
+# tabela de fn_CalcularPerfilRisco). Quando o compliance muda as faixas, `flask suitability
+# reclassificar` recalcula o PerfilCalculado de todas as respostas.
+
+# Faixas do script de criação do banco, usadas enquanto FaixaPerfilRisco estiver vazia
+FAIXAS_PADRAO = ((0, 'Conservador'), (50, 'Moderado'), (81, 'Agressivo'))
+# Respostas lidas, recalculadas e gravadas por transação
+TAMANHO_LOTE_RECLASSIFICACAO = 5000
+
+
+class FaixasPerfil:
+    """Faixas (PontuacaoMinima, PerfilCalculado) em ordem crescente de pontuação."""
+
+    def __init__(self, faixas):
+        faixas = sorted(faixas)
+        self.minimos = [minimo for minimo, _ in faixas]
+        self.perfis = [perfil for _, perfil in faixas]
+
+    def perfil(self, pontuacao):
+        """Perfil da faixa de maior PontuacaoMinima <= pontuacao (abaixo da primeira, o perfil dela)."""
+        if pontuacao is None:
+            return 'Indefinido'
+        return self.perfis[max(bisect_right(self.minimos, pontuacao) - 1, 0)]
+
+    def pontuacao_minima(self, perfil):
+        """Menor pontuação do perfil (a da primeira faixa para perfis desconhecidos)."""
+        return self.minimos[self.perfis.index(perfil)] if perfil in self.perfis else self.minimos[0]
+
+    def como_lista(self):
+        return [{"PontuacaoMinima": m, "PerfilCalculado": p} for m, p in zip(self.minimos, self.perfis)]
+
+
+def ler_faixas(connection):
+    faixas = connection.execute(
+        select(FaixaPerfilRisco.PontuacaoMinima, FaixaPerfilRisco.PerfilCalculado)
+    ).all()
+    return FaixasPerfil([tuple(f) for f in faixas] or FAIXAS_PADRAO)
+
+
+def reclassificar_respostas(tamanho_lote=TAMANHO_LOTE_RECLASSIFICACAO, simular=False):
+    """Recalcula PerfilCalculado de todas as respostas com as faixas atuais.
+
+    As respostas são lidas em blocos por RespostaID e só as que mudaram de perfil são gravadas,
+    com um UPDATE em lote e um commit por bloco (a rotina pode ser repetida se interrompida).
+    Com `simular`, nada é gravado. Retorna o resumo com as transições de perfil.
+    """
+    tabela = RespostaSuitabilityCliente.__table__
+    faixas = ler_faixas(db.session.connection())
+    atualizar = (
+        update(tabela)
+        .where(tabela.c.RespostaID == bindparam('v_RespostaID'))
+        .values(PerfilCalculado=bindparam('v_PerfilCalculado'))
+    )
+
+    inicio = time.perf_counter()
+    lidas = alteradas = 0
+    clientes = set()
+    transicoes = Counter()
+    ultimo_id = None
+    while True:
+        consulta = select(
+            tabela.c.RespostaID, tabela.c.ClienteID, tabela.c.PontuacaoTotal, tabela.c.PerfilCalculado
+        ).order_by(tabela.c.RespostaID).limit(tamanho_lote)
+        if ultimo_id is not None:
+            consulta = consulta.where(tabela.c.RespostaID > ultimo_id)
+        linhas = db.session.execute(consulta).all()
+        if not linhas:
+            break
+        ultimo_id = linhas[-1].RespostaID
+        lidas += len(linhas)
+
+        mudancas = []
+        clientes_lote = set()
+        for linha in linhas:
+            perfil = faixas.perfil(linha.PontuacaoTotal)
+            if perfil != linha.PerfilCalculado:
+                mudancas.append({'v_RespostaID': linha.RespostaID, 'v_PerfilCalculado': perfil})
+                clientes_lote.add(linha.ClienteID)
+                transicoes[(linha.PerfilCalculado, perfil)] += 1
+
+        alteradas += len(mudancas)
+        clientes |= clientes_lote
+        if mudancas and not simular:
+            db.session.connection().execute(atualizar, mudancas)
+            # UPDATE fora do ORM: contexto de negociação e claims do token descartados após o commit
+            marcar_contextos_alterados(db.session, cliente_ids=clientes_lote)
+            marcar_claims_alteradas(db.session, clientes_lote)
+            db.session.commit()
+
+    if simular:
+        db.session.rollback()
+    else:
+        # As faixas são lidas junto com o questionário (services/questionnaire.py): a nova versão
+        # do recurso faz todos os processos relerem as faixas
+        incrementar_versoes(db.session.connection(), [QUESTIONARIO])
+        db.session.commit()
+
+    duracao = time.perf_counter() - inicio
+    return {
+        "faixas": faixas.como_lista(),
+        "respostas_lidas": lidas,
+        "respostas_alteradas": alteradas,
+        "clientes_afetados": len(clientes),
+        "transicoes": [
+            {"de": de, "para": para, "respostas": total}
+            for (de, para), total in sorted(transicoes.items(), key=lambda t: (-t[1], t[0]))
+        ],
+        "simulacao": simular,
+        "duracao_segundos": round(duracao, 3),
+        "respostas_por_segundo": round(lidas / duracao, 1) if duracao > 0 else None
+    }
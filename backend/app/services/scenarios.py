@@ -0,0 +1,235 @@
+from collections import namedtuple
+import numpy as np
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import object_session
+from app import db
+from app.models import HistoricoPreco
+from app.serializers import dump_simulacao_cenarios
+from app.services.cache import TTLCache, MISSING
+from app.services.pricing import TAMANHO_LOTE_IN, price_cache
+from app.services.valuation import _buscar_posicoes, avaliar, totais
+
+# Simulação de Monte Carlo do valor da carteira: cenários de preço correlacionados, gerados a
+# partir dos log-retornos diários de HistoricoPreco (média e covariância da janela). Os cenários
+# são processados em blocos de matrizes NumPy; o modelo de retornos fica em cache por universo
+# de produtos.
+
+PERCENTIS = (1, 5, 25, 50, 75, 95, 99)
+# Limite de números aleatórios por bloco (cenários x produtos), para não alocar tudo de uma vez
+TAMANHO_BLOCO = 1_000_000
+# Retornos diários mínimos na janela: com um só, a covariância amostral (ddof=1) é NaN
+MIN_OBSERVACOES = 2
+
+# produto_ids: ordem das colunas; fator: F tal que F @ F.T = covariância diária;
+# ultimos_precos: último fechamento da janela (None para produtos sem histórico)
+ModeloRetornos = namedtuple('ModeloRetornos', 'produto_ids media fator observacoes ultimos_precos sem_historico')
+
+
+def _ler_historico(produto_ids, janela):
+    """Fechamentos das últimas `janela` + 1 datas com preço no universo, ordenados por data."""
+    linhas = []
+    for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+        lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+        datas = select(HistoricoPreco.Data).where(
+            HistoricoPreco.ProdutoID.in_(lote)
+        ).distinct().order_by(HistoricoPreco.Data.desc()).limit(janela + 1).subquery()
+
+        linhas.extend(db.session.execute(
+            select(HistoricoPreco.Data, HistoricoPreco.ProdutoID, HistoricoPreco.PrecoFechamento).where(
+                HistoricoPreco.ProdutoID.in_(lote),
+                HistoricoPreco.Data >= select(func.min(datas.c.Data)).scalar_subquery()
+            )
+        ).all())
+
+    # Lotes diferentes podem ter datas distintas: mantém só as últimas janela + 1 do conjunto
+    datas = sorted({linha.Data for linha in linhas})[-(janela + 1):]
+    return datas, [linha for linha in linhas if datas and linha.Data >= datas[0]]
+
+
+def _fator_covariancia(covariancia):
+    """Fator F com F @ F.T = covariância; matrizes singulares caem na decomposição espectral."""
+    try:
+        return np.linalg.cholesky(covariancia)
+    except np.linalg.LinAlgError:
+        autovalores, autovetores = np.linalg.eigh(covariancia)
+        return autovetores * np.sqrt(np.clip(autovalores, 0, None))
+
+
+def construir_modelo(produto_ids, janela):
+    """Média e fator da covariância dos log-retornos diários de `produto_ids` (ordenados)."""
+    datas, linhas = _ler_historico(list(produto_ids), janela)
+    coluna = {pid: j for j, pid in enumerate(produto_ids)}
+    if len(datas) < MIN_OBSERVACOES + 1:
+        vazio = np.zeros(len(produto_ids))
+        ultimos = {linha.ProdutoID: linha.PrecoFechamento for linha in linhas}
+        return ModeloRetornos(
+            tuple(produto_ids), vazio, np.zeros((len(produto_ids), len(produto_ids))), max(len(datas) - 1, 0),
+            [ultimos.get(pid) for pid in produto_ids], [pid for pid in produto_ids if pid not in ultimos]
+        )
+    linha_da_data = {data: i for i, data in enumerate(datas)}
+
+    precos = np.full((len(datas), len(produto_ids)), np.nan)
+    for linha in linhas:
+        precos[linha_da_data[linha.Data], coluna[linha.ProdutoID]] = float(linha.PrecoFechamento)
+
+    observado = ~np.isnan(precos) & (precos > 0)
+    sem_historico = [pid for pid, j in coluna.items() if not observado[:, j].any()]
+
+    # Dias sem cotação repetem o último fechamento (antes do primeiro, o primeiro): retorno zero
+    indices = np.where(observado, np.arange(len(datas))[:, None], -1)
+    np.maximum.accumulate(indices, axis=0, out=indices)
+    primeiro = np.argmax(observado, axis=0)
+    indices = np.where(indices < 0, primeiro, indices)
+    precos = np.where(observado.any(axis=0), precos[indices, np.arange(len(produto_ids))], 1.0)
+
+    retornos = np.diff(np.log(precos), axis=0)
+    media = retornos.mean(axis=0)
+    fator = _fator_covariancia(np.atleast_2d(np.cov(retornos, rowvar=False)))
+
+    ultimos = {}
+    for linha in linhas:
+        if linha.ProdutoID not in ultimos or linha.Data >= ultimos[linha.ProdutoID].Data:
+            ultimos[linha.ProdutoID] = linha
+    return ModeloRetornos(
+        tuple(produto_ids), media, fator, len(retornos),
+        [ultimos[pid].PrecoFechamento if pid in ultimos else None for pid in produto_ids], sem_historico
+    )
+
+
+class ScenarioModelCache:
+    """ModeloRetornos por (universo de produtos, janela).
+
+    Escritas em HistoricoPreco descartam os modelos que contêm o produto quando a transação
+    é confirmada.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        self._cache.configure(
+            maxsize=app.config.get('SCENARIO_CACHE_MAXSIZE'),
+            ttl=app.config.get('SCENARIO_CACHE_TTL')
+        )
+
+    def get(self, produto_ids, janela):
+        chave = (tuple(sorted(set(produto_ids))), janela)
+        modelo = self._cache.get(chave)
+        if modelo is MISSING:
+            modelo = construir_modelo(chave[0], janela)
+            self._cache.set(chave, modelo)
+        return modelo
+
+    def invalidate(self, produto_ids=None):
+        if produto_ids is None:
+            self._cache.clear()
+        else:
+            produto_ids = set(produto_ids)
+            self._cache.invalidate_where(lambda modelo: not produto_ids.isdisjoint(modelo.produto_ids))
+
+
+scenario_models = ScenarioModelCache()
+
+
+def simular_valores(exposicoes, modelo, cenarios, horizonte, semente=None):
+    """Valor da carteira em cada cenário: soma de exposicao x exp(retorno do horizonte)."""
+    rng = np.random.default_rng(semente)
+    n = len(exposicoes)
+    deriva = modelo.media * horizonte
+    fator = modelo.fator.T * np.sqrt(horizonte)
+
+    valores = np.empty(cenarios)
+    bloco = max(1, TAMANHO_BLOCO // max(n, 1))
+    for inicio in range(0, cenarios, bloco):
+        fim = min(inicio + bloco, cenarios)
+        choques = rng.standard_normal((fim - inicio, n))
+        valores[inicio:fim] = np.exp(choques @ fator + deriva) @ exposicoes
+    return valores
+
+
+def estatisticas(valores, valor_atual, confianca):
+    """VaR e expected shortfall (como perdas positivas), percentis e momentos do valor final."""
+    resultado = valores - valor_atual
+    corte = np.quantile(resultado, 1 - confianca)
+    cauda = resultado[resultado <= corte]
+    return {
+        "valor_esperado": valores.mean(),
+        "desvio_padrao": valores.std(ddof=1) if len(valores) > 1 else 0.0,
+        "var": max(-corte, 0.0),
+        "expected_shortfall": max(-cauda.mean(), 0.0) if len(cauda) else max(-corte, 0.0),
+        "probabilidade_perda": float((resultado < 0).mean()),
+        "percentis": dict(zip(PERCENTIS, np.percentile(valores, PERCENTIS)))
+    }
+
+
+def simular_cenarios_portfolio(portfolio, cenarios, horizonte, confianca, janela, semente=None):
+    """Distribuição do valor da carteira em `horizonte` dias úteis, em `cenarios` cenários."""
+    posicoes = [p for p in _buscar_posicoes([portfolio.PortfolioID]) if p.Quantidade]
+    if not posicoes:
+        raise ValueError("Portfólio vazio. Adicione ativos para simular.")
+
+    modelo = scenario_models.get([p.ProdutoID for p in posicoes], janela)
+    if modelo.observacoes < MIN_OBSERVACOES:
+        raise ValueError("Histórico insuficiente para simular.")
+    coluna = {pid: j for j, pid in enumerate(modelo.produto_ids)}
+
+    # Preço de partida: o mesmo da carteira valorizada; sem PrecoAtual, o último da janela
+    precos = price_cache.get_prices(list(modelo.produto_ids))
+    for pid, ultimo in zip(modelo.produto_ids, modelo.ultimos_precos):
+        if pid not in precos and ultimo is not None:
+            precos[pid] = ultimo
+
+    exposicoes = np.zeros(len(modelo.produto_ids))
+    for p in posicoes:
+        exposicoes[coluna[p.ProdutoID]] += float(p.Quantidade) * float(precos.get(p.ProdutoID, 0))
+
+    valor_atual = totais(avaliar(
+        [p.Quantidade for p in posicoes],
+        [precos.get(p.ProdutoID, 0) for p in posicoes],
+        custos_medios=[p.CustoMedio for p in posicoes]
+    ))["valor_mercado_total"]
+
+    valores = simular_valores(exposicoes, modelo, cenarios, horizonte, semente)
+    return dump_simulacao_cenarios(
+        portfolio,
+        valor_atual,
+        estatisticas(valores, float(exposicoes.sum()), confianca),
+        {
+            "cenarios": cenarios,
+            "horizonte_dias": horizonte,
+            "confianca": confianca,
+            "janela_dias": janela,
+            "observacoes": modelo.observacoes,
+            "produtos_sem_historico": modelo.sem_historico,
+            "produtos_sem_preco": sorted(pid for pid in coluna if pid not in precos)
+        }
+    )
+
+
+def marcar_retornos_alterados(session, produto_ids):
+    """Agenda a invalidação para escritas em HistoricoPreco feitas fora do ORM."""
+    session.info.setdefault('cenarios_produtos_alterados', set()).update(produto_ids)
+
+
+# --- Eventos: novos preços mudam a janela de retornos dos universos que contêm o produto ---
+
+def _apos_alterar_preco(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        marcar_retornos_alterados(session, [target.ProdutoID])
+
+
+for _evento in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(HistoricoPreco, _evento, _apos_alterar_preco)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_apos_commit(session):
+    produtos = session.info.pop('cenarios_produtos_alterados', None)
+    if produtos:
+        scenario_models.invalidate(produtos)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_apos_rollback(session):
+    session.info.pop('cenarios_produtos_alterados', None)
@@ -0,0 +1,145 @@
+from collections import namedtuple
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+from app import db
+from app.models import Cliente, Conta, RespostaSuitabilityCliente, ProdutoFinanceiro
+from app.services.cache import TTLCache, MISSING
+from app.services.pricing import TAMANHO_LOTE_IN
+
+# Fatos pré-negociação que mudam pouco e são consultados em toda ordem
+ContextoCliente = namedtuple('ContextoCliente', 'ClienteID StatusCompliance PerfilCalculado ContaID')
+ProdutoNegociacao = namedtuple('ProdutoNegociacao', 'ProdutoID NivelRiscoProduto')
+
+
+def _buscar_contexto_cliente(cliente_id):
+    """Status de compliance, perfil da resposta de suitability mais recente e conta, em uma consulta."""
+    perfil_recente = select(RespostaSuitabilityCliente.PerfilCalculado).where(
+        RespostaSuitabilityCliente.ClienteID == Cliente.ClienteID
+    ).order_by(RespostaSuitabilityCliente.DataResposta.desc()).limit(1).scalar_subquery()
+
+    conta = select(Conta.ContaID).where(
+        Conta.ClienteID == Cliente.ClienteID
+    ).order_by(Conta.ContaID).limit(1).scalar_subquery()
+
+    linha = db.session.execute(
+        select(
+            Cliente.ClienteID,
+            Cliente.StatusCompliance,
+            perfil_recente.label('PerfilCalculado'),
+            conta.label('ContaID')
+        ).where(Cliente.ClienteID == cliente_id)
+    ).first()
+    return ContextoCliente(*linha) if linha else None
+
+
+def _buscar_produtos(produto_ids):
+    produtos = {}
+    for i in range(0, len(produto_ids), TAMANHO_LOTE_IN):
+        lote = produto_ids[i:i + TAMANHO_LOTE_IN]
+        for linha in db.session.execute(
+            select(ProdutoFinanceiro.ProdutoID, ProdutoFinanceiro.NivelRiscoProduto)
+            .where(ProdutoFinanceiro.ProdutoID.in_(lote))
+        ):
+            produtos[linha.ProdutoID] = ProdutoNegociacao(*linha)
+    return produtos
+
+
+class TradingContextCache:
+    """Cache do contexto de negociação por ClienteID e do nível de risco por ProdutoID.
+
+    Escritas em Cliente, Conta, RespostaSuitabilityCliente e ProdutoFinanceiro invalidam as
+    entradas afetadas quando a transação é confirmada; o TTL limita a defasagem entre processos.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self._clientes = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._produtos = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        for cache in (self._clientes, self._produtos):
+            cache.configure(
+                maxsize=app.config.get('TRADING_CONTEXT_CACHE_MAXSIZE'),
+                ttl=app.config.get('TRADING_CONTEXT_CACHE_TTL')
+            )
+
+    def get_cliente(self, cliente_id):
+        contexto = self._clientes.get(cliente_id)
+        if contexto is MISSING:
+            contexto = _buscar_contexto_cliente(cliente_id)
+            if contexto is not None:
+                self._clientes.set(cliente_id, contexto)
+        return contexto
+
+    def get_produtos(self, produto_ids):
+        """Retorna {ProdutoID: ProdutoNegociacao} apenas para os produtos existentes."""
+        produto_ids = list(dict.fromkeys(produto_ids))
+        encontrados, ausentes = self._produtos.get_many(produto_ids)
+
+        if ausentes:
+            carregados = _buscar_produtos(ausentes)
+            self._produtos.set_many(carregados)
+            encontrados.update(carregados)
+
+        return encontrados
+
+    def get_produto(self, produto_id):
+        return self.get_produtos([produto_id]).get(produto_id)
+
+    def invalidate_clientes(self, cliente_ids=None):
+        if cliente_ids is None:
+            self._clientes.clear()
+        else:
+            self._clientes.invalidate_many(cliente_ids)
+
+    def invalidate_produtos(self, produto_ids=None):
+        if produto_ids is None:
+            self._produtos.clear()
+        else:
+            self._produtos.invalidate_many(produto_ids)
+
+
+trading_context = TradingContextCache()
+
+
+def marcar_contextos_alterados(session, cliente_ids=(), produto_ids=()):
+    """Agenda a invalidação para escritas feitas fora do ORM (ex.: UPDATEs em lote)."""
+    session.info.setdefault('contextos_clientes_alterados', set()).update(cliente_ids)
+    session.info.setdefault('contextos_produtos_alterados', set()).update(produto_ids)
+
+
+# --- Eventos: as entradas só são descartadas após o commit (como em pricing.py) ---
+
+def _registrar_cliente_alterado(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        marcar_contextos_alterados(session, cliente_ids=[target.ClienteID])
+
+
+def _registrar_produto_alterado(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        marcar_contextos_alterados(session, produto_ids=[target.ProdutoID])
+
+
+for _evento in ('after_update', 'after_delete'):
+    event.listen(Cliente, _evento, _registrar_cliente_alterado)
+for _evento in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Conta, _evento, _registrar_cliente_alterado)
+    event.listen(RespostaSuitabilityCliente, _evento, _registrar_cliente_alterado)
+    event.listen(ProdutoFinanceiro, _evento, _registrar_produto_alterado, propagate=True)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_apos_commit(session):
+    clientes = session.info.pop('contextos_clientes_alterados', None)
+    produtos = session.info.pop('contextos_produtos_alterados', None)
+    if clientes:
+        trading_context.invalidate_clientes(clientes)
+    if produtos:
+        trading_context.invalidate_produtos(produtos)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_apos_rollback(session):
+    session.info.pop('contextos_clientes_alterados', None)
+    session.info.pop('contextos_produtos_alterados', None)
@@ -0,0 +1,289 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+from sqlalchemy import select, insert, delete
+from app import db
+from app.models import Portfolio, Posicao, ProdutoFinanceiro, SnapshotPortfolio
+from app.serializers import dump_posicao_valorizada, dump_portfolio_valorizado, dump_snapshot_portfolio
+from app.services.pricing import price_cache, precos_na_data
+from app.services.versioning import SNAPSHOTS, incrementar_versoes
+
+# Motor de valorização: quantidades, custos e preços entram como arrays de inteiros em ponto
+# fixo (8 casas, como Quantidade e PrecoFechamento) e os produtos são calculados de uma vez,
+# exatos, com arredondamento (ROUND_HALF_UP) para centavos. Os Decimais só existem nas bordas:
+# na conversão das colunas e na serialização.
+
+ESCALA_ENTRADA = 8
+_BASE = 10 ** ESCALA_ENTRADA
+_LIMITE_UNIDADES = 10 ** 18            # |valor| < 10^10 com 8 casas: os produtos parciais cabem em int64
+_LIMITE_PRODUTO_INTEIRO = 9 * 10 ** 16  # parte inteira de q x p, em centavos, também em int64
+TAMANHO_LOTE_MARCACAO = 5000
+
+# Arrays de centavos (int64) por posição
+Avaliacao = namedtuple('Avaliacao', 'valor_mercado custo_total resultado_financeiro')
+
+
+def _unidades(valores, escala=ESCALA_ENTRADA):
+    """Converte Decimais (ou números) para inteiros com `escala` casas, arredondando na borda."""
+    inteiros = [
+        int((v if isinstance(v, Decimal) else Decimal(str(v or 0)))
+            .scaleb(escala).to_integral_value(rounding=ROUND_HALF_UP))
+        for v in valores
+    ]
+    try:
+        unidades = np.array(inteiros, dtype=np.int64)
+        if not unidades.size or np.abs(unidades).max() < _LIMITE_UNIDADES:
+            return unidades
+    except OverflowError:
+        pass
+    # Valores fora da faixa das colunas (ex.: preço simulado absurdo): inteiros do Python
+    return np.array(inteiros, dtype=object)
+
+
+def _multiplicar_centavos(a, b):
+    """a x b (ambos com 8 casas) em centavos, arredondado ROUND_HALF_UP, sem passar por float.
+
+    Com a = ai·10^8 + af e b = bi·10^8 + bf, o produto (16 casas) é
+    ai·bi·10^16 + (ai·bf + af·bi)·10^8 + af·bf; cada parcela cabe em int64.
+    """
+    sinal = np.sign(a) * np.sign(b)
+    a, b = np.abs(a), np.abs(b)
+    if a.dtype == np.int64 and b.dtype == np.int64:
+        partes_inteiras = (a // _BASE).astype(np.float64) * (b // _BASE)
+        if partes_inteiras.size and partes_inteiras.max() >= _LIMITE_PRODUTO_INTEIRO:
+            a, b = a.astype(object), b.astype(object)
+
+    ai, af = a // _BASE, a % _BASE
+    bi, bf = b // _BASE, b % _BASE
+    meio = ai * bf + af * bi                        # unidades de 10^-8
+    centavos = ai * bi * 100 + meio // 10 ** 6
+    resto = (meio % 10 ** 6) * _BASE + af * bf     # unidades de 10^-16, < 1.01·10^16
+    centavos = centavos + (resto + 5 * 10 ** 13) // 10 ** 14
+    return sinal * centavos
+
+
+def avaliar(quantidades, precos, custos_medios=None, custos_totais=None):
+    """Valor de mercado, custo e resultado de cada posição, em centavos.
+
+    O custo vem do custo médio (quantidade x custo médio) ou, se informado, já totalizado
+    (ex.: SUM(Quantidade * CustoMedio) de uma consolidação).
+    """
+    q = _unidades(quantidades)
+    valor_mercado = _multiplicar_centavos(q, _unidades(precos))
+    if custos_totais is not None:
+        custo_total = _unidades(custos_totais, 2)
+    else:
+        custo_total = _multiplicar_centavos(q, _unidades(custos_medios))
+    return Avaliacao(valor_mercado, custo_total, valor_mercado - custo_total)
+
+
+def para_decimal(centavos):
+    return Decimal(int(centavos)).scaleb(-2)
+
+
+def para_decimais(centavos):
+    return [para_decimal(c) for c in centavos]
+
+
+def totais(avaliacao):
+    """Somas exatas (em centavos) das posições: o total é a soma das linhas exibidas."""
+    valor_mercado = int(avaliacao.valor_mercado.sum())
+    custo = int(avaliacao.custo_total.sum())
+    return {
+        "valor_mercado_total": para_decimal(valor_mercado),
+        "custo_total": para_decimal(custo),
+        "resultado_total_financeiro": para_decimal(valor_mercado - custo)
+    }
+
+
+def somar_por_chave(chaves, avaliacao):
+    """Totais por chave (ex.: PortfolioID) em uma passada: {chave: (valor_mercado, custo, posicoes)}
+    em centavos, como inteiros do Python (podem ser somados entre lotes e trafegar entre processos).
+    """
+    if not len(chaves):
+        return {}
+    unicas, indices, contagens = np.unique(np.asarray(chaves), return_inverse=True, return_counts=True)
+    somas = []
+    for valores in (avaliacao.valor_mercado, avaliacao.custo_total):
+        soma = np.zeros(len(unicas), dtype=valores.dtype)
+        np.add.at(soma, indices, valores)
+        somas.append(soma)
+    return {
+        chave.item(): (int(valor_mercado), int(custo), int(posicoes))
+        for chave, valor_mercado, custo, posicoes in zip(unicas, *somas, contagens)
+    }
+
+
+# --- Carteiras ---
+
+def _buscar_posicoes(portfolio_ids=None):
+    query = db.session.query(
+        Posicao.PosicaoID,
+        Posicao.PortfolioID,
+        Posicao.ProdutoID,
+        Posicao.Quantidade,
+        Posicao.CustoMedio,
+        ProdutoFinanceiro.Ticker,
+        ProdutoFinanceiro.NomeProduto,
+        ProdutoFinanceiro.ClasseAtivo,
+        ProdutoFinanceiro.NivelRiscoProduto,
+        ProdutoFinanceiro.Emissor
+    ).join(ProdutoFinanceiro, Posicao.ProdutoID == ProdutoFinanceiro.ProdutoID)
+    if portfolio_ids is not None:
+        query = query.filter(Posicao.PortfolioID.in_(portfolio_ids))
+    return query.order_by(Posicao.PortfolioID, Posicao.PosicaoID).all()
+
+
+def avaliar_portfolio(portfolio, mapa_precos=None):
+    """Estrutura de PortfolioSchema com as posições valorizadas.
+
+    `portfolio` é uma linha com PortfolioID, ClienteID e NomePortfolio. Usa o último preço de
+    cada produto (cache); `mapa_precos` ({ProdutoID: preço}) substitui apenas os produtos que
+    contém. Produtos sem preço valem zero.
+    """
+    posicoes = _buscar_posicoes([portfolio.PortfolioID])
+    precos = price_cache.get_prices(list({p.ProdutoID for p in posicoes}))
+    if mapa_precos:
+        precos.update(mapa_precos)
+    mapa_precos = precos
+
+    avaliacao = avaliar(
+        [p.Quantidade for p in posicoes],
+        [mapa_precos.get(p.ProdutoID, 0) for p in posicoes],
+        custos_medios=[p.CustoMedio for p in posicoes]
+    )
+    resumo = totais(avaliacao)
+
+    return dump_portfolio_valorizado(
+        portfolio,
+        [
+            dump_posicao_valorizada(p, valor_mercado, resultado)
+            for p, valor_mercado, resultado in zip(
+                posicoes,
+                para_decimais(avaliacao.valor_mercado),
+                para_decimais(avaliacao.resultado_financeiro)
+            )
+        ],
+        resumo["valor_mercado_total"],
+        resumo["resultado_total_financeiro"]
+    )
+
+
+# --- Marcação a mercado de todas as carteiras ---
+
+def _avaliar_lote(portfolio_ids, quantidades, custos_medios, precos):
+    """Executada nos processos do pool: recebe colunas simples e não usa o banco."""
+    return somar_por_chave(portfolio_ids, avaliar(quantidades, precos, custos_medios=custos_medios))
+
+
+def _lotes_posicoes(precos, tamanho_lote):
+    """Lê as posições em blocos (sem carregar a tabela inteira) já no formato de _avaliar_lote."""
+    consulta = select(
+        Posicao.PortfolioID, Posicao.ProdutoID, Posicao.Quantidade, Posicao.CustoMedio
+    ).order_by(Posicao.PosicaoID).execution_options(yield_per=tamanho_lote)
+
+    for linhas in db.session.execute(consulta).partitions():
+        yield (
+            [l.PortfolioID for l in linhas],
+            [l.Quantidade for l in linhas],
+            [l.CustoMedio for l in linhas],
+            [precos.get(l.ProdutoID, 0) for l in linhas]
+        )
+
+
+def _acumular(totais, parcial):
+    for portfolio_id, (valor_mercado, custo, posicoes) in parcial.items():
+        atual = totais.get(portfolio_id, (0, 0, 0))
+        totais[portfolio_id] = (atual[0] + valor_mercado, atual[1] + custo, atual[2] + posicoes)
+
+
+def avaliar_todos_portfolios(data, tamanho_lote=TAMANHO_LOTE_MARCACAO, processos=1):
+    """Valoriza todas as carteiras com o fechamento de `data` (último preço até a data).
+
+    As posições são lidas em blocos de `tamanho_lote`; com `processos` > 1 cada bloco é
+    calculado em um pool de processos, com no máximo 2 blocos por processo em memória.
+    Retorna {PortfolioID: (valor_mercado, custo, posicoes)} em centavos; produtos sem
+    preço na data valem zero.
+    """
+    precos = precos_na_data(data)
+    lotes = _lotes_posicoes(precos, tamanho_lote)
+    totais = {}
+
+    if processos <= 1:
+        for lote in lotes:
+            _acumular(totais, _avaliar_lote(*lote))
+        return totais
+
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        pendentes = set()
+        for lote in lotes:
+            pendentes.add(executor.submit(_avaliar_lote, *lote))
+            if len(pendentes) >= 2 * processos:
+                concluidos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    _acumular(totais, futuro.result())
+        for futuro in pendentes:
+            _acumular(totais, futuro.result())
+    return totais
+
+
+def gravar_snapshots(data, totais, tamanho_lote=TAMANHO_LOTE_MARCACAO):
+    """Substitui os snapshots de `data` (reexecutar o job no mesmo dia é seguro).
+
+    Carteiras sem posições também recebem snapshot (zerado). Não faz commit.
+    """
+    db.session.execute(delete(SnapshotPortfolio).where(SnapshotPortfolio.DataReferencia == data))
+
+    # Os IDs são lidos antes das inserções: sem MARS, o SQL Server não aceita outro comando
+    # na conexão enquanto um cursor ainda está sendo lido
+    portfolio_ids = db.session.execute(select(Portfolio.PortfolioID).order_by(Portfolio.PortfolioID)).scalars().all()
+    agora = datetime.utcnow()
+    gravados = 0
+    for i in range(0, len(portfolio_ids), tamanho_lote):
+        registros = []
+        for portfolio_id in portfolio_ids[i:i + tamanho_lote]:
+            valor_mercado, custo, posicoes = totais.get(portfolio_id, (0, 0, 0))
+            registros.append({
+                'PortfolioID': portfolio_id,
+                'DataReferencia': data,
+                'ValorMercado': para_decimal(valor_mercado),
+                'CustoTotal': para_decimal(custo),
+                'ResultadoFinanceiro': para_decimal(valor_mercado - custo),
+                'QuantidadePosicoes': posicoes,
+                'DataCalculo': agora
+            })
+        db.session.execute(insert(SnapshotPortfolio), registros)
+        gravados += len(registros)
+    incrementar_versoes(db.session.connection(), [SNAPSHOTS])
+    return gravados
+
+
+def buscar_snapshot(portfolio_id, data):
+    return db.session.query(
+        SnapshotPortfolio.DataReferencia,
+        SnapshotPortfolio.ValorMercado,
+        SnapshotPortfolio.CustoTotal,
+        SnapshotPortfolio.ResultadoFinanceiro,
+        SnapshotPortfolio.QuantidadePosicoes,
+        SnapshotPortfolio.DataCalculo
+    ).filter(
+        SnapshotPortfolio.PortfolioID == portfolio_id,
+        SnapshotPortfolio.DataReferencia == data
+    ).first()
+
+
+def valorizar_portfolio(portfolio, data=None):
+    """Valor da carteira para as rotas: com `data`, o snapshot de fechamento do dia; sem snapshot,
+    só o dia corrente é calculado ao vivo (LookupError para datas passadas ou futuras).
+    """
+    if data is None:
+        return avaliar_portfolio(portfolio)
+
+    snapshot = buscar_snapshot(portfolio.PortfolioID, data)
+    if snapshot is not None:
+        return dump_snapshot_portfolio(portfolio, snapshot)
+    if data == date.today():
+        return avaliar_portfolio(portfolio)
+    raise LookupError(f"Não há valorização de fechamento da carteira para {data.isoformat()}.")
@@ -0,0 +1,117 @@
+from sqlalchemy import event, select, insert, update, func, cast, literal, String, exc
+from sqlalchemy.orm import object_session
+from app import db
+from app.models import (
+    VersaoRecurso, Conta, MovimentacaoConta, Portfolio, Posicao, Ordem, SnapshotPortfolio,
+    ProdutoFinanceiro, HistoricoPreco, QuestionarioSuitabilityVersao, Pergunta, OpcaoResposta,
+    FaixaPerfilRisco
+)
+from app.services.pricing import TAMANHO_LOTE_IN
+
+# Contadores de versão por recurso lido pelas rotas (VersaoRecurso): as escritas incrementam o
+# contador na mesma transação, e as rotas de leitura montam o ETag só com as versões, sem
+# valorizar nem serializar nada. Recursos:
+#   'conta:<ContaID>'          Conta e MovimentacaoConta
+#   'portfolio:<PortfolioID>'  Portfolio, Posicao e Ordem
+#   'catalogo'                 produtos e preços (HistoricoPreco -> PrecoAtual/EstatisticaProduto)
+#   'snapshots'                SnapshotPortfolio (rotina de marcação a mercado)
+#   'questionario'             questionários de suitability (versões, perguntas e opções) e faixas de perfil
+
+CATALOGO = 'catalogo'
+SNAPSHOTS = 'snapshots'
+QUESTIONARIO = 'questionario'
+
+
+def recurso(prefixo, recurso_id):
+    return f"{prefixo}:{recurso_id}"
+
+
+def versao(prefixo, coluna=None):
+    """Versão do recurso como subconsulta escalar (0 se nunca alterado), para ler na mesma consulta
+    dos dados: versao('catalogo') ou versao('conta', Conta.ContaID)."""
+    tabela = VersaoRecurso.__table__
+    chave = literal(prefixo) if coluna is None else literal(f"{prefixo}:") + cast(coluna, String)
+    return func.coalesce(select(tabela.c.Versao).where(tabela.c.Recurso == chave).scalar_subquery(), 0)
+
+
+def ler_versoes(recursos):
+    """{recurso: versão} (0 para recursos nunca alterados)."""
+    tabela = VersaoRecurso.__table__
+    recursos = list(dict.fromkeys(recursos))
+    versoes = dict.fromkeys(recursos, 0)
+    for i in range(0, len(recursos), TAMANHO_LOTE_IN):
+        versoes.update(db.session.execute(
+            select(tabela.c.Recurso, tabela.c.Versao).where(tabela.c.Recurso.in_(recursos[i:i + TAMANHO_LOTE_IN]))
+        ).all())
+    return versoes
+
+
+def incrementar_versoes(connection, recursos):
+    """Incrementa as versões na transação de `connection` (escritas feitas fora do ORM)."""
+    tabela = VersaoRecurso.__table__
+    recursos = sorted(set(recursos))
+    for i in range(0, len(recursos), TAMANHO_LOTE_IN):
+        lote = recursos[i:i + TAMANHO_LOTE_IN]
+        incrementar = update(tabela).where(tabela.c.Recurso.in_(lote)).values(Versao=tabela.c.Versao + 1)
+        if connection.execute(incrementar).rowcount == len(lote):
+            continue
+
+        existentes = set(connection.execute(select(tabela.c.Recurso).where(tabela.c.Recurso.in_(lote))).scalars())
+        novos = [r for r in lote if r not in existentes]
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(tabela), [{'Recurso': r, 'Versao': 1} for r in novos])
+        except exc.IntegrityError:
+            # Outra transação criou o contador entre o UPDATE e o INSERT
+            connection.execute(update(tabela).where(tabela.c.Recurso.in_(novos)).values(Versao=tabela.c.Versao + 1))
+
+
+def marcar_recursos_alterados(session, recursos):
+    """Agenda o incremento para o fim do flush corrente (um UPDATE por flush, não por linha)."""
+    session.info.setdefault('versoes_alteradas', set()).update(recursos)
+
+
+# --- Eventos do ORM ---
+
+_RECURSOS_POR_MODELO = {
+    Conta: lambda alvo: [recurso('conta', alvo.ContaID)],
+    MovimentacaoConta: lambda alvo: [recurso('conta', conta_id)
+                                     for conta_id in (alvo.ContaOrigemID, alvo.ContaDestinoID) if conta_id],
+    Portfolio: lambda alvo: [recurso('portfolio', alvo.PortfolioID)],
+    Posicao: lambda alvo: [recurso('portfolio', alvo.PortfolioID)],
+    Ordem: lambda alvo: [recurso('portfolio', alvo.PortfolioID)],
+    SnapshotPortfolio: lambda alvo: [SNAPSHOTS],
+    ProdutoFinanceiro: lambda alvo: [CATALOGO],
+    HistoricoPreco: lambda alvo: [CATALOGO],
+    QuestionarioSuitabilityVersao: lambda alvo: [QUESTIONARIO],
+    Pergunta: lambda alvo: [QUESTIONARIO],
+    OpcaoResposta: lambda alvo: [QUESTIONARIO],
+    FaixaPerfilRisco: lambda alvo: [QUESTIONARIO],
+}
+
+
+def _registrar(recursos_de):
+    def apos_alterar(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            marcar_recursos_alterados(session, recursos_de(target))
+    return apos_alterar
+
+
+for _modelo, _recursos_de in _RECURSOS_POR_MODELO.items():
+    _ouvinte = _registrar(_recursos_de)
+    for _evento in ('after_insert', 'after_update', 'after_delete'):
+        # propagate: subclasses de ProdutoFinanceiro (Produto_Acao, Produto_RendaFixa, Produto_Fundo)
+        event.listen(_modelo, _evento, _ouvinte, propagate=True)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _incrementar_apos_flush(session, flush_context):
+    recursos = session.info.pop('versoes_alteradas', None)
+    if recursos:
+        incrementar_versoes(session.connection(), recursos)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_apos_rollback(session):
+    session.info.pop('versoes_alteradas', None)
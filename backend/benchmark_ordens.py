@@ -0,0 +1,84 @@
+import argparse
+import time
+from decimal import Decimal
+from flask_jwt_extended import create_access_token
+from app import create_app, db
+from app.models import Portfolio, Cliente
+from app.services.pricing import price_cache
+
+# Compara ordens por segundo entre os motores de execução ('orm' e 'procedure').
+# ATENÇÃO: grava ordens de verdade (compra e venda alternadas do mesmo produto, saldo e posição
+# voltam ao ponto de partida a cada par). Use apenas em um banco de desenvolvimento.
+
+
+def medir(app, motor, portfolio_id, produto_id, quantidade, preco, total, headers):
+    app.config['ORDER_EXECUTION_ENGINE'] = motor
+    client = app.test_client()
+    falhas = 0
+
+    inicio = time.perf_counter()
+    for i in range(total):
+        resposta = client.post('/ordem', headers=headers, json={
+            "portfolio_id": portfolio_id,
+            "produto_id": produto_id,
+            "tipo_ordem": "Compra" if i % 2 == 0 else "Venda",
+            "quantidade": str(quantidade),
+            "preco_unitario": str(preco)
+        })
+        if resposta.status_code != 201:
+            falhas += 1
+            if falhas == 1:
+                print(f"   Primeira falha ({motor}): {resposta.status_code} {resposta.get_json()}")
+    duracao = time.perf_counter() - inicio
+
+    return total / duracao, falhas
+
+
+def executar_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark de execução de ordens: ORM x sp_ExecutarOrdem")
+    parser.add_argument('--portfolio', type=int, required=True, help='PortfolioID de um cliente Aprovado')
+    parser.add_argument('--produto', type=int, required=True, help='ProdutoID compatível com o perfil do cliente')
+    parser.add_argument('--ordens', type=int, default=200, help='Ordens por motor (padrão: 200)')
+    parser.add_argument('--quantidade', default='1', help='Quantidade de cada ordem (padrão: 1)')
+    args = parser.parse_args()
+
+    app = create_app()
+    print("--- Benchmark de Execução de Ordens ---")
+
+    with app.app_context():
+        if db.engine.dialect.name != 'mssql':
+            print("❌ O motor 'procedure' exige SQL Server (verifique o .env). No SQLite só há o ORM.")
+            return
+
+        portfolio = Portfolio.query.get(args.portfolio)
+        if not portfolio:
+            print(f"❌ Portfólio {args.portfolio} não encontrado.")
+            return
+        assessor_id = Cliente.query.get(portfolio.ClienteID).AssessorID
+        preco = price_cache.get_price(args.produto)
+        if preco is None:
+            print(f"❌ Produto {args.produto} sem preço em PrecoAtual.")
+            return
+
+        token = create_access_token(identity=str(assessor_id), additional_claims={'role': 'assessor'})
+        headers = {'Authorization': f'Bearer {token}'}
+        total = args.ordens + args.ordens % 2  # número par: cada compra tem a sua venda
+
+        print(f"Portfólio: {args.portfolio} | Produto: {args.produto} | Preço: {preco} | Ordens por motor: {total}")
+        # Aquecimento (conexões do pool, plano da procedure, caches)
+        for motor in ('orm', 'procedure'):
+            medir(app, motor, args.portfolio, args.produto, Decimal(args.quantidade), preco, 2, headers)
+
+        resultados = {}
+        for motor in ('orm', 'procedure'):
+            por_segundo, falhas = medir(
+                app, motor, args.portfolio, args.produto, Decimal(args.quantidade), preco, total, headers)
+            resultados[motor] = por_segundo
+            print(f"{motor:>10}: {por_segundo:8.1f} ordens/s ({falhas} falhas)")
+
+        if resultados['orm'] > 0:
+            print(f"\n✅ procedure / orm = {resultados['procedure'] / resultados['orm']:.2f}x")
+
+
+if __name__ == "__main__":
+    executar_benchmark()
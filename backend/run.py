@@ -22,6 +22,7 @@ def make_shell_context():
         'Produto_RendaFixa': Produto_RendaFixa,
         'Produto_Fundo': Produto_Fundo,
         'HistoricoPreco': HistoricoPreco,
+        'PrecoAtual': PrecoAtual,
         'ComposicaoFundo': ComposicaoFundo,
         'Conta': Conta,
         'Portfolio': Portfolio,
@@ -1,6 +1,7 @@
 from app import create_app, db
 from app.models import Assessor, Cliente, ProdutoFinanceiro, Produto_Acao, Conta, Portfolio, HistoricoPreco, \
-    AuditoriaCompliance
+    AuditoriaCompliance, FaixaPerfilRisco
+from app.services.risk_profile import FAIXAS_PADRAO
 from datetime import date
 from decimal import Decimal
 
@@ -76,6 +77,14 @@ def seed():
                 db.session.add(preco)
                 print("✅ Preço do PETR4 atualizado.")
 
+        db.session.commit()
+
+        # 5. Faixas de perfil do suitability (as mesmas do script de criação do banco)
+        if not FaixaPerfilRisco.query.first():
+            for minimo, perfil in FAIXAS_PADRAO:
+                db.session.add(FaixaPerfilRisco(PontuacaoMinima=minimo, PerfilCalculado=perfil))
+            print("✅ Criadas: Faixas de perfil do suitability")
+
         db.session.commit()
         print("--- \nSUCESSO! O banco de dados está pronto para uso. ---")
 
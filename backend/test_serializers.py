@@ -0,0 +1,173 @@
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from flask import jsonify
+from app import create_app
+from app.models import (
+    Assessor, Cliente, Conta, Portfolio, Posicao, ProdutoFinanceiro, Produto_Acao,
+    Produto_RendaFixa, Produto_Fundo, GrupoEconomico, ClienteGrupoLink,
+    QuestionarioSuitabilityVersao, RespostaSuitabilityCliente
+)
+from app.schemas import (
+    produto_schema,
+    produto_acao_schema,
+    produto_rf_schema,
+    produto_fundo_schema,
+    portfolios_schema,
+    posicoes_schema,
+    clientes_schema,
+    clientes_lista_schema,
+    respostas_historico_schema
+)
+from app.serializers import compilar
+
+# Confere que os serializadores compilados (app/serializers.py) geram exatamente a mesma saída
+# dos esquemas marshmallow, tanto no dicionário quanto nos bytes do jsonify.
+# Roda com `python test_serializers.py` ou `python -m pytest test_serializers.py`.
+
+rng = random.Random(18)
+TEXTOS = ["Ação Ordinária", "Crédito Privado Ñ", "Fundo 日本", "", "a\"b\\c", "linha\nquebrada", "emoji 📈"]
+
+
+def _decimal(casas, maximo=10 ** 6):
+    valor = Decimal(rng.randint(-maximo * 10 ** casas, maximo * 10 ** casas)).scaleb(-casas)
+    return rng.choice([valor, valor, Decimal(0), Decimal("0E-8"), Decimal("1E+3"), Decimal("-0.00"), None])
+
+
+def _texto():
+    return rng.choice(TEXTOS + [None])
+
+
+def _data():
+    return rng.choice([date(2000, 1, 1) + timedelta(days=rng.randint(0, 12000)), None])
+
+
+def _data_hora():
+    return rng.choice([datetime(2020, 1, 1, 12, 30, 15, rng.choice([0, 123456])), datetime(1999, 12, 31), None])
+
+
+def _produto(produto_id):
+    classe = rng.choice([Produto_Acao, Produto_RendaFixa, Produto_Fundo, ProdutoFinanceiro])
+    produto = classe(ProdutoID=produto_id, Ticker=f"TK{produto_id}", ISIN=_texto(), NomeProduto=_texto(),
+                     NivelRiscoProduto=rng.choice([1, 5, None]), Emissor=_texto())
+    if classe is Produto_Acao:
+        produto.CNPJ_Empresa, produto.SetorAtuacao = "12345678000199", _texto()
+    elif classe is Produto_RendaFixa:
+        produto.Tipo, produto.DataVencimento = _texto(), _data()
+        produto.Indexador, produto.TaxaContratada = _texto(), _decimal(4, 100)
+    elif classe is Produto_Fundo:
+        produto.CNPJ_Fundo, produto.Gestor, produto.Administrador = "99887766000155", _texto(), _texto()
+        produto.TaxaAdm, produto.TaxaPerf = _decimal(2, 10), _decimal(2, 50)
+    else:
+        produto.ClasseAtivo = rng.choice(["Outro", "Cripto"])
+    return produto
+
+
+def _portfolio(portfolio_id, cliente_id):
+    portfolio = Portfolio(PortfolioID=portfolio_id, ClienteID=cliente_id, NomePortfolio=_texto())
+    for i in range(rng.randint(0, 4)):
+        posicao = Posicao(PosicaoID=portfolio_id * 10 + i, PortfolioID=portfolio_id, ProdutoID=i + 1,
+                          Quantidade=_decimal(8), CustoMedio=_decimal(2))
+        posicao.produto = rng.choice([_produto(i + 1), None])
+        if rng.random() < 0.7:
+            posicao.valor_mercado, posicao.resultado_financeiro = _decimal(2), _decimal(2)
+        portfolio.posicoes.append(posicao)
+    if rng.random() < 0.7:
+        portfolio.valor_mercado_total, portfolio.resultado_total_financeiro = _decimal(2), _decimal(2)
+    return portfolio
+
+
+def _cliente(cliente_id):
+    cliente = Cliente(ClienteID=cliente_id, AssessorID=1, CPF_CNPJ=f"{cliente_id:011d}", NomeCompleto=_texto(),
+                      Email=f"cliente{cliente_id}@exemplo.com", StatusCompliance=rng.choice(["Pendente", "Ativo"]),
+                      DataUltimaAtualizacao=_data_hora())
+    cliente.assessor = rng.choice([Assessor(AssessorID=1, Nome=_texto(), Email="a@exemplo.com"), None])
+    cliente.contas = [Conta(ContaID=cliente_id * 10 + i, ClienteID=cliente_id, TipoConta=_texto(), Agencia="0001",
+                            NumeroConta=f"{cliente_id}-{i}", Saldo=_decimal(2)) for i in range(rng.randint(0, 2))]
+    cliente.portfolios = [_portfolio(cliente_id * 10 + i, cliente_id) for i in range(rng.randint(0, 2))]
+    cliente.respostas_suitability = [_resposta(cliente_id * 10 + i, cliente_id) for i in range(rng.randint(0, 2))]
+    for i in range(rng.randint(0, 2)):
+        link = ClienteGrupoLink(ClienteID=cliente_id, GrupoID=i + 1, PapelNoGrupo=_texto())
+        link.grupo = GrupoEconomico(GrupoID=i + 1, NomeGrupo=_texto(), DataCriacao=_data_hora())
+        cliente.grupos.append(link)
+    return cliente
+
+
+def _resposta(resposta_id, cliente_id):
+    resposta = RespostaSuitabilityCliente(RespostaID=resposta_id, ClienteID=cliente_id, VersaoID=1,
+                                          DataResposta=_data_hora(), PontuacaoTotal=rng.randint(0, 100),
+                                          PerfilCalculado=rng.choice(["Conservador", "Moderado", "Arrojado"]))
+    resposta.versao = rng.choice([
+        QuestionarioSuitabilityVersao(VersaoID=1, DataVigencia=date(2024, 1, 1), NomeQuestionario=_texto()), None
+    ])
+    return resposta
+
+
+def _casos():
+    produtos = [_produto(i) for i in range(1, 200)]
+    portfolios = [_portfolio(i, 1) for i in range(1, 60)]
+    clientes = [_cliente(i) for i in range(1, 60)]
+    return [
+        (produto_schema, produtos),
+        (produto_acao_schema, [p for p in produtos if isinstance(p, Produto_Acao)]),
+        (produto_rf_schema, [p for p in produtos if isinstance(p, Produto_RendaFixa)]),
+        (produto_fundo_schema, [p for p in produtos if isinstance(p, Produto_Fundo)]),
+        (portfolios_schema, portfolios),
+        (posicoes_schema, [posicao for p in portfolios for posicao in p.posicoes]),
+        (clientes_schema, clientes),
+        (clientes_lista_schema, clientes),
+        (respostas_historico_schema, [r for c in clientes for r in c.respostas_suitability]),
+    ]
+
+
+def test_mesmo_dicionario_que_marshmallow():
+    for schema, dados in _casos():
+        compilado = compilar(schema)
+        if schema.many:
+            assert compilado.serializar(dados) == schema.dump(dados), type(schema).__name__
+        for item in dados:
+            esperado = schema.dump(item, many=False)
+            assert compilado.dump(item) == esperado, (type(schema).__name__, esperado)
+
+
+def test_mesmos_bytes_no_jsonify():
+    app = create_app()
+    with app.app_context():
+        for schema, dados in _casos():
+            esperado = jsonify(schema.dump(dados)).get_data()
+            assert jsonify(compilar(schema, json_nativo=True).serializar(dados)).get_data() == esperado
+            assert jsonify(compilar(schema).serializar(dados)).get_data() == esperado
+
+
+def test_json_nativo_sem_decimais():
+    def tipos(valor):
+        if isinstance(valor, dict):
+            return set().union(*map(tipos, valor.values())) if valor else set()
+        if isinstance(valor, list):
+            return set().union(*map(tipos, valor)) if valor else set()
+        return {type(valor)}
+
+    for schema, dados in _casos():
+        assert tipos(compilar(schema, json_nativo=True).serializar(dados)) <= {str, int, float, bool, type(None)}
+
+
+def test_linhas_e_dicionarios():
+    # Listagens podem vir de consultas por colunas (Row) em vez de objetos ORM
+    linhas = [{"ClienteID": i, "AssessorID": 1, "CPF_CNPJ": "1", "NomeCompleto": t, "Email": "e",
+               "StatusCompliance": "Ativo", "DataUltimaAtualizacao": None} for i, t in enumerate(TEXTOS)]
+    assert compilar(clientes_lista_schema).serializar(linhas) == clientes_lista_schema.dump(linhas)
+    parcial = [{"ClienteID": 1}]
+    assert compilar(clientes_lista_schema).serializar(parcial) == clientes_lista_schema.dump(parcial)
+
+
+if __name__ == "__main__":
+    falhas = 0
+    for nome, teste in list(globals().items()):
+        if nome.startswith("test_") and callable(teste):
+            try:
+                teste()
+                print(f"✅ {nome}")
+            except AssertionError as e:
+                falhas += 1
+                print(f"❌ {nome}: {e}")
+    raise SystemExit(1 if falhas else 0)
@@ -17,6 +17,21 @@ function safeEscape(str) {
     return str.toString().replace(/\\/g, '\\\\').replace(/'/g, "\\'");
 }
 
+// Listagens paginadas por cursor: segue o cabeçalho X-Next-Cursor até a última página.
+// Com `cursor`, continua a partir de uma página já recebida. Retorna null se alguma página falhar.
+async function fetchAllPages(path, headers, cursor = null) {
+    const itens = [];
+    const separador = path.includes('?') ? '&' : '?';
+    do {
+        const url = cursor ? `${API_URL}${path}${separador}cursor=${encodeURIComponent(cursor)}` : `${API_URL}${path}`;
+        const res = await fetch(url, { headers });
+        if (!res.ok) return null;
+        itens.push(...await res.json());
+        cursor = res.headers.get('X-Next-Cursor');
+    } while (cursor);
+    return itens;
+}
+
 async function initDashboard(role) {
     checkAuth();
 
@@ -52,7 +67,7 @@ async function initDashboard(role) {
         });
     });
 
-    if (role === 'cliente') await loadClientData();
+    if (role === 'cliente') await loadClientData(['conta', 'portfolio', 'perfil', 'produtos']);
     if (role === 'assessor') await loadAssessorData();
 }
 
@@ -70,9 +85,9 @@ function showToast(message, type = 'success') {
 // --- ASSESSOR ---
 async function loadAssessorData() {
     try {
-        const res = await fetch(`${API_URL}/clientes`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` } });
-        if (!res.ok) return;
-        const clientes = await res.json();
+        // /clientes devolve 100 por página: totais e tabela precisam de todas
+        const clientes = await fetchAllPages('/clientes', { 'Authorization': `Bearer ${localStorage.getItem('token')}` });
+        if (!clientes) return;
 
         document.getElementById('total-clientes').textContent = clientes.length || 0;
         const pendentes = clientes.filter(c => c.StatusCompliance !== 'Aprovado');
@@ -210,88 +225,91 @@ async function handleNewProduct(e) {
 // FUNÇÕES DO CLIENTE
 // ==========================================
 
-async function loadClientData() {
+// Painel do cliente: uma única requisição a /portal/dashboard com as seções pedidas.
+// Na abertura vêm todas; depois de depósitos, saques e ordens, só conta e portfólio.
+async function loadClientData(sections = ['conta', 'portfolio']) {
     try {
         const token = localStorage.getItem('token');
         const headers = { 'Authorization': `Bearer ${token}` };
 
-        const [resConta, resPort] = await Promise.all([
-            fetch(`${API_URL}/portal/minha-conta`, { headers }),
-            fetch(`${API_URL}/portal/meu-portfolio`, { headers })
-        ]);
+        const res = await fetch(`${API_URL}/portal/dashboard?sections=${sections.join(',')}`, { headers });
+        const dados = await res.json();
+        if (!res.ok) {
+            showToast('Erro de acesso à conta: ' + (dados.erro || 'Autenticação Inválida.'), 'error');
+            return;
+        }
 
-        if (resConta.ok) {
-            const conta = await resConta.json();
-            document.getElementById('saldo-val').textContent = moneyFormatter.format(conta.Saldo);
-        } else {
-             const json = await resConta.json();
-             showToast('Erro de acesso à conta: ' + (json.erro || 'Autenticação Inválida.'), 'error');
+        if (dados.conta) {
+            document.getElementById('saldo-val').textContent = moneyFormatter.format(dados.conta.Saldo);
         }
+        if (dados.portfolio) renderPortfolio(dados.portfolio);
+        if (dados.perfil) renderPerfil(dados.perfil);
+        if (dados.produtos) {
+            renderProdutos(dados.produtos);
+            // O painel traz só a primeira página do catálogo: o restante vem de /produtos
+            if (dados.produtos_proximo_cursor) {
+                const restantes = await fetchAllPages('/produtos', headers, dados.produtos_proximo_cursor);
+                if (restantes) renderProdutos(dados.produtos.concat(restantes));
+            }
+        }
+    } catch (e) { console.error(e); }
+}
 
-        if (resPort.ok) {
-            const portfolio = await resPort.json();
-            document.getElementById('patrimonio-val').textContent = moneyFormatter.format(portfolio.valor_mercado_total || 0);
-            const lucro = parseFloat(portfolio.resultado_total_financeiro || 0);
-            const elLucro = document.getElementById('lucro-val');
-            elLucro.textContent = moneyFormatter.format(lucro);
-            elLucro.style.color = lucro >= 0 ? 'var(--success)' : 'var(--danger)';
+function renderPortfolio(portfolio) {
+    document.getElementById('patrimonio-val').textContent = moneyFormatter.format(portfolio.valor_mercado_total || 0);
+    const lucro = parseFloat(portfolio.resultado_total_financeiro || 0);
+    const elLucro = document.getElementById('lucro-val');
+    elLucro.textContent = moneyFormatter.format(lucro);
+    elLucro.style.color = lucro >= 0 ? 'var(--success)' : 'var(--danger)';
 
-            // Remove títulos de simulação ao carregar dados reais
-            elLucro.removeAttribute('title');
-            document.getElementById('patrimonio-val').removeAttribute('title');
+    // Remove títulos de simulação ao carregar dados reais
+    elLucro.removeAttribute('title');
+    document.getElementById('patrimonio-val').removeAttribute('title');
 
 
-            const tbody = document.getElementById('portfolio-body');
-            if(tbody) {
-                tbody.innerHTML = '';
-                if(!portfolio.posicoes || portfolio.posicoes.length === 0) {
-                    tbody.innerHTML = '<tr><td colspan="5" style="text-align:center; padding:2rem; color:var(--text-muted)">Nenhum ativo.</td></tr>';
-                } else {
-                    portfolio.posicoes.forEach(pos => {
-                        const rentab = parseFloat(pos.resultado_financeiro);
-                        tbody.innerHTML += `
-                            <tr>
-                                <td style="color:var(--accent-gold); font-weight:600">${pos.produto.Ticker}</td>
-                                <td>${pos.produto.NomeProduto}</td>
-                                <td>${parseFloat(pos.Quantidade).toFixed(2)}</td>
-                                <td>${moneyFormatter.format(pos.valor_mercado)}</td>
-                                <td style="color:${rentab >= 0 ? 'var(--success)' : 'var(--danger)'}">${moneyFormatter.format(rentab)}</td>
-                            </tr>`;
-                    });
-                }
-            }
+    const tbody = document.getElementById('portfolio-body');
+    if(tbody) {
+        tbody.innerHTML = '';
+        if(!portfolio.posicoes || portfolio.posicoes.length === 0) {
+            tbody.innerHTML = '<tr><td colspan="5" style="text-align:center; padding:2rem; color:var(--text-muted)">Nenhum ativo.</td></tr>';
+        } else {
+            portfolio.posicoes.forEach(pos => {
+                const rentab = parseFloat(pos.resultado_financeiro);
+                tbody.innerHTML += `
+                    <tr>
+                        <td style="color:var(--accent-gold); font-weight:600">${pos.produto.Ticker}</td>
+                        <td>${pos.produto.NomeProduto}</td>
+                        <td>${parseFloat(pos.Quantidade).toFixed(2)}</td>
+                        <td>${moneyFormatter.format(pos.valor_mercado)}</td>
+                        <td style="color:${rentab >= 0 ? 'var(--success)' : 'var(--danger)'}">${moneyFormatter.format(rentab)}</td>
+                    </tr>`;
+            });
         }
-    } catch (e) { console.error(e); }
+    }
 }
 
 async function loadExtratoData() {
     try {
-        // Rota de conta simples é usada para simular o extrato
-        const resConta = await fetch(`${API_URL}/portal/minha-conta`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` } });
-        const resPort = await fetch(`${API_URL}/portal/meu-portfolio`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` } });
-
-        if (resConta.ok && resPort.ok) {
-            const conta = await resConta.json();
-            const portfolio = await resPort.json();
+        const headers = { 'Authorization': `Bearer ${localStorage.getItem('token')}` };
+        const resConta = await fetch(`${API_URL}/portal/minha-conta`, { headers });
+        if (!resConta.ok) return;
+        const conta = await resConta.json();
+
+        // Primeira página do extrato (mais recentes primeiro)
+        const resExtrato = await fetch(`${API_URL}/contas/${conta.ContaID}/extrato?limit=50`, { headers });
+        if (resExtrato.ok) {
+            const movimentacoes = await resExtrato.json();
             const tbody = document.getElementById('extrato-body');
 
             if(tbody) {
                 tbody.innerHTML = '';
-                // 1. Aporte Inicial (Fixo)
-                if (parseFloat(conta.Saldo) >= 100000 || portfolio.posicoes.length > 0) {
-                     tbody.innerHTML += `<tr><td>${new Date().toLocaleDateString('pt-BR')}</td><td>Aporte</td><td>Transferência Inicial</td><td style="color:var(--success)">+ ${moneyFormatter.format(100000.00)}</td></tr>`;
-                }
-
-                // 2. Movimentações (Simulação de Compra - Se a ordem funcionar)
-                if (portfolio.posicoes && portfolio.posicoes.length > 0) {
-                     portfolio.posicoes.forEach(pos => {
-                        // Esta é uma simulação. O valor do custo total é o gasto.
-                        const custoTotal = parseFloat(pos.Quantidade) * parseFloat(pos.CustoMedio);
-                        if (custoTotal > 0) {
-                           tbody.innerHTML += `<tr><td>${new Date().toLocaleDateString('pt-BR')}</td><td>Compra</td><td>${pos.produto.Ticker}</td><td style="color:var(--danger)">- ${moneyFormatter.format(custoTotal)}</td></tr>`;
-                        }
-                    });
+                if (movimentacoes.length === 0) {
+                    tbody.innerHTML = '<tr><td colspan="4" style="text-align:center">Nenhuma movimentação.</td></tr>';
                 }
+                movimentacoes.forEach(mov => {
+                    const credito = mov.Sentido === 'Credito';
+                    tbody.innerHTML += `<tr><td>${new Date(mov.DataHora).toLocaleDateString('pt-BR')}</td><td>${mov.TipoMovimentacao}</td><td>${mov.Status}</td><td style="color:${credito ? 'var(--success)' : 'var(--danger)'}">${credito ? '+' : '-'} ${moneyFormatter.format(mov.Valor)}</td></tr>`;
+                });
             }
         }
     } catch (e) { console.error(e); }
@@ -301,10 +319,7 @@ async function loadPerfilData() {
     try {
         const res = await fetch(`${API_URL}/portal/meu-perfil`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` } });
         if(res.ok) {
-            const perfil = await res.json();
-            document.getElementById('perfil-email').textContent = perfil.Email;
-            document.getElementById('perfil-doc').textContent = perfil.CPF_CNPJ;
-            document.getElementById('perfil-status').textContent = perfil.StatusCompliance;
+            renderPerfil(await res.json());
         } else {
              const json = await res.json();
              showToast('Erro ao carregar perfil: ' + (json.erro || 'Autenticação Inválida.'), 'error');
@@ -312,37 +327,46 @@ async function loadPerfilData() {
     } catch(e) { console.error(e); }
 }
 
+function renderPerfil(perfil) {
+    document.getElementById('perfil-email').textContent = perfil.Email;
+    document.getElementById('perfil-doc').textContent = perfil.CPF_CNPJ;
+    document.getElementById('perfil-status').textContent = perfil.StatusCompliance;
+}
+
 async function loadProdutos() {
     try {
-        const res = await fetch(`${API_URL}/produtos`, { headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` } });
-        if (!res.ok) return;
-
-        const produtos = await res.json();
-        const grid = document.getElementById('products-grid');
-        if(grid) {
-            grid.innerHTML = '';
-            produtos.forEach(prod => {
-                // CORRIGIDO: Usa PrecoAtual do backend. Se não houver, usa o mock ou 100.00 como fallback.
-                const preco = prod.PrecoAtual || PRECOS_MOCK[prod.Ticker] || 100.00;
-                grid.innerHTML += `
-                    <div class="product-card fade-in">
-                        <div class="product-header">
-                            <span class="badge badge-gold">${prod.ClasseAtivo}</span>
-                            <span class="badge" style="border:1px solid var(--text-muted); color:var(--text-muted)">Risco ${prod.NivelRiscoProduto}/5</span>
-                        </div>
-                        <h3 style="color:#fff; margin-bottom:0.5rem;">${prod.NomeProduto}</h3>
-                        <p style="color:var(--text-muted); font-size:0.9rem; margin-bottom:1rem;">${prod.Ticker} - ${prod.Emissor || 'Chicoin$'}</p>
-                        <p style="color:#fff; font-weight:bold; font-size:1.2rem; margin-bottom:1rem;">R$ ${parseFloat(preco).toFixed(2)}</p>
-                        <button class="btn-premium" style="width:100%; font-size:0.8rem" 
-                            onclick="openInvestModal(${prod.ProdutoID}, '${prod.Ticker}', ${preco})">
-                            Investir
-                        </button>
-                    </div>`;
-            });
-        }
+        const produtos = await fetchAllPages('/produtos', { 'Authorization': `Bearer ${localStorage.getItem('token')}` });
+        if (!produtos) return;
+
+        renderProdutos(produtos);
     } catch (e) { console.error(e); }
 }
 
+function renderProdutos(produtos) {
+    const grid = document.getElementById('products-grid');
+    if(grid) {
+        grid.innerHTML = '';
+        produtos.forEach(prod => {
+            // CORRIGIDO: Usa PrecoAtual do backend. Se não houver, usa o mock ou 100.00 como fallback.
+            const preco = prod.PrecoAtual || PRECOS_MOCK[prod.Ticker] || 100.00;
+            grid.innerHTML += `
+                <div class="product-card fade-in">
+                    <div class="product-header">
+                        <span class="badge badge-gold">${prod.ClasseAtivo}</span>
+                        <span class="badge" style="border:1px solid var(--text-muted); color:var(--text-muted)">Risco ${prod.NivelRiscoProduto}/5</span>
+                    </div>
+                    <h3 style="color:#fff; margin-bottom:0.5rem;">${prod.NomeProduto}</h3>
+                    <p style="color:var(--text-muted); font-size:0.9rem; margin-bottom:1rem;">${prod.Ticker} - ${prod.Emissor || 'Chicoin$'}</p>
+                    <p style="color:#fff; font-weight:bold; font-size:1.2rem; margin-bottom:1rem;">R$ ${parseFloat(preco).toFixed(2)}</p>
+                    <button class="btn-premium" style="width:100%; font-size:0.8rem" 
+                        onclick="openInvestModal(${prod.ProdutoID}, '${prod.Ticker}', ${preco})">
+                        Investir
+                    </button>
+                </div>`;
+        });
+    }
+}
+
 let selectedProdutoId = null;
 function openInvestModal(id, ticker, preco) {
     selectedProdutoId = id;